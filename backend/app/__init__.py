@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -11,3 +12,51 @@ db_connection_params = {
     "host": os.environ["DB_HOST"],
     "port": os.environ["DB_PORT"],
 }
+
+db_pool_params = {
+    "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 1)),
+    "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+    "acquire_timeout": float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", 5)),
+}
+
+notification_params = {
+    "poll_seconds": float(os.environ.get("NOTIFICATION_POLL_SECONDS", 1)),
+    "coalesce_seconds": float(os.environ.get("NOTIFICATION_COALESCE_SECONDS", 2)),
+    "batch_size": int(os.environ.get("NOTIFICATION_BATCH_SIZE", 500)),
+    "max_attempts": int(os.environ.get("NOTIFICATION_MAX_ATTEMPTS", 8)),
+}
+
+http_client_params = {
+    "max_connections": int(os.environ.get("HTTP_MAX_CONNECTIONS", 20)),
+    "max_keepalive_connections": int(os.environ.get("HTTP_MAX_KEEPALIVE", 10)),
+    "connect_timeout": float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3)),
+    "timeout": float(os.environ.get("HTTP_TIMEOUT", 10)),
+    "concurrency": int(os.environ.get("HTTP_CONCURRENCY", 20)),
+    # Per call, waiting for a connection included
+    "deadlines": {
+        "onesignal": float(os.environ.get("ONESIGNAL_DEADLINE", 5)),
+        "passwordless": float(os.environ.get("PASSWORDLESS_DEADLINE", 3)),
+    },
+    "failure_threshold": int(os.environ.get("HTTP_BREAKER_FAILURES", 5)),
+    "reset_seconds": float(os.environ.get("HTTP_BREAKER_RESET_SECONDS", 30)),
+}
+
+appuser_cache_params = {
+    "max_size": int(os.environ.get("APPUSER_CACHE_SIZE", 10000)),
+    "ttl_seconds": float(os.environ.get("APPUSER_CACHE_TTL_SECONDS", 300)),
+}
+
+query_stats_params = {
+    # Statement shapes run more often than this in one request are logged
+    "repeat_threshold": int(os.environ.get("SQL_REPEAT_THRESHOLD", 5)),
+    "log_requests": os.environ.get("SQL_LOG_REQUESTS", "true").lower() == "true",
+}
+
+profiling_params = {
+    "directory": os.environ.get(
+        "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "uptome-profiles")
+    ),
+    "interval_seconds": float(os.environ.get("PROFILE_INTERVAL_MS", 1)) / 1000,
+    # Older profiles are deleted
+    "keep": int(os.environ.get("PROFILE_KEEP", 50)),
+}
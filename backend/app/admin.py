@@ -1,11 +1,16 @@
+from enum import Enum
+
 import psycopg2
+from app import auth, card_counts, catalog, db_connector, profiler
 from app.api_classes import CardDeckInfo
-from fastapi import APIRouter, HTTPException
+from app.helpers import stream_helper
+from app.query_stats import execute_values
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 from psycopg2 import sql
 from pydantic import BaseModel
 
-from . import db_connection_params
-
 router = APIRouter()
 
 GET_DECK_FIELDS = ["iddeck", "title", "description"]
@@ -41,9 +46,9 @@ class DecksAndCardsUpdateInput(BaseModel):
 
 
 @router.get("/admin/decks/cards")
-async def get_common_decks_and_cards(external_id: str):
+def get_common_decks_and_cards(external_id: str):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
             get_query = sql.SQL(
                 "SELECT is_admin FROM appuser "
@@ -100,10 +105,170 @@ async def get_common_decks_and_cards(external_id: str):
     return {"decks": list(decks_and_cards.values())}
 
 
+# The editor's payload is staged in these and applied with one statement per
+# kind of change, however many decks and cards were edited
+STAGE_QUERY = """
+    CREATE TEMP TABLE admin_deck (
+        position INT, iddeck INT, title TEXT, description TEXT,
+        created BOOL, updated BOOL
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE admin_card (
+        position INT, idcard INT, iddeck INT, title TEXT, description TEXT,
+        created BOOL, updated BOOL
+    ) ON COMMIT DROP;
+"""
+
+# Ids are drawn in payload order in a CTE, which is evaluated once, so the
+# editor's negative ids map to the new ones. Cards of new decks are pointed
+# at them.
+INSERT_DECKS_QUERY = """
+    WITH new_deck AS (
+        SELECT iddeck AS tempid, title, description,
+        nextval(pg_get_serial_sequence('deck', 'iddeck')) AS iddeck
+        FROM (
+            SELECT * FROM admin_deck
+            WHERE iddeck < 0 AND created
+            ORDER BY position
+        ) AS created_deck
+    ),
+    inserted AS (
+        INSERT INTO deck (iddeck, title, description, updatedby, createdby)
+        SELECT iddeck, title, description, %(idappuser)s, %(idappuser)s
+        FROM new_deck
+    )
+    UPDATE admin_card SET iddeck = new_deck.iddeck
+    FROM new_deck
+    WHERE admin_card.iddeck = new_deck.tempid
+"""
+
+# Renamed decks also get their new title in the game inboxes of GET /games/
+UPDATE_DECKS_QUERY = """
+    WITH updated AS (
+        UPDATE deck
+        SET title = a.title, description = a.description, updatedby = %(idappuser)s
+        FROM admin_deck AS a
+        WHERE deck.iddeck = a.iddeck AND a.updated AND NOT (a.iddeck < 0 AND a.created)
+        RETURNING deck.iddeck, deck.title
+    )
+    UPDATE game_inbox AS i
+    SET deck_title = updated.title, updatedtime = CURRENT_TIMESTAMP
+    FROM game AS g, updated
+    WHERE i.game = g.idgame AND g.deck = updated.iddeck
+    AND i.deck_title IS DISTINCT FROM updated.title
+"""
+
+INSERT_CARDS_QUERY = """
+    WITH new_card AS (
+        SELECT iddeck, title, description,
+        nextval(pg_get_serial_sequence('card', 'idcard')) AS idcard
+        FROM (
+            SELECT * FROM admin_card
+            WHERE idcard < 0 AND created
+            ORDER BY position
+        ) AS created_card
+    ),
+    inserted AS (
+        INSERT INTO card (idcard, title, description, updatedby)
+        SELECT idcard, title, description, %(idappuser)s
+        FROM new_card
+    )
+    INSERT INTO card_deck (card, deck, updatedby)
+    SELECT idcard, iddeck, %(idappuser)s
+    FROM new_card
+    RETURNING deck
+"""
+
+UPDATE_CARDS_QUERY = """
+    UPDATE card
+    SET title = a.title, description = a.description, updatedby = %(idappuser)s
+    FROM admin_card AS a
+    WHERE card.idcard = a.idcard AND a.updated AND NOT (a.idcard < 0 AND a.created)
+"""
+
+
+def stage_deck_rows(decks: list) -> list:
+    """admin_deck rows of the editor's decks, in payload order."""
+    return [
+        (
+            position,
+            deck.iddeck,
+            deck.title,
+            deck.description,
+            deck.created,
+            deck.updated,
+        )
+        for position, deck in enumerate(decks)
+    ]
+
+
+def stage_card_rows(cards: list) -> list:
+    """admin_card rows of the editor's cards, in payload order."""
+    return [
+        (
+            position,
+            card.idcard,
+            card.iddeck,
+            card.title,
+            card.description,
+            card.created,
+            card.updated,
+        )
+        for position, card in enumerate(cards)
+    ]
+
+
+def apply_decks_and_cards(cursor, data: DecksAndCardsUpdateInput, idappuser: int):
+    """Writes the editor's changes in the caller's transaction."""
+    params = {"idappuser": idappuser}
+    new_card_decks = []
+    if data.decks or data.cards:
+        cursor.execute(STAGE_QUERY)
+
+    if data.cards:
+        execute_values(
+            cursor,
+            "INSERT INTO admin_card VALUES %s",
+            stage_card_rows(data.cards),
+            page_size=len(data.cards),
+        )
+
+    if data.decks:
+        execute_values(
+            cursor,
+            "INSERT INTO admin_deck VALUES %s",
+            stage_deck_rows(data.decks),
+            page_size=len(data.decks),
+        )
+        cursor.execute(INSERT_DECKS_QUERY, params)
+        cursor.execute(UPDATE_DECKS_QUERY, params)
+
+    if data.cards:
+        cursor.execute(INSERT_CARDS_QUERY, params)
+        new_card_decks = [(deck, None) for deck, in cursor.fetchall()]
+        cursor.execute(UPDATE_CARDS_QUERY, params)
+
+    if data.deletes.cards:
+        delete_card_query = """
+            UPDATE card SET deleted = TRUE, updatedby = %s
+            WHERE idcard IN %s
+        """
+        cursor.execute(delete_card_query, (idappuser, tuple(data.deletes.cards)))
+
+    if data.deletes.decks:
+        delete_deck_query = """
+            UPDATE deck SET deleted = TRUE, updatedby = %s
+            WHERE iddeck IN %s
+        """
+        cursor.execute(delete_deck_query, (idappuser, tuple(data.deletes.decks)))
+
+    card_counts.add(cursor, new_card_decks)
+    db_connector.catalog_changed(cursor)
+
+
 @router.post("/admin/decks/cards")
-async def update_common_decks_and_cards(data: DecksAndCardsUpdateInput):
+def update_common_decks_and_cards(data: DecksAndCardsUpdateInput):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
             get_query = sql.SQL(
                 "SELECT is_admin, idappuser FROM appuser "
@@ -114,83 +279,198 @@ async def update_common_decks_and_cards(data: DecksAndCardsUpdateInput):
             if appuser[0] is False:
                 raise HTTPException(status_code=401, detail="You are not authorized")
 
-            idappuser = appuser[1]
-            new_deck_ids = {}
-            for deck in data.decks:
-                if deck.iddeck < 0 and deck.created:
-                    insert_query = """
-                        INSERT INTO deck (title, description, updatedby, createdby)
-                        VALUES (%s, %s, %s, %s) RETURNING iddeck
-                    """
-                    cursor.execute(
-                        insert_query,
-                        (deck.title, deck.description, idappuser, idappuser),
-                    )
-                    new_deck_id = cursor.fetchone()[0]
-                    new_deck_ids[deck.iddeck] = new_deck_id
-
-                elif deck.updated:
-                    update_query = """
-                        UPDATE deck SET title = %s, description = %s, updatedby = %s
-                        WHERE iddeck = %s
-                    """
-                    cursor.execute(
-                        update_query,
-                        (deck.title, deck.description, idappuser, deck.iddeck),
-                    )
-
-            for card in data.cards:
-                if card.idcard < 0 and card.created:
-                    insert_query = """
-                        INSERT INTO card (title, description, updatedby)
-                        VALUES (%s, %s, %s) RETURNING idcard
-                    """
-                    cursor.execute(
-                        insert_query,
-                        (card.title, card.description, idappuser),
-                    )
-                    new_card_id = cursor.fetchone()[0]
-
-                    insert_card_deck_query = """
-                        INSERT INTO card_deck (card, deck, updatedby)
-                        VALUES (%s, %s, %s)
-                    """
-                    card.iddeck = new_deck_ids.get(card.iddeck, card.iddeck)
-                    cursor.execute(
-                        insert_card_deck_query,
-                        (new_card_id, card.iddeck, idappuser),
-                    )
-
-                elif card.updated:
-                    update_query = """
-                        UPDATE card SET title = %s, description = %s, updatedby = %s
-                        WHERE idcard = %s
-                    """
-                    cursor.execute(
-                        update_query,
-                        (card.title, card.description, idappuser, card.idcard),
-                    )
-
-            if data.deletes.cards:
-                delete_card_query = """
-                    UPDATE card SET deleted = TRUE, updatedby = %s
-                    WHERE idcard IN %s
-                """
-                cursor.execute(
-                    delete_card_query, (idappuser, tuple(data.deletes.cards))
-                )
-
-            if data.deletes.decks:
-                delete_deck_query = """
-                    UPDATE deck SET deleted = TRUE, updatedby = %s
-                    WHERE iddeck IN %s
-                """
-                cursor.execute(
-                    delete_deck_query, (idappuser, tuple(data.deletes.decks))
-                )
-
+            apply_decks_and_cards(cursor, data, appuser[1])
             connection.commit()
+            catalog.catalog.invalidate()
     except (Exception, psycopg2.Error) as error:
         raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
 
     return {"success": True}
+
+
+class TransferFormatEnum(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
+TRANSFER_COLUMNS = ["title", "description"]
+EXPORT_BATCH_SIZE = 2000
+
+IMPORT_STAGE_QUERY = """
+    CREATE TEMP TABLE import_card (
+        position BIGSERIAL, title TEXT, description TEXT
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE import_line (position BIGSERIAL, line TEXT) ON COMMIT DROP;
+"""
+
+# NDJSON goes in one line per row, quote and delimiter are bytes that JSON
+# text cannot contain unescaped
+IMPORT_COPY_QUERIES = {
+    TransferFormatEnum.csv: """
+        COPY import_card (title, description)
+        FROM STDIN WITH (FORMAT csv, HEADER true)
+    """,
+    TransferFormatEnum.ndjson: """
+        COPY import_line (line)
+        FROM STDIN WITH (FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02')
+    """,
+}
+
+IMPORT_LINES_QUERY = """
+    INSERT INTO import_card (title, description)
+    SELECT line::json->>'title', line::json->>'description'
+    FROM import_line
+    WHERE line IS NOT NULL AND btrim(line, e' \\r\\t') <> ''
+    ORDER BY position
+"""
+
+IMPORT_CARDS_QUERY = """
+    WITH new_card AS (
+        SELECT title, COALESCE(description, '') AS description,
+        nextval(pg_get_serial_sequence('card', 'idcard')) AS idcard
+        FROM (SELECT * FROM import_card ORDER BY position) AS imported
+    ),
+    inserted AS (
+        INSERT INTO card (idcard, title, description, updatedby, createdby)
+        SELECT idcard, title, description, %(idappuser)s, %(idappuser)s
+        FROM new_card
+    )
+    INSERT INTO card_deck (card, deck, updatedby, createdby)
+    SELECT idcard, %(iddeck)s, %(idappuser)s, %(idappuser)s
+    FROM new_card
+"""
+
+EXPORT_QUERY = """
+    SELECT c.title, c.description
+    FROM card_deck cd
+    INNER JOIN card c ON c.idcard = cd.card
+    WHERE cd.deck = %s AND cd.deleted = FALSE AND cd.appuser IS NULL
+    AND c.deleted = FALSE
+    ORDER BY cd.idcard_deck
+"""
+
+
+def get_admin(cursor, external_id: str) -> int:
+    cursor.execute(
+        "SELECT idappuser, is_admin FROM appuser "
+        "WHERE deleted = FALSE AND external_id = %s LIMIT 1",
+        (external_id,),
+    )
+    appuser = cursor.fetchone()
+    if not appuser or appuser[1] is not True:
+        raise HTTPException(status_code=401, detail="You are not authorized")
+    return appuser[0]
+
+
+def check_public_deck(cursor, iddeck: int):
+    cursor.execute(
+        "SELECT 1 FROM deck WHERE iddeck = %s AND deleted = FALSE AND appuser IS NULL",
+        (iddeck,),
+    )
+    if not cursor.fetchone():
+        raise HTTPException(status_code=404, detail="Deck not found")
+
+
+def import_cards(iddeck: int, external_id: str, format: TransferFormatEnum, body):
+    with db_connector.get_connection() as connection:
+        cursor = connection.cursor()
+        idappuser = get_admin(cursor, external_id)
+        check_public_deck(cursor, iddeck)
+
+        cursor.execute(IMPORT_STAGE_QUERY)
+        cursor.copy_expert(IMPORT_COPY_QUERIES[format], body)
+        if format == TransferFormatEnum.ndjson:
+            cursor.execute(IMPORT_LINES_QUERY)
+
+        cursor.execute(
+            "SELECT COUNT(1) FROM import_card WHERE title IS NULL OR title = ''"
+        )
+        if cursor.fetchone()[0]:
+            raise HTTPException(status_code=422, detail="Every card needs a title")
+
+        cursor.execute(IMPORT_CARDS_QUERY, {"idappuser": idappuser, "iddeck": iddeck})
+        imported = cursor.rowcount
+        card_counts.add(cursor, [(iddeck, None)], imported)
+        db_connector.catalog_changed(cursor)
+        connection.commit()
+
+    catalog.catalog.invalidate()
+    return imported
+
+
+@router.post("/admin/decks/{iddeck}/import")
+async def import_deck_cards(
+    iddeck: int,
+    external_id: str,
+    request: Request,
+    format: TransferFormatEnum = TransferFormatEnum.csv,
+):
+    """Adds the cards of a CSV (title,description) or NDJSON upload to a deck.
+
+    The body is streamed into COPY, all cards are added or none are.
+    """
+    body = stream_helper.StreamReader(request.stream())
+    try:
+        imported = await run_in_threadpool(
+            import_cards, iddeck, external_id, format, body
+        )
+    except psycopg2.DataError as error:
+        raise HTTPException(status_code=422, detail=f"Invalid import: {str(error)}")
+    except psycopg2.Error as error:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
+
+    return {"success": True, "imported": imported}
+
+
+def export_cards(iddeck: int, format: TransferFormatEnum):
+    with db_connector.get_connection() as connection:
+        # Named, so rows are fetched from the server in batches
+        cursor = connection.cursor(name=f"deck_export_{iddeck}")
+        cursor.itersize = EXPORT_BATCH_SIZE
+        cursor.execute(EXPORT_QUERY, (iddeck,))
+
+        if format == TransferFormatEnum.csv:
+            yield stream_helper.format_rows([TRANSFER_COLUMNS], [], format)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            yield stream_helper.format_rows(rows, TRANSFER_COLUMNS, format)
+
+
+@router.get("/admin/decks/{iddeck}/export")
+def export_deck_cards(
+    iddeck: int, external_id: str, format: TransferFormatEnum = TransferFormatEnum.csv
+):
+    try:
+        with db_connector.get_connection() as connection:
+            cursor = connection.cursor()
+            get_admin(cursor, external_id)
+            check_public_deck(cursor, iddeck)
+    except psycopg2.Error as error:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
+
+    media_types = {
+        TransferFormatEnum.csv: "text/csv",
+        TransferFormatEnum.ndjson: "application/x-ndjson",
+    }
+    return StreamingResponse(
+        export_cards(iddeck, format),
+        media_type=media_types[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="deck-{iddeck}.{format.value}"'
+        },
+    )
+
+
+@router.get("/admin/profiles/{name}")
+def get_profile(name: str, identity: auth.Identity = Depends(auth.get_identity)):
+    """A request profile stored by app.profiler, named in X-Profile-File."""
+    if not identity or auth.ADMIN_ROLE not in identity.roles:
+        raise HTTPException(status_code=401, detail="You are not authorized")
+
+    path = profiler.profile_path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "application/json" if name.endswith(".json") else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=name)
@@ -1,14 +1,45 @@
 import os
+from contextlib import asynccontextmanager
 
 from app.passwordless_login import passwordless_api
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 
-from . import admin, appuser, card, deck, friendship, game
+from . import (
+    admin,
+    appuser,
+    card,
+    catalog,
+    db_connector,
+    deck,
+    events,
+    friendship,
+    game,
+    http_client,
+    metrics,
+    notifications,
+    profiler,
+    query_stats,
+)
 from .passwordless_login.passwordless_bp import PasswordlessApiBlueprint
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db_connector.open_pool()
+    await events.broker.start()
+    catalog.catalog.load()
+    await http_client.client.start()
+    await notifications.worker.start()
+    yield
+    await notifications.worker.stop()
+    await http_client.client.stop()
+    await events.broker.stop()
+    db_connector.close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "https://up-to-me.onrender.com",
     "http://localhost:3000",
@@ -17,7 +48,8 @@ origins = [
 
 
 async def api_key_validation(request: Request, call_next):
-    if request.method == "OPTIONS":
+    # Scrapers are checked by get_metrics
+    if request.method == "OPTIONS" or request.scope["path"] == metrics.METRICS_PATH:
         return await call_next(request)
 
     api_key = request.headers.get("x-api-key", None)
@@ -33,15 +65,20 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["x-api-key"],
+    allow_headers=["x-api-key", "authorization", "x-profile"],
+    expose_headers=["x-profile-file"],
 )
 app.middleware("http")(api_key_validation)
+app.middleware("http")(query_stats.record_queries)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiler.ProfilingMiddleware)
 
 app.include_router(card.router)
 app.include_router(deck.router)
 app.include_router(appuser.router)
 app.include_router(friendship.router)
 app.include_router(game.router)
+app.include_router(events.router)
 app.include_router(admin.router)
 app.include_router(passwordless_api.router)
 
@@ -51,3 +88,9 @@ api_bp = PasswordlessApiBlueprint(app)
 @app.get("/", tags=["root"])
 async def read_root() -> dict:
     return {"message": "Testing root"}
+
+
+@app.get(metrics.METRICS_PATH, tags=["root"], include_in_schema=False)
+async def get_metrics(request: Request) -> Response:
+    metrics.check_scraper(request)
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -20,6 +20,7 @@ class Game(BaseModel):
     started: bool = False
     wildcards_count: int
     skips_count: int
+    version: int = 0
 
     @classmethod
     def from_tuple(cls, data_tuple):
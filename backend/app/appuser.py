@@ -4,8 +4,6 @@ from fastapi import APIRouter, HTTPException
 from psycopg2 import sql
 from pydantic import BaseModel
 
-from . import db_connection_params
-
 router = APIRouter()
 
 
@@ -19,10 +17,10 @@ class AppUserInput(BaseModel):
 
 
 @router.get("/appusers/")
-async def get_appusers():
+def get_appusers():
     appusers: list = []
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
             cursor.execute("SELECT idappuser, email, firstname, lastname FROM appuser")
             appusers = cursor.fetchall()
@@ -43,9 +41,9 @@ async def get_appusers():
 
 
 @router.get("/appuser/")
-async def get_appuser(external_id: str):
+def get_appuser(external_id: str):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
 
             get_query = sql.SQL(
@@ -116,9 +114,9 @@ async def get_appuser(external_id: str):
 
 
 @router.get("/appuser/search")
-async def search_appuser(term: str, external_id: str):
+def search_appuser(term: str, external_id: str):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
 
             get_query = sql.SQL(
@@ -164,9 +162,9 @@ async def search_appuser(term: str, external_id: str):
 
 
 @router.post("/appuser/")
-async def create_appuser(data: AppUserInput):
+def create_appuser(data: AppUserInput):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
 
             get_query = sql.SQL(
@@ -206,9 +204,9 @@ async def create_appuser(data: AppUserInput):
 
 
 @router.put("/appuser/")
-async def update_appuser(data: AppUserInput):
+def update_appuser(data: AppUserInput):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
 
             get_query = sql.SQL(
@@ -227,6 +225,12 @@ async def update_appuser(data: AppUserInput):
                 raise HTTPException(
                     status_code=400, detail="Username already registered"
                 )
+            get_query = sql.SQL(
+                "SELECT idappuser, username FROM appuser WHERE external_id = %s"
+            )
+            cursor.execute(get_query, (data.userid,))
+            appuser = cursor.fetchone()
+
             update_query = sql.SQL(
                 "UPDATE appuser SET username = %s, email = %s, firstname = %s, "
                 "lastname = %s, onesignal_id = %s "
@@ -243,6 +247,24 @@ async def update_appuser(data: AppUserInput):
                     data.userid,
                 ),
             )
+            if appuser:
+                db_connector.appuser_changed(cursor, appuser[0])
+
+            if appuser and appuser[1] != data.username:
+                # Other players list this user by name in their game inbox
+                update_inbox_query = sql.SQL(
+                    """
+                    UPDATE game_inbox
+                    SET participants = array_replace(participants, %s, %s),
+                    updatedtime = CURRENT_TIMESTAMP
+                    WHERE game IN (SELECT game FROM game_appuser WHERE appuser = %s)
+                    AND appuser != %s
+                    """
+                )
+                cursor.execute(
+                    update_inbox_query,
+                    (appuser[1], data.username, appuser[0], appuser[0]),
+                )
             connection.commit()
 
     except psycopg2.Error as error:
@@ -253,7 +275,7 @@ async def update_appuser(data: AppUserInput):
 
 
 @router.delete("/appuser/")
-async def delete_appuser(idappuser: int, external_id: str):
+def delete_appuser(idappuser: int, external_id: str):
     try:
         db_connector.delete_object(
             table="appuser", idobject=idappuser, external_id=external_id
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class AppUserCache:
+    """Bounded LRU cache of appuser rows for the db_connector lookups.
+
+    Rows are cached by external_id and by username and kept for ttl_seconds
+    at most. Changes to a user invalidate its rows on every worker through
+    a NOTIFY on db_connector.APPUSER_CHANGES_CHANNEL, the TTL bounds how
+    stale a row can get if a notification is missed.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 300.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evicted": 0,
+            "invalidated": 0,
+        }
+
+    def get(self, key: tuple):
+        with self._lock:
+            cached = self._rows.get(key)
+            if cached is None:
+                self._counters["misses"] += 1
+                return None
+
+            row, expires = cached
+            if expires <= time.monotonic():
+                del self._rows[key]
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None
+
+            self._rows.move_to_end(key)
+            self._counters["hits"] += 1
+            return row
+
+    def put(self, key: tuple, row: tuple):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._rows[key] = (row, time.monotonic() + self.ttl_seconds)
+            self._rows.move_to_end(key)
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+                self._counters["evicted"] += 1
+
+    def invalidate(self, idappuser: int):
+        with self._lock:
+            keys = [key for key, (row, _) in self._rows.items() if row[0] == idappuser]
+            for key in keys:
+                del self._rows[key]
+            self._counters["invalidated"] += len(keys)
+
+    def on_notify(self, payload: str):
+        try:
+            self.invalidate(int(payload))
+        except ValueError:
+            print("Invalid appuser change payload:", payload)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "size": len(self._rows),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                **self._counters,
+                "hit_ratio": round(self._counters["hits"] / lookups, 3)
+                if lookups
+                else None,
+            }
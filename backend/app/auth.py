@@ -0,0 +1,67 @@
+from typing import List, Optional
+
+import jwt
+from app.helpers import jwt_helper
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import BaseModel
+
+ADMIN_ROLE = "Admin"
+
+bearer = HTTPBearer(auto_error=False)
+
+
+class Identity(BaseModel):
+    external_id: str
+    idappuser: Optional[int] = None
+    username: Optional[str] = None
+    roles: List[str] = []
+
+    def check(self, external_id: Optional[str]):
+        if external_id and external_id != self.external_id:
+            raise HTTPException(status_code=403, detail="Token is for another user")
+
+
+def get_identity(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer),
+) -> Optional[Identity]:
+    """The caller from the login JWT in the Authorization header, if one is sent.
+
+    The token is verified here, without a database round trip. Requests
+    without one get None and handlers look the user up by external_id, as
+    do tokens issued before logins carried an expiry and the idappuser.
+    """
+    if credentials is None:
+        return None
+
+    try:
+        claims = jwt_helper.decode_jwt(credentials.credentials)
+    except jwt.MissingRequiredClaimError as error:
+        claims = jwt_helper.decode_jwt(credentials.credentials, require_exp=False)
+        if claims.get("idappuser") is None:
+            return None
+        raise HTTPException(status_code=401, detail=f"Invalid token: {error}")
+    except jwt.InvalidTokenError as error:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {error}")
+
+    return Identity(
+        external_id=claims["user_id"],
+        idappuser=claims.get("idappuser"),
+        username=claims.get("username"),
+        roles=claims.get("roles", []),
+    )
+
+
+def appuser_filter(identity: Optional[Identity], external_id: str):
+    """SQL for the caller's idappuser and its parameter.
+
+    The id from the token when there is one, else a subquery on external_id,
+    so queries that only need the id do not need a lookup of their own.
+    """
+    if identity and identity.idappuser is not None:
+        identity.check(external_id)
+        return "%s", identity.idappuser
+    return (
+        "(SELECT idappuser FROM appuser WHERE external_id = %s LIMIT 1)",
+        external_id,
+    )
@@ -1,13 +1,11 @@
 from typing import Optional
 
 import psycopg2
-from app import db_connector
-from fastapi import APIRouter, HTTPException, Query
+from app import auth, card_counts, catalog, db_connector
+from fastapi import APIRouter, Depends, HTTPException, Query
 from psycopg2 import sql
 from pydantic import BaseModel
 
-from . import db_connection_params
-
 router = APIRouter()
 GET_CARD_FIELDS = ["idcard_deck", "title", "description"]
 
@@ -27,39 +25,48 @@ def map_card(sql_card: list):
     }
 
 
+USER_CARDS_QUERY = """
+    SELECT cd.idcard_deck, cd.deck, c.title, c.description, cd.wildcard
+    FROM card_deck cd
+    LEFT JOIN card c ON c.idcard = cd.card
+    WHERE cd.deleted = FALSE AND cd.appuser = {appuser}
+    AND (cd.card IS NULL OR c.deleted = FALSE)
+"""
+
+
 @router.get("/cards/")
-async def get_cards(
-    external_id: Optional[str] = Query(None), iddeck: Optional[int] = Query(None)
+def get_cards(
+    external_id: Optional[str] = Query(None),
+    iddeck: Optional[int] = Query(None),
+    identity: auth.Identity = Depends(auth.get_identity),
 ):
-    cards: list = []
-    query = f"SELECT idcard_deck, card.title, card.description"
-    params = []
-
-    if external_id:
-        query += ", (appuser.external_id IS NOT NULL) AS usercard, cd.wildcard "
-        query += "FROM card_deck cd "
-        query += "LEFT JOIN card ON card.idcard = cd.card "
-        query += "LEFT JOIN deck d ON d.iddeck = cd.deck "
-        query += "LEFT JOIN appuser ON cd.appuser = appuser.idappuser "
-        query += "WHERE (appuser.external_id = %s OR card.appuser IS NULL) "
-        params.append(external_id)
-    else:
-        query += ", false AS usercard FROM card "
-
-    if iddeck:
-        query += (" AND " if "WHERE" in query else " WHERE ") + "cd.deck = %s "
-        "AND d.hidden = FALSE "
-        params.append(iddeck)
-
-    query += (
-        " AND " if "WHERE" in query else " WHERE "
-    ) + "(cd.card IS NULL OR card.deleted = FALSE) AND cd.deleted = FALSE "
-
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
-            cursor = connection.cursor()
-            cursor.execute(query, params)
-            cards = cursor.fetchall()
+        cards = [
+            (idcard_deck, title, description, False, wildcard)
+            for idcard_deck, _, title, description, wildcard in catalog.catalog.cards(
+                iddeck
+            )
+        ]
+        if external_id:
+            appuser, appuser_param = auth.appuser_filter(identity, external_id)
+            query = USER_CARDS_QUERY.format(appuser=appuser)
+            params = [appuser_param]
+            if iddeck:
+                query += "AND cd.deck = %s"
+                params.append(iddeck)
+
+            with db_connector.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(sql.SQL(query), params)
+                cards = sorted(
+                    cards
+                    + [
+                        (idcard_deck, title, description, True, wildcard)
+                        for idcard_deck, _, title, description, wildcard in (
+                            cursor.fetchall()
+                        )
+                    ]
+                )
 
     except (Exception, psycopg2.Error) as error:
         raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
@@ -68,19 +75,13 @@ async def get_cards(
 
 
 @router.post("/card/")
-async def create_card(data: CreateCardInput):
+def create_card(
+    data: CreateCardInput, identity: auth.Identity = Depends(auth.get_identity)
+):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
-            get_query = sql.SQL(
-                "SELECT idappuser FROM appuser WHERE external_id = %s LIMIT 1"
-            )
-            cursor.execute(get_query, (data.external_id,))
-            appuser = cursor.fetchone()
-            if not appuser:
-                raise HTTPException(status_code=422, detail="User not found")
-
-            idappuser = appuser[0]
+            idappuser, _ = db_connector.get_appuser(cursor, data.external_id, identity)
             if not data.wildcard:
                 insert_query = sql.SQL(
                     "INSERT INTO card (title, description, appuser, updatedby) VALUES ({}) RETURNING idcard"
@@ -105,6 +106,7 @@ async def create_card(data: CreateCardInput):
                     insert_query,
                     (idcard, data.deck, data.wildcard, idappuser, idappuser),
                 )
+                card_counts.add(cursor, [(data.deck, idappuser)])
                 connection.commit()
 
     except (Exception, psycopg2.Error) as error:
@@ -115,10 +117,17 @@ async def create_card(data: CreateCardInput):
 
 
 @router.delete("/card_deck/")
-async def delete_card_deck(idcard_deck: int, external_id: str):
+def delete_card_deck(
+    idcard_deck: int,
+    external_id: str,
+    identity: auth.Identity = Depends(auth.get_identity),
+):
     try:
         db_connector.delete_object(
-            table="card_deck", idobject=idcard_deck, external_id=external_id
+            table="card_deck",
+            idobject=idcard_deck,
+            external_id=external_id,
+            identity=identity,
         )
 
     except (Exception, psycopg2.Error) as error:
@@ -129,10 +138,17 @@ async def delete_card_deck(idcard_deck: int, external_id: str):
 
 
 @router.delete("/card/")
-async def delete_card(idcard: int, external_id: str):
+def delete_card(
+    idcard: int,
+    external_id: str,
+    identity: auth.Identity = Depends(auth.get_identity),
+):
     try:
         db_connector.delete_object(
-            table="card", idobject=idcard, external_id=external_id
+            table="card",
+            idobject=idcard,
+            external_id=external_id,
+            identity=identity,
         )
 
     except (Exception, psycopg2.Error) as error:
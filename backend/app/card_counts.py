@@ -0,0 +1,85 @@
+"""Maintained card counts per deck and owner, see deck_card_count.
+
+The card_deck write endpoints call add() in their transaction. Running
+
+    python -m app.card_counts
+
+recounts every deck from card_deck and fixes the counts that drifted.
+"""
+import argparse
+from collections import Counter
+
+import psycopg2
+from app import db_connection_params
+from app.query_stats import execute_values
+
+ADD_QUERY = """
+    INSERT INTO deck_card_count (deck, appuser, card_count)
+    VALUES %s
+    ON CONFLICT (deck, COALESCE(appuser, 0))
+    DO UPDATE SET card_count = deck_card_count.card_count + EXCLUDED.card_count
+"""
+
+# Returns how many counts were wrong, missing or left over
+REPAIR_QUERY = """
+    WITH actual AS (
+        SELECT deck, appuser, COUNT(1) AS card_count
+        FROM card_deck
+        WHERE deleted = FALSE AND deck IS NOT NULL
+        GROUP BY deck, appuser
+    ),
+    fixed AS (
+        INSERT INTO deck_card_count (deck, appuser, card_count)
+        SELECT deck, appuser, card_count FROM actual
+        ON CONFLICT (deck, COALESCE(appuser, 0))
+        DO UPDATE SET card_count = EXCLUDED.card_count
+        WHERE deck_card_count.card_count <> EXCLUDED.card_count
+        RETURNING 1
+    ),
+    removed AS (
+        DELETE FROM deck_card_count AS n
+        WHERE n.card_count <> 0 AND NOT EXISTS (
+            SELECT 1 FROM actual AS a
+            WHERE a.deck = n.deck AND a.appuser IS NOT DISTINCT FROM n.appuser
+        )
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(1) FROM fixed) + (SELECT COUNT(1) FROM removed)
+"""
+
+
+def add(cursor, keys: list, delta: int = 1):
+    """Adds delta to the count of every (deck, appuser) in keys.
+
+    Increments rather than recounts, so concurrent writers to a deck cannot
+    overwrite each other's counts.
+    """
+    counts = Counter(key for key in keys if key[0] is not None)
+    if counts:
+        execute_values(
+            cursor,
+            ADD_QUERY,
+            [
+                (deck, appuser, count * delta)
+                for (deck, appuser), count in counts.items()
+            ],
+        )
+
+
+def repair(cursor) -> int:
+    cursor.execute(REPAIR_QUERY)
+    return cursor.fetchone()[0]
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__.splitlines()[0]).parse_args()
+    connection = psycopg2.connect(**db_connection_params)
+    try:
+        with connection:
+            print(f"Repaired {repair(connection.cursor())} deck card counts")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import threading
+
+from app import db_connector, events
+
+PUBLIC_DECKS_QUERY = """
+    SELECT d.iddeck, d.title, d.description, d.hidden, COALESCE(n.card_count, 0)
+    FROM deck d
+    LEFT JOIN deck_card_count n ON n.deck = d.iddeck AND n.appuser IS NULL
+    WHERE d.deleted = FALSE AND d.appuser IS NULL
+    ORDER BY d.iddeck
+"""
+
+PUBLIC_CARDS_QUERY = """
+    SELECT cd.idcard_deck, cd.deck, c.title, c.description, cd.wildcard
+    FROM card_deck cd
+    LEFT JOIN card c ON c.idcard = cd.card
+    WHERE cd.deleted = FALSE AND cd.appuser IS NULL
+    AND (cd.card IS NULL OR (c.deleted = FALSE AND c.appuser IS NULL))
+    ORDER BY cd.idcard_deck
+"""
+
+
+class Catalog:
+    """The public decks and cards, which are the same for every user.
+
+    Loaded in the app lifespan and read from memory by get_decks and
+    get_cards. Admin changes send a NOTIFY on
+    db_connector.CATALOG_CHANGES_CHANNEL, which marks the catalog stale on
+    every worker, and the next read loads it again.
+    """
+
+    def __init__(self):
+        self._data = ([], [])
+        self._stale = True
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def decks(self, hidden: bool = True) -> list:
+        """(iddeck, title, description, hidden, cardcount) of public decks."""
+        decks, _ = self._current()
+        return [deck for deck in decks if hidden or not deck[3]]
+
+    def cards(self, iddeck: int = None) -> list:
+        """(idcard_deck, iddeck, title, description, wildcard) of public cards."""
+        _, cards = self._current()
+        return [card for card in cards if iddeck is None or card[1] == iddeck]
+
+    def invalidate(self, payload: str = None):
+        self._stale = True
+
+    def load(self):
+        # Cleared first, so a change committed while loading is not missed
+        self._stale = False
+        try:
+            with db_connector.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(PUBLIC_DECKS_QUERY)
+                decks = cursor.fetchall()
+                cursor.execute(PUBLIC_CARDS_QUERY)
+                cards = cursor.fetchall()
+        except BaseException:
+            self._stale = True
+            raise
+
+        self._data = (decks, cards)
+        self.loads += 1
+
+    def stats(self) -> dict:
+        return {
+            "decks": len(self._data[0]),
+            "cards": len(self._data[1]),
+            "stale": self._stale,
+            "loads": self.loads,
+        }
+
+    def _current(self):
+        if self._stale:
+            with self._lock:
+                if self._stale:
+                    self.load()
+        return self._data
+
+
+catalog = Catalog()
+events.broker.listen(
+    db_connector.CATALOG_CHANGES_CHANNEL, catalog.invalidate, reset=catalog.invalidate
+)
@@ -1,70 +1,133 @@
+from contextlib import contextmanager
+
 import psycopg2
 from fastapi import HTTPException
 from psycopg2 import sql
 
-from . import db_connection_params
+from . import appuser_cache_params, card_counts, db_connection_params, db_pool_params
+from .appuser_cache import AppUserCache
+from .db_pool import ConnectionPool
+from .query_stats import InstrumentedCursor
+
+APPUSER_CHANGES_CHANNEL = "appuser_changes"
+CATALOG_CHANGES_CHANNEL = "catalog_changes"
+# Tables whose public rows (appuser IS NULL) are in the deck and card catalog
+CATALOG_TABLES = ["deck", "card", "card_deck"]
+
+# Request connections count their statements in app.query_stats
+connection_params = {**db_connection_params, "cursor_factory": InstrumentedCursor}
+
+pool: ConnectionPool = None
+appuser_cache = AppUserCache(**appuser_cache_params)
+
+
+def open_pool():
+    global pool
+    pool = ConnectionPool(connection_params, **db_pool_params)
+    pool.open()
+    return pool
+
+
+def close_pool():
+    global pool
+    if pool:
+        pool.close()
+    pool = None
 
 
-def delete_object(table: str, idobject: int, external_id: int):
-    with psycopg2.connect(**db_connection_params) as connection:
+def pool_stats():
+    return pool.stats() if pool else {}
+
+
+@contextmanager
+def get_connection():
+    if pool and not pool.closed:
+        with pool.connection() as connection:
+            yield connection
+        return
+
+    # No pool outside the app lifespan (scripts, TestClient without `with`)
+    connection = psycopg2.connect(**connection_params)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def delete_object(table: str, idobject: int, external_id: int, identity=None):
+    with get_connection() as connection:
         cursor = connection.cursor()
+        idappuser, _ = get_appuser(cursor, external_id, identity)
 
-        get_query = sql.SQL(
-            "SELECT idappuser FROM appuser WHERE deleted = FALSE AND external_id = %s LIMIT 1"
+        delete_query = (
+            f"UPDATE {table} SET deleted = TRUE, updatedby = %s "
+            f"WHERE id{table} = %s AND deleted = FALSE"
         )
-        cursor.execute(get_query, (external_id,))
-        appuser = cursor.fetchone()
+        if table in CATALOG_TABLES:
+            deck = "deck" if table == "card_deck" else "NULL"
+            delete_query += f" RETURNING appuser, {deck}"
+
+        cursor.execute(sql.SQL(delete_query), (idappuser, idobject))
+        deleted = cursor.fetchone() if table in CATALOG_TABLES else None
+        if table == "appuser":
+            appuser_changed(cursor, idobject)
+        if deleted and deleted[0] is None:
+            catalog_changed(cursor)
+        if deleted and table == "card_deck":
+            card_counts.add(cursor, [(deleted[1], deleted[0])], -1)
+        connection.commit()
 
-        if not appuser:
-            raise HTTPException(status_code=422, detail="User not found")
 
-        idappuser = appuser[0]
+def get_appuser(cursor, external_id: str, identity=None):
+    """The (idappuser, username) of a user, from the caller's token if it has them."""
+    if identity and identity.idappuser is not None:
+        identity.check(external_id)
+        return identity.idappuser, identity.username
 
-        delete_query = sql.SQL(
-            f"UPDATE {table} SET deleted = TRUE, updatedby = %s WHERE id{table} = %s"
-        )
+    idappuser, username, _ = find_appuser(cursor, "external_id", external_id)
+    return idappuser, username
 
-        cursor.execute(delete_query, (idappuser, idobject))
-        connection.commit()
 
+def get_appuser_by_email(cursor, email: str):
+    idappuser, _, onesignal_id = find_appuser(cursor, "username", email)
+    return idappuser, onesignal_id
 
-def get_appuser(cursor, external_id: str):
-    get_query = sql.SQL(
-        "SELECT idappuser, username FROM appuser "
-        "WHERE deleted = FALSE AND external_id = %s LIMIT 1"
-    )
-    cursor.execute(get_query, (external_id,))
-    appuser = cursor.fetchone()
 
-    if not appuser:
-        raise HTTPException(status_code=422, detail="User not found")
+def get_appuser_by_username(cursor, username: str):
+    idappuser, _, onesignal_id = find_appuser(cursor, "username", username)
+    return idappuser, onesignal_id
 
-    return appuser[0], appuser[1]
 
+def find_appuser(cursor, column: str, value: str):
+    """The (idappuser, username, onesignal_id) of a user, cached per worker."""
+    appuser = appuser_cache.get((column, value))
+    if appuser is not None:
+        return appuser
 
-def get_appuser_by_email(cursor, email: str):
     get_query = sql.SQL(
-        "SELECT idappuser, onesignal_id "
-        "FROM appuser WHERE deleted = FALSE AND username = %s LIMIT 1"
+        "SELECT idappuser, username, onesignal_id FROM appuser "
+        f"WHERE deleted = FALSE AND {column} = %s LIMIT 1"
     )
-    cursor.execute(get_query, (email,))
+    cursor.execute(get_query, (value,))
     appuser = cursor.fetchone()
 
     if not appuser:
         raise HTTPException(status_code=422, detail="User not found")
 
-    return appuser[0], appuser[1]
+    appuser = tuple(appuser)
+    appuser_cache.put((column, value), appuser)
+    return appuser
 
 
-def get_appuser_by_username(cursor, username: str):
-    get_query = sql.SQL(
-        "SELECT idappuser, onesignal_id "
-        "FROM appuser WHERE deleted = FALSE AND username = %s LIMIT 1"
+def appuser_changed(cursor, idappuser: int):
+    """Drops the user's cached rows here now and on every worker on commit."""
+    appuser_cache.invalidate(idappuser)
+    cursor.execute(
+        sql.SQL("SELECT pg_notify(%s, %s)"), (APPUSER_CHANGES_CHANNEL, str(idappuser))
     )
-    cursor.execute(get_query, (username,))
-    appuser = cursor.fetchone()
 
-    if not appuser:
-        raise HTTPException(status_code=422, detail="User not found")
 
-    return appuser[0], appuser[1]
+def catalog_changed(cursor):
+    """Reloads the public deck and card catalog on every worker on commit."""
+    cursor.execute(sql.SQL("SELECT pg_notify(%s, '')"), (CATALOG_CHANGES_CHANNEL,))
@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+
+class PoolTimeoutError(PoolError):
+    pass
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections.
+
+    Unlike psycopg2.pool it keeps every returned connection up to max_size
+    instead of closing the ones above min_size, and lets callers wait up to
+    acquire_timeout seconds for a free connection instead of failing at once.
+    """
+
+    def __init__(
+        self,
+        connection_params: dict,
+        min_size: int = 1,
+        max_size: int = 10,
+        acquire_timeout: float = 5.0,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size")
+
+        self.connection_params = connection_params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+
+        self._idle = deque()
+        self._size = 0
+        self._waiting = 0
+        self._closed = True
+        self._condition = threading.Condition()
+        self._counters = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "acquired": 0,
+            "acquire_timeouts": 0,
+            "acquire_wait_seconds": 0.0,
+        }
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def open(self):
+        with self._condition:
+            self._closed = False
+            missing = max(0, self.min_size - self._size)
+            self._size += missing
+
+        for _ in range(missing):
+            self.putconn(self._connect())
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.popleft())
+            self._condition.notify_all()
+
+    def getconn(self, timeout: float = None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        connection = None
+
+        with self._condition:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolError("Connection pool is closed")
+                    if self._idle:
+                        connection = self._idle.pop()
+                        if not connection.closed:
+                            break
+                        self._discard(connection)
+                        connection = None
+                        continue
+                    if self._size < self.max_size:
+                        # Reserve the slot here and connect outside the lock
+                        self._size += 1
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["acquire_timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available after {timeout}s"
+                        )
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+        if connection is None:
+            connection = self._connect()
+
+        with self._condition:
+            self._counters["acquired"] += 1
+            self._counters["acquire_wait_seconds"] += time.monotonic() - started
+        return connection
+
+    def putconn(self, connection, discard: bool = False):
+        with self._condition:
+            if discard or self._closed or connection.closed:
+                self._discard(connection)
+            else:
+                status = connection.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    self._discard(connection)
+                else:
+                    if status != extensions.TRANSACTION_STATUS_IDLE:
+                        connection.rollback()
+                    self._idle.append(connection)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        connection = self.getconn(timeout)
+        discard = False
+        try:
+            yield connection
+            connection.commit()
+        except psycopg2.InterfaceError:
+            discard = True
+            raise
+        except BaseException:
+            if not connection.closed:
+                connection.rollback()
+            raise
+        finally:
+            self.putconn(connection, discard=discard)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "acquire_timeout": self.acquire_timeout,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                **self._counters,
+            }
+
+    def _connect(self):
+        # The caller has already reserved a slot in self._size
+        try:
+            connection = psycopg2.connect(**self.connection_params)
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._counters["connections_created"] += 1
+        return connection
+
+    def _discard(self, connection):
+        self._size -= 1
+        self._counters["connections_closed"] += 1
+        if not connection.closed:
+            connection.close()
@@ -0,0 +1,124 @@
+import secrets
+from typing import List, Optional
+
+import numpy as np
+
+ALL = "all"
+DEAL = "deal"
+CUSTOM = "custom"
+
+# The shuffle a game is dealt with, stored on its row so lazily dealt games
+# keep their hands when the shuffle changes.
+# 1: the Generator's permutation and permuted, which games were dealt with
+#    before the version was stored
+# 2: sort keys from the raw PCG64 stream, which NumPy keeps the same across
+#    releases unlike the Generator methods
+DEAL_VERSION = 2
+
+
+def hand_size(
+    gamemode: str, card_count: int, player_count: int, cards_per_player: Optional[int]
+) -> int:
+    if gamemode == ALL:
+        return card_count
+    if gamemode == DEAL:
+        return cards_per_player or card_count // player_count
+    if gamemode == CUSTOM:
+        return min(cards_per_player or card_count, card_count)
+    raise ValueError(f"Unknown game mode {gamemode}")
+
+
+def deal(
+    gamemode: str,
+    card_count: int,
+    player_count: int,
+    seed: int,
+    cards_per_player: Optional[int] = None,
+    wildcards: int = 0,
+    version: int = DEAL_VERSION,
+) -> List[np.ndarray]:
+    """Deck positions dealt to every seat, in the order they are drawn.
+
+    all:    every player gets the whole deck in their own order
+    deal:   the deck is shuffled once and split between the players, leftover
+            cards are not dealt
+    custom: every player gets cards_per_player cards of the whole deck, so
+            hands may share cards
+
+    Positions from card_count upwards are the player's wildcards. The deal
+    only depends on the arguments, so a game can be replayed or audited from
+    the seed and deal version stored on its row.
+    """
+    size = hand_size(gamemode, card_count, player_count, cards_per_player)
+
+    if version == 1:
+        rng = np.random.default_rng(seed)
+        if gamemode == DEAL:
+            deck = rng.permutation(card_count)
+            hands = [
+                deck[seat * size : (seat + 1) * size] for seat in range(player_count)
+            ]
+        else:
+            decks = np.broadcast_to(np.arange(card_count), (player_count, card_count))
+            hands = list(rng.permuted(decks, axis=1)[:, :size])
+    elif version == 2:
+        bits = np.random.PCG64(seed)
+        if gamemode == DEAL:
+            deck = shuffled(bits, 1, card_count)[0]
+            hands = [
+                deck[seat * size : (seat + 1) * size] for seat in range(player_count)
+            ]
+        else:
+            hands = list(shuffled(bits, player_count, card_count)[:, :size])
+    else:
+        raise ValueError(f"Unknown deal version {version}")
+
+    wildcard_positions = np.arange(card_count, card_count + wildcards)
+    return [np.concatenate((hand, wildcard_positions)) for hand in hands]
+
+
+def shuffled(bits: np.random.PCG64, rows: int, count: int) -> np.ndarray:
+    """rows orders of range(count), from the bit stream alone.
+
+    Sorting by random keys is an even shuffle, and a stable sort of the same
+    keys always gives the same order.
+    """
+    keys = bits.random_raw(rows * count).reshape(rows, count)
+    return np.argsort(keys, axis=1, kind="stable")
+
+
+def player_positions(
+    gamemode: str,
+    card_count: int,
+    player_count: int,
+    seat: int,
+    seed: int,
+    cards_per_player: Optional[int] = None,
+    wildcards: int = 0,
+    version: int = DEAL_VERSION,
+) -> List[int]:
+    hands = deal(
+        gamemode, card_count, player_count, seed, cards_per_player, wildcards, version
+    )
+    return hands[seat].tolist()
+
+
+def dealt_count(
+    gamemode: str,
+    card_count: int,
+    player_count: int,
+    cards_per_player: Optional[int] = None,
+    wildcards: int = 0,
+) -> int:
+    """Number of positions dealt to all players together."""
+    size = hand_size(gamemode, card_count, player_count, cards_per_player)
+    if gamemode == DEAL:
+        dealt = min(size * player_count, card_count)
+    else:
+        dealt = size * player_count
+    return dealt + wildcards * player_count
+
+
+def new_seed() -> int:
+    # Fits the BIGINT seed column
+    return secrets.randbits(63)
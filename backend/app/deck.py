@@ -1,13 +1,11 @@
 from typing import Optional
 
 import psycopg2
-from app import db_connector
-from fastapi import APIRouter, HTTPException, Query
+from app import auth, catalog, db_connector
+from fastapi import APIRouter, Depends, HTTPException, Query
 from psycopg2 import sql
 from pydantic import BaseModel
 
-from . import db_connection_params
-
 router = APIRouter()
 
 GET_DECK_FIELDS = ["iddeck", "title", "description"]
@@ -19,31 +17,49 @@ class CreateDeckInput(BaseModel):
     external_id: str
 
 
+# The caller's own decks, then the caller's card count in every deck from
+# deck_card_count. Public decks come from the catalog.
+USER_DECKS_QUERY = """
+    SELECT d.iddeck, d.title, d.description, TRUE, 0
+    FROM deck d
+    WHERE d.deleted = FALSE AND d.appuser = {appuser} {hidden}
+    UNION ALL
+    SELECT n.deck, NULL, NULL, FALSE, n.card_count
+    FROM deck_card_count n
+    WHERE n.appuser = {appuser}
+"""
+
+
 @router.get("/decks/")
-async def get_decks(external_id: Optional[str] = Query(None), game_deck: str = False):
+def get_decks(
+    external_id: Optional[str] = Query(None),
+    game_deck: str = False,
+    identity: auth.Identity = Depends(auth.get_identity),
+):
     decks: list = []
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
-            cursor = connection.cursor()
-            query = (
-                f"SELECT {', '.join(GET_DECK_FIELDS)}, "
-                "(appuser.external_id IS NOT NULL) AS userdeck, "
-                "(SELECT COUNT(1) FROM card_deck WHERE card_deck.deck = deck.iddeck "
-                "AND card_deck.deleted = FALSE) AS cardcount "
-                "FROM deck LEFT JOIN appuser ON deck.appuser = appuser.idappuser "
-                "WHERE deck.deleted = FALSE "
+        decks = [
+            (iddeck, title, description, False, cardcount)
+            for iddeck, title, description, _, cardcount in catalog.catalog.decks(
+                hidden=bool(game_deck)
+            )
+        ]
+        if external_id:
+            appuser, appuser_param = auth.appuser_filter(identity, external_id)
+            with db_connector.get_connection() as connection:
+                cursor = connection.cursor()
+                query = USER_DECKS_QUERY.format(
+                    appuser=appuser,
+                    hidden="" if game_deck else "AND d.hidden = FALSE",
+                )
+                cursor.execute(sql.SQL(query), (appuser_param, appuser_param))
+                user_decks = cursor.fetchall()
+
+            user_counts = {deck[0]: deck[4] for deck in user_decks if not deck[3]}
+            decks = sorted(
+                deck[:4] + (deck[4] + user_counts.get(deck[0], 0),)
+                for deck in decks + [deck for deck in user_decks if deck[3]]
             )
-            if not game_deck:
-                query += "AND deck.hidden = FALSE "
-
-            if external_id:
-                query += "AND appuser IS NULL OR appuser.external_id = %s"
-                cursor.execute(query, (external_id,))
-            else:
-                query += "AND appuser IS NULL"
-                cursor.execute(query)
-
-            decks = cursor.fetchall()
 
     except (Exception, psycopg2.Error) as error:
         print("Error connecting to PostgreSQL:", error)
@@ -62,20 +78,13 @@ async def get_decks(external_id: Optional[str] = Query(None), game_deck: str = F
 
 
 @router.post("/deck/")
-async def create_deck(data: CreateDeckInput):
+def create_deck(
+    data: CreateDeckInput, identity: auth.Identity = Depends(auth.get_identity)
+):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
-            get_query = sql.SQL(
-                "SELECT idappuser FROM appuser WHERE deleted = FALSE AND external_id = %s LIMIT 1"
-            )
-            cursor.execute(get_query, (data.external_id,))
-            appuser = cursor.fetchone()
-
-            if not appuser:
-                raise HTTPException(status_code=422, detail="User not found")
-
-            idappuser = appuser[0]
+            idappuser, _ = db_connector.get_appuser(cursor, data.external_id, identity)
             insert_query = sql.SQL(
                 "INSERT INTO deck (title, description, appuser, updatedby) VALUES ({}) RETURNING iddeck"
             ).format(
@@ -96,10 +105,14 @@ async def create_deck(data: CreateDeckInput):
 
 
 @router.delete("/deck/")
-async def delete_deck(iddeck: int, external_id: str):
+def delete_deck(
+    iddeck: int,
+    external_id: str,
+    identity: auth.Identity = Depends(auth.get_identity),
+):
     try:
         db_connector.delete_object(
-            table="deck", idobject=iddeck, external_id=external_id
+            table="deck", idobject=iddeck, external_id=external_id, identity=identity
         )
 
     except (Exception, psycopg2.Error) as error:
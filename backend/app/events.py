@@ -0,0 +1,230 @@
+import asyncio
+import json
+
+import psycopg2
+from app import db_connection_params, db_connector
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from psycopg2 import extensions
+
+router = APIRouter()
+
+GAME_EVENTS_CHANNEL = "game_events"
+KEEPALIVE_SECONDS = 15
+RECONNECT_SECONDS = [1, 2, 5, 10, 30]
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Subscription:
+    def __init__(self, game: int = None, appuser: int = None):
+        self.game = game
+        self.appuser = appuser
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def wants(self, event: dict) -> bool:
+        if self.game is not None:
+            return event.get("game") == self.game
+        return self.appuser in event.get("appusers", [])
+
+    def put(self, event: dict):
+        if self.queue.full():
+            # A stalled client only loses its oldest events
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class EventBroker:
+    """Relays NOTIFYs on GAME_EVENTS_CHANNEL to this worker's subscribers.
+
+    Every uvicorn worker runs one LISTEN connection, so events published in
+    a transaction on any worker reach the streams on all of them. Other
+    channels can share the connection through listen().
+    """
+
+    def __init__(self, connection_params: dict, channel: str):
+        self.connection_params = connection_params
+        self.channel = channel
+        self.subscriptions = set()
+        self.listeners = {}
+        self._connection = None
+        self._fileno = None
+        self._loop = None
+        self._reconnect_task = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self._connect()
+
+    async def stop(self):
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        self._close()
+
+    def listen(self, channel: str, handler, reset=None):
+        """Calls handler(payload) for every NOTIFY on channel.
+
+        reset() is called whenever the connection is (re)opened, as
+        notifications sent while it was down are lost.
+        """
+        self.listeners[channel] = (handler, reset)
+
+    def subscribe(self, game: int = None, appuser: int = None) -> Subscription:
+        subscription = Subscription(game=game, appuser=appuser)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+    def dispatch(self, event: dict):
+        for subscription in self.subscriptions:
+            if subscription.wants(event):
+                subscription.put(event)
+
+    async def _connect(self):
+        connection = await run_in_threadpool(self._listen)
+        # Loop methods are not thread safe, so the reader is only added and
+        # removed from the loop's own thread
+        self._connection = connection
+        self._fileno = connection.fileno()
+        self._loop.add_reader(self._fileno, self._on_readable)
+
+        for _, reset in self.listeners.values():
+            if reset:
+                reset()
+
+    def _listen(self):
+        connection = psycopg2.connect(**self.connection_params)
+        connection.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = connection.cursor()
+        for channel in [self.channel, *self.listeners]:
+            cursor.execute(f"LISTEN {channel}")
+        return connection
+
+    def _close(self):
+        if self._connection is None:
+            return
+        self._loop.remove_reader(self._fileno)
+        if not self._connection.closed:
+            self._connection.close()
+        self._connection = None
+
+    def _on_readable(self):
+        try:
+            self._connection.poll()
+        except psycopg2.Error as error:
+            print("Lost game event listener connection:", error)
+            self._close()
+            self._reconnect_task = self._loop.create_task(self._reconnect())
+            return
+
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            if notify.channel in self.listeners:
+                self.listeners[notify.channel][0](notify.payload)
+                continue
+            try:
+                self.dispatch(json.loads(notify.payload))
+            except ValueError as error:
+                print("Invalid game event payload:", error)
+
+    async def _reconnect(self):
+        attempt = 0
+        while True:
+            await asyncio.sleep(
+                RECONNECT_SECONDS[min(attempt, len(RECONNECT_SECONDS) - 1)]
+            )
+            try:
+                await self._connect()
+                return
+            except psycopg2.Error as error:
+                print("Could not reconnect game event listener:", error)
+                attempt += 1
+
+
+broker = EventBroker(db_connection_params, GAME_EVENTS_CHANNEL)
+broker.listen(
+    db_connector.APPUSER_CHANGES_CHANNEL,
+    db_connector.appuser_cache.on_notify,
+    reset=db_connector.appuser_cache.clear,
+)
+
+
+def format_event(event: dict) -> str:
+    data = {key: value for key, value in event.items() if key != "appusers"}
+    return (
+        f"id: {event.get('version', '')}\n"
+        f"event: {event['type']}\n"
+        f"data: {json.dumps(data)}\n\n"
+    )
+
+
+async def stream(request: Request, subscription: Subscription):
+    try:
+        yield f"retry: {RECONNECT_SECONDS[0] * 1000}\n\n"
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(
+                    subscription.queue.get(), KEEPALIVE_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def event_response(request: Request, subscription: Subscription):
+    return StreamingResponse(
+        stream(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def get_game_participant(idgame: int, external_id: str):
+    with db_connector.get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            SELECT a.idappuser
+            FROM appuser a
+            INNER JOIN game_appuser ga ON a.idappuser = ga.appuser
+            INNER JOIN game g ON g.idgame = ga.game
+            WHERE a.deleted = FALSE AND ga.deleted = FALSE AND g.deleted = FALSE
+            AND ga.game = %s AND a.external_id = %s
+            """,
+            (idgame, external_id),
+        )
+        return cursor.fetchone()
+
+
+def get_appuser(external_id: str):
+    with db_connector.get_connection() as connection:
+        return db_connector.get_appuser(connection.cursor(), external_id)
+
+
+@router.get("/game/{idgame}/events")
+async def get_game_events(idgame: int, external_id: str, request: Request):
+    try:
+        participant = await run_in_threadpool(get_game_participant, idgame, external_id)
+    except psycopg2.Error as error:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
+
+    if not participant:
+        raise HTTPException(status_code=401, detail="User not in game")
+
+    return event_response(request, broker.subscribe(game=idgame))
+
+
+@router.get("/events/")
+async def get_appuser_events(external_id: str, request: Request):
+    try:
+        idappuser, _ = await run_in_threadpool(get_appuser, external_id)
+    except psycopg2.Error as error:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
+
+    return event_response(request, broker.subscribe(appuser=idappuser))
@@ -1,12 +1,12 @@
+from typing import Optional
+
 import psycopg2
-from app import db_connector
-from app.helpers import onesignal_helper
-from fastapi import APIRouter, HTTPException
+from app import db_connector, notifications
+from app.helpers import pagination_helper
+from fastapi import APIRouter, HTTPException, Query
 from psycopg2 import sql
 from pydantic import BaseModel
 
-from . import db_connection_params
-
 router = APIRouter()
 
 
@@ -25,9 +25,16 @@ class FriendshipUpdate(BaseModel):
 
 
 @router.get("/friendships/")
-async def get_friendships(external_id: str):
+def get_friendships(
+    external_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=pagination_helper.MAX_PAGE_SIZE),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    accepted: Optional[bool] = None,
+):
+    next_cursor = None
+    after = pagination_helper.decode_cursor(page_cursor) if page_cursor else None
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
 
             user_pending_query = sql.SQL(
@@ -47,26 +54,54 @@ async def get_friendships(external_id: str):
                 {"username": pending_request[0]} for pending_request in pending_requests
             ]
 
-            get_friends_query = sql.SQL(
-                """
-                SELECT
-                    f.accepted,
-                    CASE
-                        WHEN f.appuser1 = au.idappuser THEN au2.username
-                        ELSE au1.username
-                    END AS friend_username
-                FROM friendship f
-                INNER JOIN
-                    appuser au ON f.appuser1 = au.idappuser OR f.appuser2 = au.idappuser
-                LEFT JOIN appuser au1 ON f.appuser1 = au1.idappuser
-                LEFT JOIN appuser au2 ON f.appuser2 = au2.idappuser
-                WHERE au.external_id = %s AND (
-                    au2.external_id != %s OR f.accepted = TRUE
+            # Friendships the user asked for, plus accepted ones asked by others.
+            # Each side reads at most one page from its own
+            # (appuser, createdtime) index before the two are merged.
+            page_filter = ""
+            if accepted is not None:
+                page_filter += "AND accepted = %(accepted)s "
+            if after:
+                page_filter += (
+                    "AND (createdtime, idfriendship) < (%(createdtime)s, %(id)s) "
                 )
-                """
-            )
-            cursor.execute(get_friends_query, (external_id, external_id))
+            page_limit = "LIMIT %(limit)s" if limit else ""
+
+            get_friends_query = f"""
+                WITH au AS (
+                    SELECT idappuser FROM appuser WHERE external_id = %(external_id)s
+                    LIMIT 1
+                )
+                SELECT f.accepted, friend.username, f.createdtime, f.idfriendship
+                FROM (
+                    (
+                        SELECT idfriendship, createdtime, accepted, appuser2 AS friend
+                        FROM friendship
+                        WHERE appuser1 = (SELECT idappuser FROM au) {page_filter}
+                        ORDER BY createdtime DESC, idfriendship DESC {page_limit}
+                    )
+                    UNION ALL
+                    (
+                        SELECT idfriendship, createdtime, accepted, appuser1 AS friend
+                        FROM friendship
+                        WHERE appuser2 = (SELECT idappuser FROM au)
+                        AND accepted = TRUE {page_filter}
+                        ORDER BY createdtime DESC, idfriendship DESC {page_limit}
+                    )
+                ) f
+                INNER JOIN appuser friend ON f.friend = friend.idappuser
+                ORDER BY f.createdtime DESC, f.idfriendship DESC {page_limit}
+            """
+            params = {
+                "external_id": external_id,
+                "accepted": accepted,
+                "createdtime": after[0] if after else None,
+                "id": after[1] if after else None,
+                "limit": limit + 1 if limit else None,
+            }
+
+            cursor.execute(get_friends_query, params)
             friendships = cursor.fetchall() or []
+            next_cursor = pagination_helper.next_cursor(friendships, limit, 2, 3)
             friends = [
                 {"accepted": friendship[0], "username": friendship[1]}
                 for friendship in friendships
@@ -75,13 +110,13 @@ async def get_friendships(external_id: str):
     except (Exception, psycopg2.Error) as error:
         raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
 
-    return {"pending": pending, "friends": friends}
+    return {"pending": pending, "friends": friends, "next_cursor": next_cursor}
 
 
 @router.get("/friends/")
-async def get_friends(external_id: str):
+def get_friends(external_id: str):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
 
             get_friends_query = sql.SQL(
@@ -117,9 +152,9 @@ async def get_friends(external_id: str):
 
 
 @router.post("/friendship/create", response_model=None)
-async def create_friendship(friendship_data: FriendshipUpdate):
+def create_friendship(friendship_data: FriendshipUpdate):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
 
             get_appuser1_query = sql.SQL(
@@ -157,11 +192,11 @@ async def create_friendship(friendship_data: FriendshipUpdate):
             """
             )
             cursor.execute(insert_friendship_query, (appuser1[0], appuser2[0]))
-            connection.commit()
-
-            onesignal_helper.send_notification_to_users(
-                [appuser2[1]], f"{appuser1[1]} wants to be friends!"
+            notifications.enqueue(
+                cursor, [appuser2[1]], f"{appuser1[1]} wants to be friends!"
             )
+            connection.commit()
+            notifications.worker.wake()
     except psycopg2.Error as error:
         print("Error connecting to PostgreSQL:", error)
         raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
@@ -170,9 +205,9 @@ async def create_friendship(friendship_data: FriendshipUpdate):
 
 
 @router.put("/friendship/accept", response_model=None)
-async def accept_friendship(friendship_data: FriendshipUpdate):
+def accept_friendship(friendship_data: FriendshipUpdate):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
 
             get_appuser1_query = """
@@ -214,9 +249,9 @@ async def accept_friendship(friendship_data: FriendshipUpdate):
 
 
 @router.delete("/friendship/")
-async def delete_friendship(friendship_data: FriendshipUpdate):
+def delete_friendship(friendship_data: FriendshipUpdate):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
             get_appuser_query = """
                 SELECT idappuser
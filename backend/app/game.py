@@ -1,24 +1,43 @@
-import random
+from datetime import datetime
 from enum import Enum
-from typing import List
+from typing import Dict, List, Optional
 
 import psycopg2
-from app import db_connector
-from app.api_classes import Game, GameCard
-from app.helpers import onesignal_helper
-from fastapi import APIRouter, HTTPException
+from app import auth, db_connector, dealing, events, notifications
+from app.api_classes import Game, GameCard, GameParticipant
+from app.helpers import etag_helper, pagination_helper
+from app.query_stats import execute_values
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from psycopg2 import sql
-from psycopg2.extras import execute_values
 from pydantic import BaseModel
 
-from . import db_connection_params
-
 router = APIRouter()
 
 
 class GameModeEnum(str, Enum):
     all = "all"
     deal = "deal"
+    custom = "custom"
+
+
+class DealingEnum(str, Enum):
+    eager = "eager"
+    lazy = "lazy"
+
+
+class GameStateEnum(str, Enum):
+    pending = "pending"
+    active = "active"
+    waiting = "waiting"
+    finished = "finished"
+
+
+GAME_STATE_FILTERS = {
+    GameStateEnum.pending: "i.accepted = FALSE",
+    GameStateEnum.active: "i.accepted = TRUE AND i.open_count > 0",
+    GameStateEnum.waiting: "i.waiting_count > 0",
+    GameStateEnum.finished: "i.open_count = 0",
+}
 
 
 class CreateGameInput(BaseModel):
@@ -29,6 +48,7 @@ class CreateGameInput(BaseModel):
     skips: int
     cardsperperson: int = None
     gamemode: GameModeEnum
+    dealing: DealingEnum = DealingEnum.eager
 
 
 class AcceptGameInput(BaseModel):
@@ -39,6 +59,7 @@ class AcceptGameInput(BaseModel):
 class PlayCardInput(BaseModel):
     external_id: str
     idgame_card: int
+    game: int = None
     title: str = ""
     description: str = ""
     external_id: str
@@ -57,209 +78,622 @@ class GameInfoResponse(BaseModel):
     cards_done: List[GameCard]
 
 
+class GameChangesResponse(BaseModel):
+    cursor: int
+    reset: bool = False
+    game_cards: List[GameCard] = []
+    participants: Dict[str, GameParticipant] = {}
+
+
+# A page of GET /games/ is an index range scan of game_inbox; state filters
+# and the keyset cursor are appended by get_games.
+GAMES_PAGE_QUERY = """
+    SELECT i.game, i.createdtime, a.username, i.deck_title, i.accepted,
+    i.waiting_count > 0, i.participants
+    FROM game_inbox AS i
+    INNER JOIN appuser AS a ON i.appuser = a.idappuser
+    INNER JOIN game AS g ON i.game = g.idgame
+    WHERE g.deleted = FALSE AND i.appuser = {appuser}
+"""
+GAMES_PAGE_ORDER = "ORDER BY i.createdtime DESC, i.game DESC "
+
+
+# Rebuilds the GET /games/ row of every participant of a game: the other
+# players, whether they accepted and how many played cards wait on them.
+GAME_INBOX_UPSERT = """
+    INSERT INTO game_inbox (
+        appuser, game, createdtime, deck_title, accepted, participants,
+        waiting_count, open_count
+    )
+    SELECT ga.appuser, g.idgame, g.createdtime, d.title, ga.accepted,
+    ARRAY(
+        SELECT other.username
+        FROM game_appuser AS oga
+        INNER JOIN appuser AS other ON oga.appuser = other.idappuser
+        WHERE oga.game = g.idgame AND oga.deleted = FALSE AND other.deleted = FALSE
+        AND oga.appuser != ga.appuser
+        ORDER BY oga.idgame_appuser
+    ),
+    (
+        SELECT COUNT(1)
+        FROM game_card AS gc
+        WHERE gc.game = g.idgame AND gc.performer = ga.appuser
+        AND gc.deleted = FALSE AND gc.skipped = FALSE
+        AND gc.played_time IS NOT NULL AND gc.finished_time IS NULL
+    ),
+    (
+        SELECT COUNT(1)
+        FROM game_card AS gc
+        WHERE gc.game = g.idgame AND gc.deleted = FALSE AND gc.skipped = FALSE
+        AND gc.finished_time IS NULL
+    ) + COALESCE(g.deal_total - (
+        SELECT COUNT(1)
+        FROM game_card AS gc
+        WHERE gc.game = g.idgame AND gc.deal_position IS NOT NULL
+    ), 0)
+    FROM game AS g
+    INNER JOIN game_appuser AS ga ON g.idgame = ga.game
+    INNER JOIN deck AS d ON g.deck = d.iddeck
+    WHERE g.idgame = %(idgame)s
+    ON CONFLICT (appuser, game) DO UPDATE SET
+        updatedtime = CURRENT_TIMESTAMP,
+        deck_title = EXCLUDED.deck_title,
+        accepted = EXCLUDED.accepted,
+        participants = EXCLUDED.participants,
+        waiting_count = EXCLUDED.waiting_count,
+        open_count = EXCLUDED.open_count
+"""
+
+# Bumps the game version, logs the changed game_card and game_appuser rows
+# under the new version for GET /game/{idgame}/changes and announces the
+# change to the event streams of every participant. NOTIFY is only delivered
+# if the transaction commits.
+GAME_CHANGE_QUERY = f"""
+    WITH changed AS (
+        UPDATE game SET version = version + 1
+        WHERE idgame = %(idgame)s
+        RETURNING idgame, version
+    ),
+    logged AS (
+        INSERT INTO game_change (game, version, game_card, appuser)
+        SELECT changed.idgame, changed.version, rows.game_card, rows.appuser
+        FROM changed, (
+            SELECT unnest(%(game_cards)s::int[]) AS game_card, NULL::int AS appuser
+            UNION ALL
+            SELECT NULL, unnest(%(appusers)s::int[])
+        ) AS rows
+    )
+    SELECT pg_notify('{events.GAME_EVENTS_CHANNEL}', json_build_object(
+        'type', %(event)s,
+        'game', changed.idgame,
+        'card', %(idgame_card)s,
+        'version', changed.version,
+        'appusers', (
+            SELECT json_agg(ga.appuser) FROM game_appuser ga
+            WHERE ga.game = changed.idgame AND ga.deleted = FALSE
+        )
+    )::text)
+    FROM changed
+"""
+
+
+def record_game_change(
+    cursor,
+    idgame: int,
+    event: str,
+    idgame_card: int = None,
+    appusers: Optional[list] = None,
+):
+    cursor.execute(
+        GAME_CHANGE_QUERY,
+        {
+            "idgame": idgame,
+            "event": event,
+            "idgame_card": idgame_card,
+            "game_cards": [idgame_card] if idgame_card else [],
+            "appusers": appusers or [],
+        },
+    )
+    # A statement of its own after the version bump: that waits for the
+    # game row lock of concurrent writes, and the upsert's fresh snapshot
+    # then counts the cards they committed
+    cursor.execute(GAME_INBOX_UPSERT, {"idgame": idgame})
+
+
 @router.get("/games/")
-async def get_games(external_id: str):
+def get_games(
+    external_id: str,
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=pagination_helper.MAX_PAGE_SIZE),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    state: Optional[GameStateEnum] = None,
+    identity: auth.Identity = Depends(auth.get_identity),
+):
     games = []
+    next_cursor = None
+    after = pagination_helper.decode_cursor(page_cursor) if page_cursor else None
+    appuser, appuser_param = auth.appuser_filter(identity, external_id)
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
-            get_query = sql.SQL(
-                "SELECT username FROM appuser WHERE deleted = FALSE AND external_id = %s LIMIT 1"
-            )
-            cursor.execute(get_query, (external_id,))
-            appuser_username = cursor.fetchone()[0]
+            query = GAMES_PAGE_QUERY.format(appuser=appuser)
+            params = [appuser_param]
 
-            cursor.execute(
-                """
-                SELECT g.idgame, g.createdtime, a.username, d.title, ga.accepted,
-                EXISTS (
-                    SELECT 1
-                    FROM game_card gc
-                    WHERE gc.game = g.idgame
-                        AND gc.performer = (
-                            SELECT idappuser
-                            FROM appuser
-                            WHERE external_id = %s
-                            LIMIT 1
-                        )
-                        AND gc.played_time IS NOT NULL
-                        AND gc.finished_time IS NULL
-                )
-                FROM game AS g
-                INNER JOIN game_appuser AS ga ON g.idgame = ga.game
-                INNER JOIN appuser AS a ON ga.appuser = a.idappuser
-                INNER JOIN deck AS d ON g.deck = d.iddeck
-                WHERE g.deleted = FALSE AND a.external_id = %s
-                """,
-                (external_id, external_id),
-            )
-            games_data = cursor.fetchall()
+            if state:
+                query += f"AND {GAME_STATE_FILTERS[state]} "
+            if after:
+                query += "AND (i.createdtime, i.game) < (%s, %s) "
+                params.extend(after)
 
-            game_ids = [game_data[0] for game_data in games_data]
+            query += GAMES_PAGE_ORDER
+            if limit:
+                query += "LIMIT %s"
+                params.append(limit + 1)
 
-            cursor.execute(
-                """
-                SELECT ga.game, array_agg(a.username)
-                FROM game_appuser AS ga
-                INNER JOIN appuser AS a ON ga.appuser = a.idappuser
-                WHERE ga.deleted = FALSE AND a.deleted = FALSE AND ga.game = ANY(%s)
-                GROUP BY ga.game
-                """,
-                (game_ids,),
-            )
-            game_participants_data = cursor.fetchall()
-            game_participants_dict = {
-                data[0]: data[1] for data in game_participants_data
-            }
-
-            games = []
-
-            for game_data in games_data:
-                game_id = game_data[0]
-                participants = game_participants_dict.get(game_id, [])
-                participants = [
-                    username
-                    for username in participants
-                    if username != appuser_username
-                ]
+            cursor.execute(query, params)
+            games_data = cursor.fetchall()
+            next_cursor = pagination_helper.next_cursor(games_data, limit, 1, 0)
 
-                game = {
-                    "idgame": game_id,
+            games = [
+                {
+                    "idgame": game_data[0],
                     "createdtime": game_data[1],
                     "appuser": game_data[2],
                     "deck": game_data[3],
                     "accepted": game_data[4],
                     "card_waiting": game_data[5],
-                    "participants": participants,
+                    "participants": game_data[6],
                 }
-                games.append(game)
+                for game_data in games_data
+            ]
 
     except (Exception, psycopg2.Error) as error:
         raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
 
-    return {"games": games}
+    # The page is one index range scan, so its ETag hashes what it returns
+    # instead of paying for a second query over the user's whole inbox
+    body = {"games": games, "next_cursor": next_cursor}
+    etag = etag_helper.make_etag(etag_helper.digest(body))
+    if etag_helper.etag_matches(request, etag):
+        return etag_helper.not_modified(etag)
+    etag_helper.set_etag(response, etag)
+    return body
+
+
+GAME_COLUMNS = [
+    "idgame",
+    "createdtime",
+    "updatedtime",
+    "appuser",
+    "deck",
+    "createdby",
+    "updatedby",
+    "deleted",
+    "wildcards_count",
+    "skips_count",
+]
+
+GAME_CARD_COLUMNS = [
+    "idgame_card",
+    "createdtime",
+    "updatedtime",
+    "game",
+    "player",
+    "performer",
+    "wildcard",
+    "title",
+    "description",
+    "played_time",
+    "finished_time",
+    "card",
+    "createdby",
+    "updatedby",
+    "deleted",
+    "skipped",
+]
+GAME_CARD_TIMESTAMPS = [
+    GAME_CARD_COLUMNS.index(column)
+    for column in ["createdtime", "updatedtime", "played_time", "finished_time"]
+]
+
+
+def game_card_json(extra_columns: str) -> str:
+    columns = ", ".join(f"gc.{column}" for column in GAME_CARD_COLUMNS)
+    return (
+        f"COALESCE(json_agg(json_build_array({columns}, {extra_columns}) "
+        "ORDER BY gc.idgame_card), '[]')"
+    )
+
+
+# One round trip for the whole game view. Card lists come back as JSON arrays
+# in GameCard.from_tuple order and participants as [username, accepted,
+# skips_left, received_cards].
+IS_PARTICIPANT = """
+    EXISTS (
+        SELECT 1
+        FROM appuser a
+        INNER JOIN game_appuser ga ON a.idappuser = ga.appuser
+        WHERE a.deleted = FALSE AND ga.deleted = FALSE
+        AND ga.game = g.idgame AND a.external_id = %(external_id)s
+    )
+"""
+
+# The viewer's seat in a lazily dealt game and the deal positions that already
+# have a game_card row, as [gamemode, cardsperperson, seed, deal_version,
+# deal_cards, wildcards_count, idappuser, seat, players, dealt_positions].
+LAZY_DEAL = """
+    SELECT json_build_array(
+        g.gamemode, g.cardsperperson, g.seed, g.deal_version, g.deal_cards,
+        g.wildcards_count,
+        seats.appuser, seats.seat, seats.players,
+        ARRAY(
+            SELECT gc.deal_position
+            FROM game_card gc
+            WHERE gc.game = g.idgame AND gc.player = seats.appuser
+            AND gc.deal_position IS NOT NULL
+        )
+    )
+    FROM (
+        SELECT ga.appuser, a.external_id,
+        row_number() OVER (ORDER BY ga.idgame_appuser) - 1 AS seat,
+        COUNT(1) OVER () AS players
+        FROM game_appuser ga
+        INNER JOIN appuser a ON ga.appuser = a.idappuser
+        WHERE ga.game = g.idgame
+    ) seats
+    WHERE seats.external_id = %(external_id)s
+"""
+
+LAZY_DEAL_QUERY = f"""
+    SELECT ({LAZY_DEAL})
+    FROM game g
+    WHERE g.deleted = FALSE AND g.dealing = 'lazy' AND g.idgame = %(idgame)s
+"""
+
+# Cards performed by each participant, aggregated once per game rather than
+# counted per participant row
+RECEIVED_CARDS = """
+    LEFT JOIN (
+        SELECT performer, COUNT(1) AS count
+        FROM game_card
+        WHERE game = g.idgame
+        GROUP BY performer
+    ) received ON received.performer = ga.appuser
+"""
+
+GAME_VERSION_QUERY = f"""
+    SELECT g.version, {IS_PARTICIPANT}
+    FROM game g
+    WHERE g.deleted = FALSE AND g.idgame = %(idgame)s
+"""
+
+GAME_SNAPSHOT_QUERY = f"""
+    SELECT {", ".join(f"g.{column}" for column in GAME_COLUMNS)},
+    g.version, {IS_PARTICIPANT},
+    (
+        SELECT {game_card_json("player.external_id = %(external_id)s")}
+        FROM game_card gc
+        INNER JOIN appuser player ON gc.player = player.idappuser
+        WHERE gc.deleted = FALSE AND player.deleted = FALSE
+        AND gc.played_time IS NULL AND gc.game = g.idgame
+        AND player.external_id = %(external_id)s AND gc.skipped = FALSE
+    ),
+    (
+        SELECT {game_card_json(
+            "player.external_id = %(external_id)s, "
+            "CONCAT(performer.firstname, ' ', LEFT(performer.lastname, 1))"
+        )}
+        FROM game_card gc
+        INNER JOIN appuser performer ON gc.performer = performer.idappuser
+        LEFT JOIN appuser player ON gc.player = player.idappuser
+        WHERE gc.deleted = FALSE AND performer.deleted = FALSE AND gc.game = g.idgame
+        AND (gc.finished_time IS NOT NULL OR gc.skipped = TRUE)
+        AND (player.external_id = %(external_id)s
+            OR performer.external_id = %(external_id)s)
+    ),
+    (
+        SELECT {game_card_json(
+            "player.external_id = %(external_id)s, "
+            "CONCAT(performer.firstname, ' ', LEFT(performer.lastname, 1))"
+        )}
+        FROM game_card gc
+        LEFT JOIN appuser performer ON gc.performer = performer.idappuser
+        LEFT JOIN appuser player ON gc.player = player.idappuser
+        WHERE gc.deleted = FALSE AND performer.deleted = FALSE AND gc.game = g.idgame
+        AND gc.played_time IS NOT NULL AND gc.finished_time IS NULL
+        AND gc.skipped = FALSE
+        AND (performer.external_id = %(external_id)s
+            OR player.external_id = %(external_id)s)
+    ),
+    CASE WHEN g.dealing = 'lazy' THEN ({LAZY_DEAL}) END,
+    (
+        SELECT COALESCE(json_agg(json_build_array(
+            a.username, ga.accepted, ga.skips_left, COALESCE(received.count, 0)
+        ) ORDER BY ga.idgame_appuser), '[]')
+        FROM appuser a
+        INNER JOIN game_appuser ga ON a.idappuser = ga.appuser
+        {RECEIVED_CARDS}
+        WHERE a.deleted = FALSE AND ga.deleted = FALSE
+        AND ga.game = g.idgame AND a.external_id != %(external_id)s
+    )
+    FROM game g
+    WHERE g.deleted = FALSE AND g.idgame = %(idgame)s
+"""
+
+
+def participants_from_json(participants_data: list) -> dict:
+    return {
+        username: {
+            "name": username,
+            "accepted": accepted,
+            "skips_left": skips_left,
+            "received_cards": received_cards,
+        }
+        for username, accepted, skips_left, received_cards in participants_data
+    }
+
+
+def game_cards_from_json(cards_data: list) -> List[GameCard]:
+    game_cards = []
+    for card_data in cards_data:
+        for index in GAME_CARD_TIMESTAMPS:
+            if card_data[index] is not None:
+                card_data[index] = datetime.fromisoformat(card_data[index])
+        game_cards.append(GameCard.from_tuple(tuple(card_data)))
+    return game_cards
+
+
+def player_hand(lazy_deal: list):
+    (
+        gamemode,
+        cardsperperson,
+        seed,
+        deal_version,
+        deal_cards,
+        wildcards,
+        idappuser,
+        seat,
+        players,
+        dealt_positions,
+    ) = lazy_deal
+    positions = dealing.player_positions(
+        gamemode,
+        len(deal_cards),
+        players,
+        seat,
+        seed,
+        cardsperperson,
+        wildcards,
+        deal_version,
+    )
+    return idappuser, deal_cards, positions, set(dealt_positions)
+
+
+def undealt_cards(cursor, game_data: tuple, lazy_deal: list) -> List[GameCard]:
+    """Cards of a lazily dealt game the viewer has not played yet.
+
+    They have no game_card row, so they are given the negative id
+    -(deal position + 1) which play_card resolves back to the position.
+    """
+    idappuser, deal_cards, positions, dealt_positions = player_hand(lazy_deal)
+    positions = [position for position in positions if position not in dealt_positions]
+    idcards = [
+        deal_cards[position] for position in positions if position < len(deal_cards)
+    ]
+    cursor.execute(
+        """
+        SELECT idcard, COALESCE(title, ''), COALESCE(description, '')
+        FROM card WHERE idcard = ANY(%s)
+        """,
+        (idcards,),
+    )
+    cards = {idcard: (title, description) for idcard, title, description in cursor}
+
+    idgame, createdtime = game_data[0], game_data[1]
+    game_cards = []
+    for position in positions:
+        wildcard = position >= len(deal_cards)
+        idcard = None if wildcard else deal_cards[position]
+        title, description = cards.get(idcard, ("", ""))
+        game_cards.append(
+            GameCard.from_tuple(
+                (
+                    -(position + 1),
+                    createdtime,
+                    createdtime,
+                    idgame,
+                    idappuser,
+                    None,
+                    wildcard,
+                    title,
+                    description,
+                    None,
+                    None,
+                    idcard,
+                    None,
+                    None,
+                    False,
+                    False,
+                    True,
+                )
+            )
+        )
+    return game_cards
+
+
+def deal_card(cursor, idgame: int, external_id: str, idgame_card: int) -> int:
+    """Inserts the game_card row of an undealt card and returns its id."""
+    cursor.execute(LAZY_DEAL_QUERY, {"idgame": idgame, "external_id": external_id})
+    lazy_deal = cursor.fetchone()
+    if not lazy_deal or not lazy_deal[0]:
+        raise HTTPException(status_code=404, detail="Game not found")
+
+    idappuser, deal_cards, positions, _ = player_hand(lazy_deal[0])
+    position = -idgame_card - 1
+    if position not in positions:
+        raise HTTPException(status_code=404, detail="Card not found")
+
+    wildcard = position >= len(deal_cards)
+    cursor.execute(
+        """
+        INSERT INTO game_card (
+            game, player, wildcard, card, title, description, updatedby,
+            deal_position
+        )
+        SELECT %(idgame)s, %(idappuser)s, %(wildcard)s, c.idcard,
+        COALESCE(c.title, ''), COALESCE(c.description, ''), %(idappuser)s,
+        %(position)s
+        FROM (SELECT %(idcard)s::int AS idcard) deal
+        LEFT JOIN card c ON deal.idcard = c.idcard
+        ON CONFLICT (game, player, deal_position) WHERE deal_position IS NOT NULL
+        DO NOTHING
+        RETURNING idgame_card
+        """,
+        {
+            "idgame": idgame,
+            "idappuser": idappuser,
+            "wildcard": wildcard,
+            "idcard": None if wildcard else deal_cards[position],
+            "position": position,
+        },
+    )
+    dealt = cursor.fetchone()
+    if dealt:
+        return dealt[0]
+
+    cursor.execute(
+        """
+        SELECT idgame_card FROM game_card
+        WHERE game = %s AND player = %s AND deal_position = %s
+        """,
+        (idgame, idappuser, position),
+    )
+    return cursor.fetchone()[0]
 
 
 @router.get("/game/{idgame}")
-async def get_game(idgame: int, external_id: str):
+def get_game(idgame: int, external_id: str, request: Request, response: Response):
+    params = {"idgame": idgame, "external_id": external_id}
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
-            query_game = """
-                SELECT *
-                FROM game
-                WHERE deleted = FALSE AND idgame = %s
-            """
-            cursor.execute(query_game, (idgame,))
-            game_data = cursor.fetchone()
-
-            if not game_data:
+            if request.headers.get("if-none-match"):
+                cursor.execute(GAME_VERSION_QUERY, params)
+                game_version = cursor.fetchone()
+                if game_version and game_version[1]:
+                    etag = etag_helper.make_etag(idgame, game_version[0])
+                    if etag_helper.etag_matches(request, etag):
+                        return etag_helper.not_modified(etag)
+
+            cursor.execute(GAME_SNAPSHOT_QUERY, params)
+            snapshot = cursor.fetchone()
+
+            if not snapshot:
                 raise HTTPException(status_code=404, detail="Game not found")
 
-            get_query = """
-                SELECT ga.accepted
-                FROM appuser a
-                INNER JOIN game_appuser ga ON a.idappuser = ga.appuser
-                WHERE a.deleted = FALSE AND ga.deleted = FALSE
-                AND ga.game = %s AND a.external_id = %s
-            """
-            cursor.execute(get_query, (idgame, external_id))
-            appuser = cursor.fetchone()
-
-            if not appuser:
+            game_data = snapshot[: len(GAME_COLUMNS)]
+            (
+                version,
+                is_participant,
+                cards_to_play_data,
+                cards_done_data,
+                cards_in_play_data,
+                lazy_deal,
+                participants_data,
+            ) = snapshot[len(GAME_COLUMNS) :]
+
+            if not is_participant:
                 raise HTTPException(status_code=401, detail="User not in game")
-            appuser_accepted = appuser[0]
-
-            query_game_cards_to_play = """
-                SELECT gc.*, (player.external_id = %s) AS mycard
-                FROM game_card gc
-                INNER JOIN appuser player ON gc.player = player.idappuser
-                WHERE gc.deleted = FALSE AND player.deleted = FALSE
-                AND gc.played_time IS NULL AND gc.game = %s AND player.external_id = %s
-                AND gc.skipped = FALSE
-            """
-            cursor.execute(query_game_cards_to_play, (external_id, idgame, external_id))
-            game_cards_to_play_data = cursor.fetchall()
+            etag_helper.set_etag(response, etag_helper.make_etag(idgame, version))
 
-            game_cards_to_play = [
-                GameCard.from_tuple(card_data) for card_data in game_cards_to_play_data
-            ]
+            cards_to_play = game_cards_from_json(cards_to_play_data)
+            if lazy_deal:
+                cards_to_play += undealt_cards(cursor, game_data, lazy_deal)
 
-            query_game_cards_done = """
-                SELECT gc.*, (player.external_id = %s) AS mycard,
-                CONCAT(performer.firstname, ' ', LEFT(performer.lastname, 1))
-                FROM game_card gc
-                INNER JOIN appuser performer ON gc.performer = performer.idappuser
-                LEFT JOIN appuser player ON gc.player = player.idappuser
-                WHERE gc.deleted = FALSE AND performer.deleted = FALSE AND gc.game = %s
-                AND (finished_time IS NOT NULL OR gc.skipped = TRUE)
-                AND (player.external_id = %s OR performer.external_id = %s)
-            """
-            cursor.execute(
-                query_game_cards_done,
-                (external_id, idgame, external_id, external_id),
+            game_data += (participants_from_json(participants_data),)
+            game = Game.from_tuple(game_data)
+            game.version = version
+
+            game.started = all([part.accepted for part in game.participants.values()])
+            return GameInfoResponse(
+                game=game,
+                cards_in_play=game_cards_from_json(cards_in_play_data),
+                cards_to_play=cards_to_play,
+                cards_done=game_cards_from_json(cards_done_data),
             )
-            game_cards_done_data = cursor.fetchall()
 
-            game_cards_done = [
-                GameCard.from_tuple(card_data) for card_data in game_cards_done_data
-            ]
+    except (Exception, psycopg2.Error) as error:
+        print("Error connecting to PostgreSQL:", error)
+        raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
 
-            query_game_cards_in_play = """
-                SELECT gc.*, (player.external_id = %s) AS mycard,
-                CONCAT(performer.firstname, ' ', LEFT(performer.lastname, 1))
-                FROM game_card gc
-                LEFT JOIN appuser performer ON gc.performer = performer.idappuser
-                LEFT JOIN appuser player ON gc.player = player.idappuser
-                WHERE gc.deleted = FALSE AND performer.deleted = FALSE
-                AND gc.game = %s AND played_time IS NOT NULL AND finished_time IS NULL
-                AND gc.skipped = FALSE
-                AND (performer.external_id = %s OR player.external_id = %s)
-            """
+
+# Rows logged in game_change after the client's cursor, filtered the same way
+# as the snapshot: cards the viewer plays or performs and the other players.
+GAME_CHANGES_QUERY = f"""
+    SELECT g.version, {IS_PARTICIPANT},
+    (
+        SELECT {game_card_json(
+            "player.external_id = %(external_id)s, "
+            "CASE WHEN performer.idappuser IS NULL THEN '' "
+            "ELSE CONCAT(performer.firstname, ' ', LEFT(performer.lastname, 1)) END"
+        )}
+        FROM game_card gc
+        LEFT JOIN appuser performer ON gc.performer = performer.idappuser
+        LEFT JOIN appuser player ON gc.player = player.idappuser
+        WHERE gc.deleted = FALSE AND gc.game = g.idgame
+        AND gc.idgame_card IN (
+            SELECT game_card FROM game_change
+            WHERE game = g.idgame AND version > %(since)s
+        )
+        AND (player.external_id = %(external_id)s
+            OR performer.external_id = %(external_id)s)
+    ),
+    (
+        SELECT COALESCE(json_agg(json_build_array(
+            a.username, ga.accepted, ga.skips_left, COALESCE(received.count, 0)
+        ) ORDER BY ga.idgame_appuser), '[]')
+        FROM appuser a
+        INNER JOIN game_appuser ga ON a.idappuser = ga.appuser
+        {RECEIVED_CARDS}
+        WHERE a.deleted = FALSE AND ga.deleted = FALSE AND ga.game = g.idgame
+        AND ga.appuser IN (
+            SELECT appuser FROM game_change
+            WHERE game = g.idgame AND version > %(since)s
+        )
+        AND a.external_id != %(external_id)s
+    )
+    FROM game g
+    WHERE g.deleted = FALSE AND g.idgame = %(idgame)s
+"""
+
+
+@router.get("/game/{idgame}/changes")
+def get_game_changes(idgame: int, external_id: str, since: int):
+    try:
+        with db_connector.get_connection() as connection:
+            cursor = connection.cursor()
             cursor.execute(
-                query_game_cards_in_play,
-                (external_id, idgame, external_id, external_id),
+                GAME_CHANGES_QUERY,
+                {"idgame": idgame, "external_id": external_id, "since": since},
             )
-            game_cards_in_play_data = cursor.fetchall()
+            changes = cursor.fetchone()
 
-            game_cards_in_play = [
-                GameCard.from_tuple(card_data) for card_data in game_cards_in_play_data
-            ]
+            if not changes:
+                raise HTTPException(status_code=404, detail="Game not found")
 
-            query_game_appusers = """
-                SELECT username, CONCAT(firstname, ' ', LEFT(lastname, 1)), ga.accepted,
-                ga.skips_left,
-                (
-                    SELECT COUNT(1) FROM game_card gc
-                    WHERE gc.game = %s AND gc.performer = ga.appuser
-                )
-                FROM appuser a
-                INNER JOIN game_appuser ga ON a.idappuser = ga.appuser
-                WHERE a.deleted = FALSE AND ga.deleted = FALSE
-                AND ga.game = %s AND a.external_id != %s
-            """
-            cursor.execute(query_game_appusers, (idgame, idgame, external_id))
-            game_appusers = cursor.fetchall()
+            version, is_participant, cards_data, participants_data = changes
+            if not is_participant:
+                raise HTTPException(status_code=401, detail="User not in game")
 
-            game_data += (
-                {
-                    user[0]: {
-                        "name": user[0],
-                        "accepted": user[2],
-                        "skips_left": user[3],
-                        "received_cards": user[4],
-                    }
-                    for user in game_appusers
-                },
-            )
-            game = Game.from_tuple(game_data)
+            if since > version:
+                # The cursor is not from this game, start over from a snapshot
+                return GameChangesResponse(cursor=version, reset=True)
 
-            game.started = all([part.accepted for part in game.participants.values()])
-            return GameInfoResponse(
-                game=game,
-                cards_in_play=game_cards_in_play,
-                cards_to_play=game_cards_to_play,
-                cards_done=game_cards_done,
+            return GameChangesResponse(
+                cursor=version,
+                game_cards=game_cards_from_json(cards_data),
+                participants=participants_from_json(participants_data),
             )
 
     except (Exception, psycopg2.Error) as error:
@@ -267,46 +701,73 @@ async def get_game(idgame: int, external_id: str):
         raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
 
 
-def list_batches(gamemode, lst, num_batches, batch_size=None):
-    if gamemode == GameModeEnum.all:
-        return [list(lst) for _ in range(num_batches)]
-    elif gamemode == GameModeEnum.deal:
-        random.shuffle(lst)
-        batch_size = len(lst) // num_batches if not batch_size else batch_size
-        batches = [
-            lst[i * batch_size : (i + 1) * batch_size] for i in range(num_batches)
-        ]
-        return batches
-
-
 @router.post("/game/")
-async def create_game(data: CreateGameInput):
+def create_game(
+    data: CreateGameInput, identity: auth.Identity = Depends(auth.get_identity)
+):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
-
-            get_query = sql.SQL(
-                """
-                SELECT idappuser, username FROM appuser
-                WHERE deleted = FALSE AND external_id = %s LIMIT 1
-                """
+            idappuser, username = db_connector.get_appuser(
+                cursor, data.external_id, identity
             )
-            cursor.execute(get_query, (data.external_id,))
-            idappuser, username = cursor.fetchone()
 
             data.participants.append(idappuser)
 
+            select_card_deck_query = """
+                SELECT COALESCE(c.title, ''), COALESCE(c.description, ''), FALSE, c.idcard
+                FROM card_deck cd
+                LEFT JOIN card c ON cd.card = c.idcard
+                LEFT JOIN appuser a ON cd.appuser = a.idappuser
+                WHERE cd.deleted = FALSE AND (cd.card IS NULL OR c.deleted = FALSE)
+                AND (cd.appuser IS NULL OR a.external_id = %s) AND cd.deck = %s
+                ORDER BY cd.idcard_deck
+            """
+            cursor.execute(select_card_deck_query, (data.external_id, data.deck))
+            card_deck_data = cursor.fetchall()
+
+            # The deck order, seed and deal version are kept on the game so
+            # the deal can be replayed. Lazily dealt games insert no game_card
+            # rows up front, play_card does that per card.
+            seed = dealing.new_seed()
+            deal_cards = [idcard for _, _, _, idcard in card_deck_data]
+            deal_total = None
+            if data.dealing == DealingEnum.lazy:
+                deal_total = dealing.dealt_count(
+                    data.gamemode,
+                    len(deal_cards),
+                    len(data.participants),
+                    data.cardsperperson,
+                    data.wildcards,
+                )
+
             insert_game_query = sql.SQL(
                 """
                 INSERT INTO game (
-                    appuser, deck, updatedby, wildcards_count, skips_count
+                    appuser, deck, updatedby, wildcards_count, skips_count,
+                    dealing, gamemode, cardsperperson, seed, deal_version,
+                    deal_cards, deal_total
                 )
-                VALUES (%s, %s, %s, %s, %s) RETURNING idgame
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING idgame
                 """
             )
             cursor.execute(
                 insert_game_query,
-                (idappuser, data.deck, idappuser, data.wildcards, data.skips),
+                (
+                    idappuser,
+                    data.deck,
+                    idappuser,
+                    data.wildcards,
+                    data.skips,
+                    data.dealing.value,
+                    data.gamemode.value,
+                    data.cardsperperson,
+                    seed,
+                    dealing.DEAL_VERSION,
+                    deal_cards,
+                    deal_total,
+                ),
             )
             idgame = cursor.fetchone()[0]
 
@@ -328,60 +789,52 @@ async def create_game(data: CreateGameInput):
             """
             execute_values(cursor, insert_game_appuser_query, game_appuser_records)
 
-            select_card_deck_query = """
-                SELECT COALESCE(c.title, ''), COALESCE(c.description, ''), FALSE, c.idcard
-                FROM card_deck cd
-                LEFT JOIN card c ON cd.card = c.idcard
-                LEFT JOIN appuser a ON cd.appuser = a.idappuser
-                WHERE cd.deleted = FALSE AND (cd.card IS NULL OR c.deleted = FALSE)
-                AND (cd.appuser IS NULL OR a.external_id = %s) AND cd.deck = %s
-            """
-            cursor.execute(select_card_deck_query, (data.external_id, data.deck))
-            card_deck_data = cursor.fetchall()
-
-            batched_cards = list_batches(
-                data.gamemode,
-                card_deck_data,
-                len(data.participants),
-                data.cardsperperson,
-            )
-
-            for batch in batched_cards:
-                for _ in range(data.wildcards):
-                    batch.append(("", "", True, None))
-
-            game_cards_data = [
-                (idgame, appuser, wildcard, idcard, title, description, idappuser)
-                for index, appuser in enumerate(data.participants)
-                for title, description, wildcard, idcard in batched_cards[index]
-            ]
+            if data.dealing == DealingEnum.eager:
+                hands = dealing.deal(
+                    data.gamemode,
+                    len(card_deck_data),
+                    len(data.participants),
+                    seed,
+                    data.cardsperperson,
+                    data.wildcards,
+                )
+                wildcard = ("", "", True, None)
+
+                game_cards_data = [
+                    (
+                        idgame,
+                        appuser,
+                        *(
+                            card_deck_data[position]
+                            if position < len(card_deck_data)
+                            else wildcard
+                        ),
+                        idappuser,
+                        position,
+                    )
+                    for appuser, hand in zip(data.participants, hands)
+                    for position in hand.tolist()
+                ]
 
-            insert_game_card_query = sql.SQL(
-                """
-                INSERT INTO game_card (
-                    game, player, wildcard, card, title, description, updatedby
+                insert_game_card_query = sql.SQL(
+                    """
+                    INSERT INTO game_card (
+                        game, player, title, description, wildcard, card,
+                        updatedby, deal_position
+                    )
+                    VALUES %s
+                    """
                 )
-                VALUES %s
-                """
+                execute_values(cursor, insert_game_card_query, game_cards_data)
+            record_game_change(cursor, idgame, "game_created")
+
+            invited = [part for part in data.participants if part != idappuser]
+            notifications.enqueue_for_appusers(
+                cursor, invited, f"{username} wants to play!"
             )
-            execute_values(cursor, insert_game_card_query, game_cards_data)
 
             connection.commit()
-
-            invited_onesignal_ids = [
-                part for part in data.participants if part != idappuser
-            ]
-            get_query = sql.SQL(
-                """
-                SELECT onesignal_id FROM appuser
-                WHERE idappuser IN %s AND onesignal_id IS NOT NULL AND onesignal_id <> ''
-                """
-            )
-            cursor.execute(get_query, (tuple(invited_onesignal_ids),))
-            receivers = [a[0] for a in cursor.fetchall()]
-            onesignal_helper.send_notification_to_users(
-                receivers, f"{username} wants to play!"
-            )
+            notifications.worker.wake()
 
     except (Exception, psycopg2.Error) as error:
         print("Error connecting to PostgreSQL:", error)
@@ -391,21 +844,28 @@ async def create_game(data: CreateGameInput):
 
 
 @router.put("/game/accept")
-async def accept_game(data: AcceptGameInput):
+def accept_game(
+    data: AcceptGameInput, identity: auth.Identity = Depends(auth.get_identity)
+):
+    appuser, appuser_param = auth.appuser_filter(identity, data.external_id)
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
             update_query = sql.SQL(
-                """
+                f"""
                 UPDATE game_appuser
-                SET accepted = TRUE, updatedby = (SELECT idappuser FROM appuser WHERE external_id = %s)
-                WHERE game_appuser.appuser = (SELECT idappuser FROM appuser WHERE external_id = %s)
-                AND game_appuser.game = %s;
+                SET accepted = TRUE, updatedby = {appuser}
+                WHERE game_appuser.appuser = {appuser}
+                AND game_appuser.game = %s
+                RETURNING game_appuser.appuser
                 """
             )
-            cursor.execute(
-                update_query, (data.external_id, data.external_id, data.game)
-            )
+            cursor.execute(update_query, (appuser_param, appuser_param, data.game))
+            accepted = cursor.fetchone()
+            if accepted:
+                record_game_change(
+                    cursor, data.game, "game_accepted", appusers=[accepted[0]]
+                )
             connection.commit()
 
     except (Exception, psycopg2.Error) as error:
@@ -416,16 +876,25 @@ async def accept_game(data: AcceptGameInput):
 
 
 @router.put("/game/play-card/")
-async def play_card(data: PlayCardInput):
+def play_card(
+    data: PlayCardInput, identity: auth.Identity = Depends(auth.get_identity)
+):
+    if data.idgame_card < 0 and data.game is None:
+        raise HTTPException(status_code=422, detail="Undealt cards need a game")
+
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
             idappuser, player_username = db_connector.get_appuser(
-                cursor, external_id=data.external_id
+                cursor, external_id=data.external_id, identity=identity
             )
             idperformer, performer_onesignal_id = db_connector.get_appuser_by_email(
                 cursor, email=data.performers[0]
             )
+            if data.idgame_card < 0:
+                data.idgame_card = deal_card(
+                    cursor, data.game, data.external_id, data.idgame_card
+                )
 
             update_query = sql.SQL(
                 """
@@ -434,6 +903,7 @@ async def play_card(data: PlayCardInput):
                 title = CASE WHEN wildcard = TRUE THEN %s ELSE title END,
                 description = CASE WHEN wildcard = TRUE THEN %s ELSE description END
                 WHERE player = %s AND idgame_card = %s and game_card.deleted = FALSE
+                RETURNING game
                 """
             )
             cursor.execute(
@@ -447,12 +917,26 @@ async def play_card(data: PlayCardInput):
                     data.idgame_card,
                 ),
             )
-            connection.commit()
-            if performer_onesignal_id:
-                onesignal_helper.send_notification_to_users(
-                    [performer_onesignal_id], f"{player_username} says you're up!"
+            played = cursor.fetchone()
+            if played:
+                record_game_change(
+                    cursor,
+                    played[0],
+                    "card_played",
+                    data.idgame_card,
+                    appusers=[idperformer],
+                )
+                notifications.enqueue(
+                    cursor,
+                    [performer_onesignal_id],
+                    f"{player_username} says you're up!",
                 )
+            connection.commit()
+            notifications.worker.wake()
 
+    except HTTPException:
+        # deal_card's 404 for a game or card the player was not dealt
+        raise
     except (Exception, psycopg2.Error) as error:
         print("Error connecting to PostgreSQL:", error)
         raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
@@ -461,22 +945,30 @@ async def play_card(data: PlayCardInput):
 
 
 @router.put("/game/confirm-card/")
-async def confirm_card(data: CardActionInput):
+def confirm_card(
+    data: CardActionInput, identity: auth.Identity = Depends(auth.get_identity)
+):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
 
             idappuser, _ = db_connector.get_appuser(
-                cursor, external_id=data.external_id
+                cursor, external_id=data.external_id, identity=identity
             )
             update_query = sql.SQL(
                 """
                 UPDATE game_card
                 SET updatedby = %s, finished_time = CURRENT_TIMESTAMP
                 WHERE player = %s AND idgame_card = %s AND game_card.deleted = FALSE
+                RETURNING game
                 """
             )
             cursor.execute(update_query, (idappuser, idappuser, data.idgame_card))
+            confirmed = cursor.fetchone()
+            if confirmed:
+                record_game_change(
+                    cursor, confirmed[0], "card_confirmed", data.idgame_card
+                )
             connection.commit()
 
     except (Exception, psycopg2.Error) as error:
@@ -487,12 +979,14 @@ async def confirm_card(data: CardActionInput):
 
 
 @router.put("/game/skip-card/")
-async def skip_card(data: CardActionInput):
+def skip_card(
+    data: CardActionInput, identity: auth.Identity = Depends(auth.get_identity)
+):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
             idappuser, _ = db_connector.get_appuser(
-                cursor, external_id=data.external_id
+                cursor, external_id=data.external_id, identity=identity
             )
             query_skips = """
                 SELECT skips_left
@@ -512,17 +1006,26 @@ async def skip_card(data: CardActionInput):
                 UPDATE game_card
                 SET updatedby = %s, skipped = TRUE
                 WHERE performer = %s AND idgame_card = %s AND game_card.deleted = FALSE
+                RETURNING game
                 """
             )
             cursor.execute(update_query, (idappuser, idappuser, data.idgame_card))
-
-            update_query = sql.SQL(
-                """
-                UPDATE game_appuser SET skips_left = skips_left - 1
-                WHERE appuser = %s AND skips_left > 0
-                """
-            )
-            cursor.execute(update_query, (idappuser,))
+            skipped = cursor.fetchone()
+            if skipped:
+                update_query = sql.SQL(
+                    """
+                    UPDATE game_appuser SET skips_left = skips_left - 1
+                    WHERE appuser = %s AND game = %s AND skips_left > 0
+                    """
+                )
+                cursor.execute(update_query, (idappuser, skipped[0]))
+                record_game_change(
+                    cursor,
+                    skipped[0],
+                    "card_skipped",
+                    data.idgame_card,
+                    appusers=[idappuser],
+                )
             connection.commit()
 
     except psycopg2.Error as error:
@@ -533,10 +1036,14 @@ async def skip_card(data: CardActionInput):
 
 
 @router.delete("/game/")
-async def delete_game(idgame: int, external_id: str):
+def delete_game(
+    idgame: int,
+    external_id: str,
+    identity: auth.Identity = Depends(auth.get_identity),
+):
     try:
         db_connector.delete_object(
-            table="game", idobject=idgame, external_id=external_id
+            table="game", idobject=idgame, external_id=external_id, identity=identity
         )
 
     except (Exception, psycopg2.Error) as error:
@@ -0,0 +1,36 @@
+import hashlib
+import json
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def digest(body) -> str:
+    """md5 of a JSON response body, for responses without a version."""
+    encoded = json.dumps(body, default=str, sort_keys=True, separators=(",", ":"))
+    return hashlib.md5(encoded.encode()).hexdigest()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    # Cached copies must be revalidated, which is what makes them cheap
+    response.headers["Cache-Control"] = "no-cache"
+
+
+def not_modified(etag: str) -> Response:
+    response = Response(status_code=304)
+    set_etag(response, etag)
+    return response
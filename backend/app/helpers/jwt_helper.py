@@ -1,13 +1,31 @@
 import os
+from datetime import datetime, timedelta
 
 import jwt
 
+# Claims are trusted until the token expires, so this bounds how long a
+# deleted user or a revoked admin role keeps working
+JWT_TTL_HOURS = float(os.environ.get("JWT_TTL_HOURS", 24))
 
-def create_jwt(payload, roles=["User"]):
+
+def create_jwt(payload, roles=["User"], idappuser=None, username=None):
     payload_dict = payload.__dict__
     payload_dict["timestamp"] = payload_dict["timestamp"].strftime("%Y-%m-%dT%H:%M:%SZ")
     payload_dict["expires_at"] = payload_dict["expires_at"].strftime(
         "%Y-%m-%dT%H:%M:%SZ"
     )
     payload_dict["roles"] = roles
+    payload_dict["idappuser"] = idappuser
+    payload_dict["username"] = username
+    payload_dict["exp"] = datetime.utcnow() + timedelta(hours=JWT_TTL_HOURS)
     return jwt.encode(payload_dict, os.environ["JWT_SECRET_KEY"], algorithm="HS256")
+
+
+def decode_jwt(token: str, require_exp: bool = True) -> dict:
+    """Checks the signature and expiry, raises jwt.InvalidTokenError if either fails."""
+    return jwt.decode(
+        token,
+        os.environ["JWT_SECRET_KEY"],
+        algorithms=["HS256"],
+        options={"require": ["exp"] if require_exp else []},
+    )
@@ -1,9 +1,24 @@
 import os
 
-import requests
+import httpx
+from app import http_client
 
+ONESIGNAL_API_URL = os.environ.get(
+    "ONESIGNAL_API_URL", "https://onesignal.com/api/v1/notifications"
+)
+# OneSignal's limit on include_player_ids per request
+MAX_PLAYER_IDS = 2000
 
-def send_notification_to_users(user_ids, message):
+
+class OneSignalError(Exception):
+    def __init__(self, message, retryable=True, attempted=True):
+        super().__init__(message)
+        self.retryable = retryable
+        # False when the request was never sent, e.g. the breaker was open
+        self.attempted = attempted
+
+
+async def send_notification_to_users(user_ids, message):
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Basic {os.environ['ONESIGNAL_API_KEY']}",
@@ -15,11 +30,58 @@ def send_notification_to_users(user_ids, message):
         "contents": {"en": message},
     }
 
-    response = requests.post(
-        "https://onesignal.com/api/v1/notifications", json=data, headers=headers
-    )
+    try:
+        response = await http_client.client.request(
+            "onesignal", "POST", ONESIGNAL_API_URL, json=data, headers=headers
+        )
+    except http_client.CircuitOpenError as error:
+        raise OneSignalError(f"OneSignal: Not sent: {error}", attempted=False)
+    except (httpx.HTTPError, http_client.OutboundError) as error:
+        raise OneSignalError(f"OneSignal: Request failed: {error!r}")
 
     if response.status_code == 200:
         print("OneSignal: Notification sent successfully")
-    else:
-        print("OneSignal: Failed to send notification")
+        return response.json()
+
+    # Rate limits and server errors are worth another attempt, other client
+    # errors will fail the same way again
+    retryable = response.status_code == 429 or response.status_code >= 500
+    raise OneSignalError(
+        f"OneSignal: Failed to send notification: {response.status_code} "
+        f"{response.text[:200]}",
+        retryable=retryable,
+    )
+
+
+def coalesce_notifications(notifications):
+    """Merges (key, user_ids, message) notifications into OneSignal requests.
+
+    Every user gets one message: their only one, or the newest with a count
+    of the others. Users with the same message share requests of up to
+    MAX_PLAYER_IDS. Returns (message, user_ids, keys) per request, keys being
+    the notifications that request delivers to.
+    """
+    messages_by_user = {}
+    for key, user_ids, message in notifications:
+        for user_id in user_ids:
+            messages = messages_by_user.setdefault(user_id, {})
+            # Re-inserted so the newest message ends up last
+            messages[message] = messages.pop(message, []) + [key]
+
+    users_by_message = {}
+    for user_id, messages in messages_by_user.items():
+        texts = list(messages)
+        message = texts[-1]
+        if len(texts) > 1:
+            message = f"{message} (+{len(texts) - 1} more)"
+
+        user_ids, keys = users_by_message.setdefault(message, ([], set()))
+        user_ids.append(user_id)
+        for message_keys in messages.values():
+            keys.update(message_keys)
+
+    return [
+        (message, user_ids[start : start + MAX_PLAYER_IDS], sorted(keys))
+        for message, (user_ids, keys) in users_by_message.items()
+        for start in range(0, len(user_ids), MAX_PLAYER_IDS)
+    ]
@@ -0,0 +1,35 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(createdtime: datetime, idobject: int) -> str:
+    cursor = json.dumps([createdtime.isoformat(), idobject])
+    return base64.urlsafe_b64encode(cursor.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        createdtime, idobject = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(createdtime), int(idobject)
+    except (ValueError, TypeError) as error:
+        raise HTTPException(status_code=422, detail="Invalid cursor") from error
+
+
+def next_cursor(rows: list, limit: int, createdtime_index: int, id_index: int):
+    """Cursor for the page after rows, or None when rows is the last page.
+
+    Pages are fetched with limit + 1 rows so the extra row tells whether there
+    is more; it is removed from rows here.
+    """
+    if limit is None or len(rows) <= limit:
+        return None
+
+    del rows[limit:]
+    last = rows[-1]
+    return encode_cursor(last[createdtime_index], last[id_index])
@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+
+import anyio
+
+
+class StreamReader:
+    """File-like view of an async byte stream such as Request.stream().
+
+    For blocking readers like cursor.copy_expert running in a worker thread,
+    each read() waits for the next chunks on the event loop, so no more than
+    one chunk of the body is held in memory.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream.__aiter__()
+        self._buffer = b""
+        self._done = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            chunk = anyio.from_thread.run(self._next_chunk)
+            if chunk is None:
+                self._done = True
+            else:
+                self._buffer += chunk
+
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    async def _next_chunk(self):
+        try:
+            return await self._stream.__anext__()
+        except StopAsyncIteration:
+            return None
+
+
+def format_rows(rows: list, columns: list, format: str) -> str:
+    """Rows as CSV lines or NDJSON objects, without a CSV header."""
+    if format == "ndjson":
+        return "".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+            for row in rows
+        )
+
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue()
@@ -0,0 +1,40 @@
+import bisect
+import threading
+
+# Upper bounds in seconds, from a cached lookup to a slow outbound call
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label values.
+
+    The Prometheus histogram, rendered by app.metrics.
+    """
+
+    def __init__(self, buckets: tuple = DURATION_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def series(self) -> dict:
+        """(cumulative bucket counts, sum, count) by label values."""
+        with self._lock:
+            snapshot = {
+                labels: (list(counts), total, count)
+                for labels, (counts, total, count) in self._series.items()
+            }
+        for labels, (counts, total, count) in snapshot.items():
+            for i in range(1, len(counts)):
+                counts[i] += counts[i - 1]
+        return snapshot
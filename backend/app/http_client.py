@@ -0,0 +1,261 @@
+import asyncio
+import time
+from collections import deque
+
+import httpx
+from app import http_client_params
+from app.histogram import Histogram
+
+# Recent calls per service kept for the latency percentiles
+LATENCY_WINDOW = 1000
+
+
+class OutboundError(Exception):
+    pass
+
+
+class CircuitOpenError(OutboundError):
+    pass
+
+
+class DeadlineExceededError(OutboundError):
+    pass
+
+
+class CircuitBreaker:
+    """Stops calling a service after failure_threshold failures in a row.
+
+    While open every call fails at once. After reset_seconds one trial call
+    is let through, its outcome closes the breaker or opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    def available(self) -> bool:
+        if self.state == self.OPEN:
+            return time.monotonic() - self._opened_at >= self.reset_seconds
+        return self.state == self.CLOSED or not self._trial_running
+
+    def before_call(self):
+        if not self.available():
+            self.rejected += 1
+            raise CircuitOpenError("Circuit breaker is open")
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self._trial_running = True
+
+    def cancel(self):
+        self._trial_running = False
+
+    def record(self, failed: bool):
+        self._trial_running = False
+        if not failed:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            return
+
+        self.consecutive_failures += 1
+        if (
+            self.state == self.HALF_OPEN
+            or self.consecutive_failures >= self.failure_threshold
+        ):
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+class OutboundClient:
+    """Shared keep-alive HTTP client for every call to another service.
+
+    One httpx.AsyncClient per worker, opened and closed in the app lifespan,
+    so OneSignal and Passwordless requests reuse TLS connections. At most
+    concurrency calls are in flight at once, the rest wait for a slot.
+
+    Every call has a deadline, waiting for a slot included, and goes through
+    the service's circuit breaker, so a slow or failing service costs a
+    request a bounded wait and nothing once the breaker has opened.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: float = 3.0,
+        timeout: float = 10.0,
+        concurrency: int = 20,
+        deadlines: dict = None,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.concurrency = concurrency
+        self.default_deadline = timeout
+        self.deadlines = dict(deadlines or {})
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self._client = None
+        self._semaphore = None
+        self._in_flight = 0
+        self._waiting = 0
+        self._services = {}
+        self._breakers = {}
+        # Call latency by (service,), for app.metrics
+        self.latency = Histogram()
+
+    async def start(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+
+    async def stop(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    def breaker(self, service: str) -> CircuitBreaker:
+        if service not in self._breakers:
+            self._breakers[service] = CircuitBreaker(
+                self.failure_threshold, self.reset_seconds
+            )
+        return self._breakers[service]
+
+    def available(self, service: str) -> bool:
+        return self.breaker(service).available()
+
+    async def request(
+        self, service: str, method: str, url: str, deadline: float = None, **kwargs
+    ):
+        if self._client is None:
+            raise RuntimeError("Outbound HTTP client is not started")
+
+        # Listed in stats even if the breaker rejects every call
+        self._counters(service)
+        breaker = self.breaker(service)
+        breaker.before_call()
+        deadline = deadline or self.deadlines.get(service, self.default_deadline)
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self._send(method, url, **kwargs), deadline
+            )
+        except asyncio.TimeoutError:
+            self._record(service, started, error=True, timeout=True)
+            raise DeadlineExceededError(f"{service} did not answer in {deadline}s")
+        except httpx.HTTPError:
+            self._record(service, started, error=True)
+            raise
+        except BaseException:
+            # Cancelled by the caller, which says nothing about the service
+            breaker.cancel()
+            raise
+
+        self._record(service, started, error=response.status_code >= 500)
+        return response
+
+    async def _send(self, method: str, url: str, **kwargs):
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        try:
+            return await self._client.request(method, url, **kwargs)
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    def _counters(self, service: str) -> dict:
+        return self._services.setdefault(
+            service,
+            {
+                "requests": 0,
+                "errors": 0,
+                "timeouts": 0,
+                "seconds": 0.0,
+                "latencies": deque(maxlen=LATENCY_WINDOW),
+            },
+        )
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "services": {
+                service: {
+                    **service_stats(counters),
+                    **breaker_stats(self.breaker(service)),
+                }
+                for service, counters in self._services.items()
+            },
+        }
+
+    def _record(self, service: str, started: float, error: bool, timeout=False):
+        self.breaker(service).record(failed=error)
+
+        seconds = time.perf_counter() - started
+        self.latency.observe((service,), seconds)
+        counters = self._counters(service)
+        counters["requests"] += 1
+        counters["errors"] += error
+        counters["timeouts"] += timeout
+        counters["seconds"] += seconds
+        counters["latencies"].append(seconds)
+
+
+def service_stats(counters: dict) -> dict:
+    latencies = sorted(counters["latencies"])
+
+    def percentile(share):
+        if not latencies:
+            return None
+        return round(
+            latencies[min(int(len(latencies) * share), len(latencies) - 1)] * 1000, 1
+        )
+
+    return {
+        "requests": counters["requests"],
+        "errors": counters["errors"],
+        "timeouts": counters["timeouts"],
+        "mean_ms": round(counters["seconds"] / counters["requests"] * 1000, 1)
+        if counters["requests"]
+        else None,
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+    }
+
+
+def breaker_stats(breaker: CircuitBreaker) -> dict:
+    return {
+        "breaker": breaker.state,
+        "consecutive_failures": breaker.consecutive_failures,
+        "breaker_opened": breaker.opened,
+        "rejected": breaker.rejected,
+    }
+
+
+client = OutboundClient(**http_client_params)
@@ -0,0 +1,239 @@
+"""Prometheus text format metrics, served by GET /metrics in app.api.
+
+MetricsMiddleware times every request by route template. The other metrics
+are read from the stats the pool, caches, outbox worker and outbound client
+already keep when /metrics is scraped. Scrapes need METRICS_TOKEN.
+"""
+import os
+import secrets
+import time
+
+from app import catalog, db_connector, http_client, notifications, query_stats
+from app.histogram import Histogram
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.routing import Match
+
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+request_latency = Histogram()
+requests_in_flight = {}
+
+
+class MetricsMiddleware:
+    """Counts in-flight requests and their latency per method and route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels = (scope["method"], route_template(scope))
+        status = []
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            await send(message)
+
+        requests_in_flight[labels] = requests_in_flight.get(labels, 0) + 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            requests_in_flight[labels] -= 1
+            request_latency.observe(
+                labels + (str(status[0]) if status else "500",),
+                time.perf_counter() - started,
+            )
+
+
+def route_template(scope) -> str:
+    """The path the route was declared with, so ids do not become labels."""
+    partial = None
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+
+def check_scraper(request: Request):
+    """Scrapers send METRICS_TOKEN as a bearer token.
+
+    /metrics skips the API key, so without a METRICS_TOKEN it is not served.
+    """
+    token = os.environ.get("METRICS_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Metrics are not enabled")
+    authorization = request.headers.get("authorization", "")
+    if not secrets.compare_digest(authorization, f"Bearer {token}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def sample(name: str, labels: dict, value) -> str:
+    if labels:
+        pairs = ",".join(f'{key}="{escape(label)}"' for key, label in labels.items())
+        name = f"{name}{{{pairs}}}"
+    return f"{name} {value}"
+
+
+def metric(lines: list, name: str, kind: str, help: str, samples: list):
+    """Appends one metric from (labels, value) samples, suffixes in the labels."""
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        suffix = labels.pop("__suffix", "")
+        lines.append(sample(name + suffix, labels, value))
+
+
+def histogram_samples(histogram: Histogram, label_names: tuple) -> list:
+    samples = []
+    for labels, (counts, total, count) in sorted(histogram.series().items()):
+        named = dict(zip(label_names, labels))
+        for bound, bucket_count in zip(histogram.buckets, counts):
+            samples.append(
+                ({**named, "le": bound, "__suffix": "_bucket"}, bucket_count)
+            )
+        samples.append(({**named, "le": "+Inf", "__suffix": "_bucket"}, count))
+        samples.append(({**named, "__suffix": "_sum"}, round(total, 6)))
+        samples.append(({**named, "__suffix": "_count"}, count))
+    return samples
+
+
+def stats_metrics(lines: list, prefix: str, stats: dict, counters: tuple, help: str):
+    """Numeric stats as gauges, the ones named in counters as counters."""
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if key in counters:
+            metric(lines, f"{prefix}_{key}_total", "counter", help, [({}, value)])
+        else:
+            metric(lines, f"{prefix}_{key}", "gauge", help, [({}, value)])
+
+
+def render() -> str:
+    lines = []
+    metric(
+        lines,
+        "uptome_http_requests_in_flight",
+        "gauge",
+        "Requests being handled by this worker.",
+        [
+            ({"method": method, "route": route}, count)
+            for (method, route), count in sorted(requests_in_flight.items())
+        ],
+    )
+    metric(
+        lines,
+        "uptome_http_request_duration_seconds",
+        "histogram",
+        "Request latency by route and status.",
+        histogram_samples(request_latency, ("method", "route", "status")),
+    )
+
+    stats_metrics(
+        lines,
+        "uptome_db_pool",
+        db_connector.pool_stats(),
+        (
+            "connections_created",
+            "connections_closed",
+            "acquired",
+            "acquire_timeouts",
+            "acquire_wait_seconds",
+        ),
+        "Database connection pool of this worker.",
+    )
+    metric(
+        lines,
+        "uptome_db_statements_total",
+        "counter",
+        "SQL statements run per table.",
+        [
+            ({"table": table}, count)
+            for table, count in sorted(query_stats.table_statements.items())
+        ],
+    )
+    stats_metrics(
+        lines,
+        "uptome_appuser_cache",
+        db_connector.appuser_cache.stats(),
+        ("hits", "misses", "expired", "evicted", "invalidated"),
+        "Per worker appuser cache.",
+    )
+    stats_metrics(
+        lines,
+        "uptome_catalog",
+        catalog.catalog.stats(),
+        ("loads",),
+        "Public deck and card catalog.",
+    )
+    stats_metrics(
+        lines,
+        "uptome_notification_outbox",
+        notifications.worker.stats(),
+        (
+            "claimed",
+            "sent",
+            "retried",
+            "failed",
+            "deferred",
+            "errors",
+            "receivers",
+            "messages",
+            "requests",
+        ),
+        "Push notification outbox worker.",
+    )
+
+    outbound = http_client.client.stats()
+    services = outbound["services"]
+    for key, help in [
+        ("requests", "Outbound calls per service."),
+        ("errors", "Outbound calls that failed, timeouts included."),
+        ("timeouts", "Outbound calls that passed their deadline."),
+        ("rejected", "Outbound calls refused by an open circuit breaker."),
+    ]:
+        metric(
+            lines,
+            f"uptome_outbound_{key}_total",
+            "counter",
+            help,
+            [({"service": service}, stats[key]) for service, stats in services.items()],
+        )
+    metric(
+        lines,
+        "uptome_outbound_circuit_open",
+        "gauge",
+        "1 while the circuit breaker of the service is not closed.",
+        [
+            ({"service": service}, int(stats["breaker"] != "closed"))
+            for service, stats in services.items()
+        ],
+    )
+    metric(
+        lines,
+        "uptome_outbound_in_flight",
+        "gauge",
+        "Outbound calls being made.",
+        [({}, outbound["in_flight"])],
+    )
+    metric(
+        lines,
+        "uptome_outbound_duration_seconds",
+        "histogram",
+        "Outbound call latency per service.",
+        histogram_samples(http_client.client.latency, ("service",)),
+    )
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,155 @@
+"""Applies the SQL files in backend/migrations that have not run yet.
+
+    python -m app.migrations          apply the pending migrations
+    python -m app.migrations --list   show which migrations have run
+
+Files are named NNN_description.sql and run in version order, each in its
+own transaction together with its schema_migration row. Migrations use
+IF NOT EXISTS, so a database migrated by hand before schema_migration
+existed can be brought under the runner by running them all again.
+
+Files starting with "-- migrate: no-transaction" run statement by statement
+outside a transaction instead, for CREATE INDEX CONCURRENTLY. A build that
+fails leaves an INVALID index which IF NOT EXISTS then skips, so drop it
+before running the migration again.
+"""
+import argparse
+import hashlib
+import re
+from pathlib import Path
+
+import psycopg2
+from app import db_connection_params
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+# pg_advisory_lock key, so two deploys do not migrate at the same time
+MIGRATION_LOCK = 20240008
+NO_TRANSACTION = "-- migrate: no-transaction"
+
+CREATE_QUERY = """
+    CREATE TABLE IF NOT EXISTS schema_migration (
+        version INT PRIMARY KEY,
+        name VARCHAR ( 256 ) NOT NULL,
+        checksum VARCHAR ( 32 ) NOT NULL,
+        appliedtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def discover(directory: Path = MIGRATIONS_DIR) -> list:
+    """(version, name, sql) of every migration file, in version order."""
+    migrations = {}
+    for path in sorted(directory.glob("*.sql")):
+        match = MIGRATION_FILE.match(path.name)
+        if not match:
+            raise ValueError(f"Migration {path.name} is not named NNN_name.sql")
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Migration version {version} is used twice")
+        migrations[version] = (version, match.group(2), path.read_text())
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def checksum(migration_sql: str) -> str:
+    return hashlib.md5(migration_sql.encode()).hexdigest()
+
+
+def statements(migration_sql: str) -> list:
+    """The statements of a migration, split after lines ending in a semicolon.
+
+    Dollar quoted bodies such as DO blocks stay whole. Comments are kept with
+    the statement that follows them.
+    """
+    found = []
+    lines = []
+    quoted = False
+    for line in migration_sql.splitlines():
+        lines.append(line)
+        if line.count("$$") % 2:
+            quoted = not quoted
+        if not quoted and line.rstrip().endswith(";"):
+            found.append("\n".join(lines).strip())
+            lines = []
+    if any(line.strip() and not line.strip().startswith("--") for line in lines):
+        found.append("\n".join(lines).strip())
+    return found
+
+
+def applied(cursor) -> dict:
+    """Checksum of every applied migration by version."""
+    cursor.execute("SELECT version, checksum FROM schema_migration")
+    return dict(cursor.fetchall())
+
+
+def migrate(connection, migrations: list) -> list:
+    """Applies the migrations that have not run and returns their versions."""
+    cursor = connection.cursor()
+    with connection:
+        cursor.execute(CREATE_QUERY)
+
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK,))
+    try:
+        done = applied(cursor)
+        connection.commit()
+
+        migrated = []
+        for version, name, migration_sql in migrations:
+            if version in done:
+                if done[version] != checksum(migration_sql):
+                    print(f"Migration {version} {name} changed after it was applied")
+                continue
+
+            no_transaction = migration_sql.startswith(NO_TRANSACTION)
+            if no_transaction:
+                connection.autocommit = True
+                try:
+                    for statement in statements(migration_sql):
+                        cursor.execute(statement)
+                finally:
+                    connection.autocommit = False
+            with connection:
+                if not no_transaction:
+                    cursor.execute(migration_sql)
+                cursor.execute(
+                    "INSERT INTO schema_migration (version, name, checksum) "
+                    "VALUES (%s, %s, %s)",
+                    (version, name, checksum(migration_sql)),
+                )
+            print(f"Applied migration {version} {name}")
+            migrated.append(version)
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK,))
+        connection.commit()
+
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--list", action="store_true", help="show the migrations and exit"
+    )
+    args = parser.parse_args()
+
+    migrations = discover()
+    connection = psycopg2.connect(**db_connection_params)
+    try:
+        if args.list:
+            cursor = connection.cursor()
+            cursor.execute(CREATE_QUERY)
+            done = applied(cursor)
+            for version, name, _ in migrations:
+                print(
+                    f"{version:03} {name}: {'applied' if version in done else 'pending'}"
+                )
+            return
+
+        migrated = migrate(connection, migrations)
+        print(f"Applied {len(migrated)} migrations")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import asyncio
+import random
+
+from app import db_connector, http_client, notification_params
+from app.helpers import onesignal_helper
+from app.query_stats import execute_values
+from fastapi.concurrency import run_in_threadpool
+
+# A claimed row is retried by any worker once its lease runs out, so a crash
+# mid-delivery delays a notification instead of losing it
+LEASE_SECONDS = 60
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 3600
+
+
+def enqueue(cursor, receivers: list, message: str):
+    """Queues a push in the caller's transaction, it is only sent on commit.
+
+    It becomes due after the worker's coalesce window. Claiming a due push
+    also claims the pending ones to the same receivers, so pushes queued
+    within a window of each other are merged into as few requests as possible.
+    """
+    receivers = [receiver for receiver in receivers if receiver]
+    if not receivers:
+        return
+    cursor.execute(
+        """
+        INSERT INTO notification_outbox (receivers, message, next_attempt_time)
+        VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+        """,
+        (receivers, message, worker.coalesce_seconds),
+    )
+
+
+def enqueue_for_appusers(cursor, appusers: list, message: str):
+    cursor.execute(
+        """
+        INSERT INTO notification_outbox (receivers, message, next_attempt_time)
+        SELECT array_agg(onesignal_id), %s,
+        CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+        FROM appuser
+        WHERE idappuser = ANY(%s) AND onesignal_id IS NOT NULL AND onesignal_id <> ''
+        HAVING COUNT(1) > 0
+        """,
+        (message, worker.coalesce_seconds, list(appusers)),
+    )
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1)
+
+
+CLAIM_QUERY = """
+    WITH due AS (
+        SELECT idnotification_outbox, receivers
+        FROM notification_outbox
+        WHERE sent_time IS NULL AND failed_time IS NULL
+        AND next_attempt_time <= CURRENT_TIMESTAMP
+        ORDER BY next_attempt_time
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    -- Pushes to the same users that are still in their coalesce window are
+    -- merged with the due ones instead of going out on their own moments later
+    early AS (
+        SELECT idnotification_outbox
+        FROM notification_outbox
+        WHERE sent_time IS NULL AND failed_time IS NULL AND attempts = 0
+        AND next_attempt_time > CURRENT_TIMESTAMP
+        AND next_attempt_time
+            <= CURRENT_TIMESTAMP + %(coalesce)s * INTERVAL '1 second'
+        AND receivers && ARRAY(SELECT unnest(receivers) FROM due)
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE notification_outbox
+    SET attempts = attempts + 1, updatedtime = CURRENT_TIMESTAMP,
+    next_attempt_time = CURRENT_TIMESTAMP + %(lease)s * INTERVAL '1 second'
+    WHERE idnotification_outbox IN (
+        SELECT idnotification_outbox FROM due
+        UNION ALL
+        SELECT idnotification_outbox FROM early
+    )
+    RETURNING idnotification_outbox, receivers, message, attempts
+"""
+
+
+def claim(cursor, limit: int, coalesce_seconds: float) -> list:
+    """Leases up to limit due rows and the pending pushes to their receivers."""
+    cursor.execute(
+        CLAIM_QUERY,
+        {"lease": LEASE_SECONDS, "limit": limit, "coalesce": coalesce_seconds},
+    )
+    # Oldest first, so coalescing keeps the newest message
+    return sorted(cursor.fetchall())
+
+
+# Rows that were never sent give back the attempt the claim counted
+RESULT_QUERY = """
+    UPDATE notification_outbox AS o SET
+        updatedtime = CURRENT_TIMESTAMP,
+        sent_time = CASE WHEN r.sent THEN CURRENT_TIMESTAMP END,
+        failed_time = CASE WHEN r.failed THEN CURRENT_TIMESTAMP END,
+        next_attempt_time = CURRENT_TIMESTAMP + r.delay * INTERVAL '1 second',
+        attempts = o.attempts - CASE WHEN r.attempted THEN 0 ELSE 1 END,
+        last_error = r.error
+    FROM (VALUES %s) AS r (id, sent, failed, delay, error, attempted)
+    WHERE o.idnotification_outbox = r.id
+"""
+
+
+def outcome_rank(error) -> int:
+    """Orders request outcomes from sent to permanently failed."""
+    if error is None:
+        return 0
+    if not error.attempted:
+        return 1
+    return 2 if error.retryable else 3
+
+
+class OutboxWorker:
+    """Delivers notification_outbox rows to OneSignal in the background.
+
+    Every uvicorn worker runs one. Rows are claimed with SKIP LOCKED, so the
+    workers share the outbox without sending a notification twice.
+    """
+
+    def __init__(
+        self,
+        poll_seconds: float = 1.0,
+        coalesce_seconds: float = 2.0,
+        batch_size: int = 500,
+        max_attempts: int = 8,
+    ):
+        self.poll_seconds = poll_seconds
+        self.coalesce_seconds = coalesce_seconds
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+        self._task = None
+        self._loop = None
+        self._wakeup = None
+        self._counters = {
+            "claimed": 0,
+            "sent": 0,
+            "retried": 0,
+            "failed": 0,
+            # Claimed but not sent because OneSignal's breaker was open
+            "deferred": 0,
+            "errors": 0,
+            # Receivers of the claimed rows, the messages they were merged
+            # into and the OneSignal requests those took
+            "receivers": 0,
+            "messages": 0,
+            "requests": 0,
+        }
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Drains the outbox when the coalesce window has passed, thread safe."""
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(
+                self._loop.call_later, self.coalesce_seconds, self._wakeup.set
+            )
+
+    def stats(self) -> dict:
+        receivers = self._counters["receivers"]
+        return {
+            "running": self._task is not None,
+            **self._counters,
+            "coalesced": receivers - self._counters["messages"],
+            "coalesce_ratio": round(self._counters["messages"] / receivers, 3)
+            if receivers
+            else None,
+        }
+
+    async def drain(self, limit: int = None) -> int:
+        notifications = await run_in_threadpool(self._claim, limit or self.batch_size)
+        if not notifications:
+            return 0
+
+        requests = onesignal_helper.coalesce_notifications(
+            (idnotification, receivers, message)
+            for idnotification, receivers, message, _ in notifications
+        )
+        self._counters["claimed"] += len(notifications)
+        self._counters["receivers"] += sum(
+            len(receivers) for _, receivers, _, _ in notifications
+        )
+        self._counters["messages"] += sum(len(user_ids) for _, user_ids, _ in requests)
+        self._counters["requests"] += len(requests)
+
+        errors = await asyncio.gather(
+            *(self._send(message, user_ids) for message, user_ids, _ in requests)
+        )
+        # A notification merged into several requests takes the worst outcome
+        notification_errors = {}
+        for (_, _, keys), error in zip(requests, errors):
+            for key in keys:
+                if outcome_rank(error) > outcome_rank(notification_errors.get(key)):
+                    notification_errors[key] = error
+
+        results = [
+            self.result(
+                idnotification, attempts, notification_errors.get(idnotification)
+            )
+            for idnotification, _, _, attempts in notifications
+        ]
+        await run_in_threadpool(self._record, results)
+        return len(notifications)
+
+    def result(self, idnotification, attempts, error):
+        """The notification_outbox update for one delivery attempt."""
+        if error is None:
+            self._counters["sent"] += 1
+            return (idnotification, True, False, 0, None, True)
+        if not error.attempted:
+            # Due again at once, the claim only goes ahead once the breaker lets it
+            self._counters["deferred"] += 1
+            return (idnotification, False, False, 0, str(error), False)
+        if error.retryable and attempts < self.max_attempts:
+            self._counters["retried"] += 1
+            return (
+                idnotification,
+                False,
+                False,
+                backoff_seconds(attempts),
+                str(error),
+                True,
+            )
+        self._counters["failed"] += 1
+        return (idnotification, False, True, 0, str(error), True)
+
+    async def _run(self):
+        while True:
+            try:
+                # Keep going while full batches come back. Nothing is claimed
+                # while OneSignal's breaker is open, and rows it rejects give
+                # their attempt back, so an outage does not use up the
+                # notifications' attempts.
+                while True:
+                    limit = self.claim_limit()
+                    if not limit or await self.drain(limit) < limit:
+                        break
+            except Exception as error:
+                self._counters["errors"] += 1
+                print("Notification outbox error:", error)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def claim_limit(self) -> int:
+        breaker = http_client.client.breaker("onesignal")
+        if not breaker.available():
+            return 0
+        # Only the trial call gets through a half open breaker, so a single
+        # row probes whether OneSignal is back
+        return self.batch_size if breaker.state == breaker.CLOSED else 1
+
+    async def _send(self, message, user_ids):
+        try:
+            await onesignal_helper.send_notification_to_users(user_ids, message)
+        except onesignal_helper.OneSignalError as error:
+            print(error)
+            return error
+
+    def _claim(self, limit: int):
+        with db_connector.get_connection() as connection:
+            return claim(connection.cursor(), limit, self.coalesce_seconds)
+
+    def _record(self, results):
+        with db_connector.get_connection() as connection:
+            execute_values(
+                connection.cursor(),
+                RESULT_QUERY,
+                results,
+                template="(%s::int, %s::bool, %s::bool, %s::float, %s::text, %s::bool)",
+            )
+
+
+worker = OutboxWorker(**notification_params)
@@ -2,9 +2,10 @@ import uuid
 from datetime import datetime, timedelta
 
 import psycopg2
-from app import db_connection_params
+from app import auth, db_connector, http_client
 from app.helpers import jwt_helper
 from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from passwordless import (
     PasswordlessError,
     RegisteredToken,
@@ -34,41 +35,55 @@ class RegisteredTokenUserId(RegisteredToken):
     userid: str
 
 
-@router.post("/passwordless/login")
-async def login(token: str):
+def get_appuser_claims(external_id: str):
+    """The idappuser, username and roles that go into the login JWT."""
+    roles = ["User"]
     try:
-        verify_sign_in = VerifySignIn(token)
-        response_data: VerifiedUser = api_bp.api_client.sign_in(verify_sign_in)
-        roles = ["User"]
-        try:
-            with psycopg2.connect(**db_connection_params) as connection:
-                cursor = connection.cursor()
-                get_query = sql.SQL(
-                    "SELECT is_admin FROM appuser WHERE external_id = %s LIMIT 1"
-                )
+        with db_connector.get_connection() as connection:
+            cursor = connection.cursor()
+            get_query = sql.SQL(
+                "SELECT idappuser, username, is_admin FROM appuser "
+                "WHERE deleted = FALSE AND external_id = %s LIMIT 1"
+            )
 
-                cursor.execute(get_query, (response_data.user_id,))
-                appuser = cursor.fetchone()
+            cursor.execute(get_query, (external_id,))
+            appuser = cursor.fetchone()
 
-                if appuser[0] is True:
-                    roles.append("Admin")
+    except (Exception, psycopg2.Error) as error:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
+
+    # Signed in before the appuser row exists, handlers look it up instead
+    if not appuser:
+        return {"roles": roles}
 
-        except (Exception, psycopg2.Error) as error:
-            raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
+    idappuser, username, is_admin = appuser
+    if is_admin is True:
+        roles.append(auth.ADMIN_ROLE)
+    return {"idappuser": idappuser, "username": username, "roles": roles}
+
+
+@router.post("/passwordless/login")
+async def login(token: str):
+    try:
+        verify_sign_in = VerifySignIn(token)
+        response_data: VerifiedUser = await api_bp.api_client.sign_in(verify_sign_in)
+        claims = await run_in_threadpool(get_appuser_claims, response_data.user_id)
 
-        return {"jwt": jwt_helper.create_jwt(payload=response_data, roles=roles)}
+        return {"jwt": jwt_helper.create_jwt(payload=response_data, **claims)}
     except PasswordlessError as e:
         print(str(e.problem_details))
         raise HTTPException(status_code=400, detail=e.problem_details)
+    except http_client.OutboundError as e:
+        print(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(str(e))
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.post("/passwordless/register")
-async def register(request_data: RegisterInput):
+def check_username(username: str):
     try:
-        with psycopg2.connect(**db_connection_params) as connection:
+        with db_connector.get_connection() as connection:
             cursor = connection.cursor()
             get_query = sql.SQL(
                 """
@@ -80,7 +95,7 @@ async def register(request_data: RegisterInput):
             """
             )
 
-            cursor.execute(get_query, (request_data.username,))
+            cursor.execute(get_query, (username,))
             exists = cursor.fetchone()[0]
             if exists:
                 raise HTTPException(
@@ -91,15 +106,24 @@ async def register(request_data: RegisterInput):
         print(str(error))
         raise HTTPException(status_code=500, detail=f"Database error: {str(error)}")
 
+
+@router.post("/passwordless/register")
+async def register(request_data: RegisterInput):
+    await run_in_threadpool(check_username, request_data.username)
+
     new_user_id = str(uuid.uuid4())
     register_token = RegisterToken(
         user_id=new_user_id,
         username=request_data.email,
         expires_at=datetime.utcnow() + timedelta(minutes=2),
     )
-    response_data: RegisteredTokenUserId = api_bp.api_client.register_token(
-        register_token
-    )
+    try:
+        response_data: RegisteredTokenUserId = await api_bp.api_client.register_token(
+            register_token
+        )
+    except http_client.OutboundError as e:
+        print(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
     if response_data:
         return {"token": response_data.token, "userid": new_user_id}
     return response_data
@@ -107,41 +131,41 @@ async def register(request_data: RegisterInput):
 
 @router.post("/passwordless/alias")
 async def set_alias(request_data):
-    api_bp.api_client.set_alias(request_data.dict())
+    await api_bp.api_client.set_alias(request_data.dict())
     return None
 
 
 @router.get("/passwordless/alias/{user_id}")
 async def get_aliases(user_id: int):
-    response_data = api_bp.api_client.get_aliases(user_id)
+    response_data = await api_bp.api_client.get_aliases(user_id)
     return response_data
 
 
 @router.put("/passwordless/apps/feature")
 async def set_apps_feature(request_data):
-    api_bp.api_client.update_apps_feature(request_data.dict())
+    await api_bp.api_client.update_apps_feature(request_data.dict())
     return None
 
 
 @router.get("/passwordless/credentials/{user_id}")
 async def get_credentials(user_id: int):
-    response_data = api_bp.api_client.get_credentials(user_id)
+    response_data = await api_bp.api_client.get_credentials(user_id)
     return response_data
 
 
 @router.delete("/passwordless/credentials")
 async def delete_credentials(request_data):
-    api_bp.api_client.delete_credential(request_data.dict())
+    await api_bp.api_client.delete_credential(request_data.dict())
     return None
 
 
 @router.get("/passwordless/users")
 async def get_users():
-    response_data = api_bp.api_client.get_users()
+    response_data = await api_bp.api_client.get_users()
     return {"users": response_data}
 
 
 @router.delete("/passwordless/users")
 async def delete_users(request_data):
-    api_bp.api_client.delete_user(request_data.dict())
+    await api_bp.api_client.delete_user(request_data.dict())
     return None
@@ -1,8 +1,24 @@
 import os
 
+import httpx
+from app import http_client
 from dotenv import load_dotenv
 from fastapi import FastAPI
-from passwordless import PasswordlessClientBuilder, PasswordlessOptions
+from passwordless import PasswordlessOptions
+from passwordless.client import handle_response_error
+from passwordless.serialization import (
+    AliasListResponseSchema,
+    CredentialListResponseSchema,
+    DeleteCredentialSchema,
+    DeleteUserSchema,
+    RegisteredTokenSchema,
+    RegisterTokenSchema,
+    SetAliasSchema,
+    UpdateAppsFeatureSchema,
+    UserSummaryListResponseSchema,
+    VerifiedUserSchema,
+    VerifySignInSchema,
+)
 
 load_dotenv()
 app = FastAPI()
@@ -25,10 +41,95 @@ class PasswordlessBlueprint:
         )
 
 
+class AsyncPasswordlessClient:
+    """The passwordless.PasswordlessClient methods we use, as coroutines.
+
+    Requests and responses use the SDK's schemas and errors, but go through
+    the shared http_client instead of a blocking requests.Session.
+    """
+
+    def __init__(self, options: PasswordlessOptions):
+        self.options = options
+
+    async def set_alias(self, create_alias):
+        await self._post("/alias", SetAliasSchema().dumps(create_alias))
+
+    async def get_aliases(self, user_id):
+        response = await self._get("/alias/list", {"userId": user_id})
+        return AliasListResponseSchema().loads(response.text).values
+
+    async def update_apps_feature(self, update_apps_feature):
+        await self._post(
+            "/apps/features", UpdateAppsFeatureSchema().dumps(update_apps_feature)
+        )
+
+    async def delete_credential(self, delete_credential):
+        await self._post(
+            "/credentials/delete", DeleteCredentialSchema().dumps(delete_credential)
+        )
+
+    async def get_credentials(self, user_id):
+        response = await self._get("/credentials/list", {"userId": user_id})
+        return CredentialListResponseSchema().loads(response.text).values
+
+    async def register_token(self, register_token):
+        response = await self._post(
+            "/register/token", RegisterTokenSchema().dumps(register_token)
+        )
+        return RegisteredTokenSchema().loads(response.text)
+
+    async def sign_in(self, verify_sign_in):
+        response = await self._post(
+            "/signin/verify", VerifySignInSchema().dumps(verify_sign_in)
+        )
+        return VerifiedUserSchema().loads(response.text)
+
+    async def get_users(self):
+        response = await self._get("/users/list")
+        return UserSummaryListResponseSchema().loads(response.text).values
+
+    async def delete_user(self, delete_user):
+        await self._post("/users/delete", DeleteUserSchema().dumps(delete_user))
+
+    async def _get(self, path: str, params: dict = None):
+        return await self._send("GET", path, params=params or {})
+
+    async def _post(self, path: str, data: str):
+        return await self._send(
+            "POST",
+            path,
+            content=data,
+            headers={"Content-Type": "application/json; charset=UTF-8"},
+        )
+
+    async def _send(self, method: str, path: str, headers: dict = None, **kwargs):
+        request_headers = {"ApiSecret": self.options.api_secret}
+        request_headers.update(headers or {})
+        try:
+            response = await http_client.client.request(
+                "passwordless",
+                method,
+                self.options.api_url + path,
+                headers=request_headers,
+                **kwargs,
+            )
+        except httpx.HTTPError as error:
+            raise http_client.OutboundError(f"Passwordless: Request failed: {error!r}")
+        # Outages are OutboundErrors like timeouts and an open breaker, only
+        # rejected requests carry problem details
+        if response.status_code >= 500:
+            raise http_client.OutboundError(
+                f"Passwordless: Answered {response.status_code}"
+            )
+        if response.status_code >= 400:
+            handle_response_error(response)
+        return response
+
+
 class PasswordlessApiBlueprint(PasswordlessBlueprint):
     def __init__(self, app: FastAPI):
         super().__init__(app)
         passwordless_options = PasswordlessOptions(
             self.api_config.secret, self.api_config.url
         )
-        self.api_client = PasswordlessClientBuilder(passwordless_options).build()
+        self.api_client = AsyncPasswordlessClient(passwordless_options)
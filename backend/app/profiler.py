@@ -0,0 +1,212 @@
+"""Opt-in sampling profiles of single requests.
+
+An admin sends X-Profile: speedscope (or collapsed, for flamegraph.pl) with
+the login JWT. ProfilingMiddleware samples the stacks of the worker while
+that request runs, stores the profile in profiling_params["directory"] and
+names the file in the X-Profile-File response header. The file is then
+downloaded from GET /admin/profiles/{name}.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import jwt
+from app import auth, profiling_params
+from app.helpers import jwt_helper
+from fastapi.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+PROFILE_HEADER = b"x-profile"
+FORMATS = {"speedscope": "speedscope.json", "collapsed": "collapsed.txt"}
+PROFILE_NAME = re.compile(r"^[0-9a-f]{32}\.(speedscope\.json|collapsed\.txt)$")
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class SamplingProfiler:
+    """Samples the stack of every thread each interval_seconds.
+
+    Threads that never ran app code, like idle threadpool workers, are left
+    out of the profile. Other requests running on the same worker at the
+    same time show up as threads of their own.
+    """
+
+    def __init__(self, interval_seconds: float = 0.001):
+        self.interval_seconds = interval_seconds
+        self.samples = defaultdict(list)
+        self.weights = defaultdict(list)
+        self.seconds = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        started = previous = time.perf_counter()
+        while not self._stopped.wait(self.interval_seconds):
+            now = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                self.samples[ident].append(tuple(reversed(stack)))
+                self.weights[ident].append(now - previous)
+            previous = now
+        self.seconds = time.perf_counter() - started
+
+    def threads(self) -> dict:
+        """Samples and weights of the threads that ran app code, by thread name."""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        return {
+            f"{names.get(ident, 'thread')} {ident}": (samples, self.weights[ident])
+            for ident, samples in self.samples.items()
+            if any(
+                filename.startswith(APP_DIR)
+                for stack in samples
+                for _, filename, _ in stack
+            )
+        }
+
+    def speedscope(self, name: str) -> dict:
+        frames = {}
+        profiles = []
+        for thread, (samples, weights) in self.threads().items():
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": thread,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": self.seconds,
+                    "samples": [
+                        [frames.setdefault(frame, len(frames)) for frame in stack]
+                        for stack in samples
+                    ],
+                    "weights": weights,
+                }
+            )
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "uptome",
+            "activeProfileIndex": 0,
+            "shared": {
+                "frames": [
+                    {"name": function, "file": filename, "line": line}
+                    for function, filename, line in frames
+                ]
+            },
+            "profiles": profiles,
+        }
+
+    def collapsed(self) -> str:
+        """Folded stacks with sample counts, the flamegraph.pl input."""
+        counts = defaultdict(int)
+        for thread, (samples, _) in self.threads().items():
+            for stack in samples:
+                frames = [thread] + [
+                    f"{function} ({os.path.basename(filename)}:{line})"
+                    for function, filename, line in stack
+                ]
+                counts[";".join(frames)] += 1
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+def is_admin(headers: dict) -> bool:
+    authorization = headers.get(b"authorization", b"").decode()
+    if not authorization.startswith("Bearer "):
+        return False
+    try:
+        claims = jwt_helper.decode_jwt(authorization[len("Bearer ") :])
+    except jwt.InvalidTokenError:
+        return False
+    return auth.ADMIN_ROLE in claims.get("roles", [])
+
+
+def save(profiler: SamplingProfiler, format: str, name: str, title: str):
+    directory = profiling_params["directory"]
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), "w") as profile_file:
+        if format == "speedscope":
+            json.dump(profiler.speedscope(title), profile_file)
+        else:
+            profile_file.write(profiler.collapsed())
+
+    # Keep the newest profiles only
+    profiles = sorted(
+        (entry for entry in os.scandir(directory) if PROFILE_NAME.match(entry.name)),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profiles[: -profiling_params["keep"]]:
+        os.remove(entry.path)
+
+
+def profile_path(name: str):
+    """Path of a stored profile, None for names that are not profile files."""
+    if not PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(profiling_params["directory"], name)
+    return path if os.path.exists(path) else None
+
+
+class ProfilingMiddleware:
+    """Profiles requests that ask for it with the X-Profile header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(
+            name == PROFILE_HEADER for name, _ in scope["headers"]
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        format = headers[PROFILE_HEADER].decode()
+        if format not in FORMATS:
+            response = JSONResponse(
+                {"detail": f"X-Profile must be one of {', '.join(FORMATS)}"}, 400
+            )
+            await response(scope, receive, send)
+            return
+        if not is_admin(headers):
+            response = JSONResponse({"detail": "Profiling needs the Admin role"}, 403)
+            await response(scope, receive, send)
+            return
+
+        name = f"{uuid.uuid4().hex}.{FORMATS[format]}"
+
+        async def send_name(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-file", name.encode())
+                ]
+            await send(message)
+
+        profiler = SamplingProfiler(profiling_params["interval_seconds"])
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_name)
+        finally:
+            # Joining the sampler and writing the file block, keep them off
+            # the event loop
+            await run_in_threadpool(profiler.stop)
+            await run_in_threadpool(
+                save, profiler, format, name, f"{scope['method']} {scope['path']}"
+            )
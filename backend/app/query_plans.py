@@ -0,0 +1,132 @@
+"""EXPLAINs the hot queries and fails when one reads a table with a Seq Scan.
+
+    python -m app.query_plans
+
+Sequential scans are disabled while explaining, so the planner still picks
+an index on a small development database and only falls back to a Seq Scan
+when no index can serve the filter. Run it after python -m app.migrations.
+"""
+import argparse
+import json
+import sys
+
+import psycopg2
+from app import admin, card, db_connection_params, deck, game
+
+SAMPLE = {"external_id": "plan-check", "idgame": 0, "since": 0}
+
+# name: (query, params, required extension)
+HOT_QUERIES = {
+    "appuser by external_id": (
+        "SELECT idappuser, username, onesignal_id FROM appuser "
+        "WHERE deleted = FALSE AND external_id = %s LIMIT 1",
+        ("plan-check",),
+        None,
+    ),
+    "appuser by username": (
+        "SELECT idappuser FROM appuser WHERE username ILIKE %s",
+        ("plan-check",),
+        "pg_trgm",
+    ),
+    "appuser search": (
+        "SELECT idappuser, username FROM appuser "
+        "WHERE external_id != %s AND username ILIKE %s",
+        ("plan-check", "plan%"),
+        "pg_trgm",
+    ),
+    "games": (
+        game.GAMES_PAGE_QUERY.format(appuser="%s") + game.GAMES_PAGE_ORDER + "LIMIT %s",
+        (0, 21),
+        None,
+    ),
+    "waiting games": (
+        game.GAMES_PAGE_QUERY.format(appuser="%s")
+        + f"AND {game.GAME_STATE_FILTERS[game.GameStateEnum.waiting]} "
+        + "AND (i.createdtime, i.game) < (%s, %s) "
+        + game.GAMES_PAGE_ORDER
+        + "LIMIT %s",
+        (0, "2024-01-01", 0, 21),
+        None,
+    ),
+    "game snapshot": (game.GAME_SNAPSHOT_QUERY, SAMPLE, None),
+    "game changes": (game.GAME_CHANGES_QUERY, SAMPLE, None),
+    "lazy deal": (game.LAZY_DEAL_QUERY, SAMPLE, None),
+    "dealt card": (
+        "SELECT idgame_card FROM game_card "
+        "WHERE game = %s AND player = %s AND deal_position = %s",
+        (0, 0, 0),
+        None,
+    ),
+    "user decks": (deck.USER_DECKS_QUERY.format(appuser="%s", hidden=""), (0, 0), None),
+    "user cards": (
+        card.USER_CARDS_QUERY.format(appuser="%s") + "AND cd.deck = %s",
+        (0, 0),
+        None,
+    ),
+    "deck export": (admin.EXPORT_QUERY, (0,), None),
+    "friendships": (
+        "SELECT idfriendship FROM friendship WHERE appuser1 = %s "
+        "ORDER BY createdtime DESC, idfriendship DESC LIMIT 20",
+        (0,),
+        None,
+    ),
+    "pending friendships": (
+        "SELECT idfriendship FROM friendship WHERE appuser2 = %s AND accepted = FALSE",
+        (0,),
+        None,
+    ),
+}
+
+
+def seq_scans(plan: dict) -> list:
+    """The relations a plan, or any of its subplans, reads with a Seq Scan."""
+    scans = []
+    if plan.get("Node Type") == "Seq Scan":
+        scans.append(plan["Relation Name"])
+    for subplan in plan.get("Plans", []):
+        scans.extend(seq_scans(subplan))
+    return scans
+
+
+def check(cursor) -> dict:
+    """Seq scanned relations by hot query name, None for skipped queries."""
+    cursor.execute("SELECT extname FROM pg_extension")
+    extensions = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SET LOCAL enable_seqscan = off")
+
+    results = {}
+    for name, (query, params, extension) in HOT_QUERIES.items():
+        if extension and extension not in extensions:
+            results[name] = None
+            continue
+        cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        results[name] = seq_scans(plan[0]["Plan"])
+    return results
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__.splitlines()[0]).parse_args()
+    connection = psycopg2.connect(**db_connection_params)
+    try:
+        results = check(connection.cursor())
+        connection.rollback()
+    finally:
+        connection.close()
+
+    failed = False
+    for name, scans in results.items():
+        if scans is None:
+            print(f"skipped  {name}: {HOT_QUERIES[name][2]} is not installed")
+        elif scans:
+            failed = True
+            print(f"SEQ SCAN {name}: {', '.join(sorted(set(scans)))}")
+        else:
+            print(f"ok       {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
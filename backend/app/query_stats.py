@@ -0,0 +1,192 @@
+import functools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from app import query_stats_params
+from psycopg2 import extensions, extras, sql
+from starlette.requests import Request
+
+# Statements longer than this are cut in logs
+STATEMENT_LOG_LENGTH = 300
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r"\s+")
+# Relations a statement reads or writes. Function calls like unnest(),
+# FOR UPDATE and ON CONFLICT DO UPDATE SET are not tables.
+TABLE_NAMES = re.compile(
+    r"\b(?:(?:FROM|JOIN)\s+([a-z_]\w*)\b(?!\s*\()"
+    r"|(?:INTO|UPDATE)\s+(?!(?:SET|SKIP|NOWAIT|OF)\b)([a-z_]\w*))",
+    re.IGNORECASE,
+)
+
+current: ContextVar = ContextVar("request_queries", default=None)
+# Shapes already run by the execute_values call in progress
+current_batch: ContextVar = ContextVar("statement_batch", default=None)
+
+# Statements per table since the worker started, for app.metrics
+table_statements = Counter()
+_table_lock = threading.Lock()
+
+
+def statement_shape(statement: str) -> str:
+    """The statement with literals replaced, so repeats with other values match."""
+    return WHITESPACE.sub(" ", LITERALS.sub("?", statement)).strip()
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_tables(statement: str) -> tuple:
+    return tuple(
+        sorted(
+            {
+                (read or written).lower()
+                for read, written in TABLE_NAMES.findall(statement)
+            }
+            - {"stdin", "stdout"}
+        )
+    )
+
+
+class RequestQueries:
+    """Statements run by one request: count, database time and the slowest."""
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.slowest = (0.0, None)
+        self.shapes = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, seconds: float, batch: set = None):
+        shape = statement_shape(statement)
+        with self._lock:
+            self.statements += 1
+            self.seconds += seconds
+            # The pages of one execute_values call count as one run
+            if batch is None or shape not in batch:
+                self.shapes[shape] += 1
+            if batch is not None:
+                batch.add(shape)
+            if seconds >= self.slowest[0]:
+                self.slowest = (seconds, shape)
+
+    def repeated(self, threshold: int) -> dict:
+        """Shapes run more than threshold times, the N+1 suspects."""
+        return {
+            shape: count for shape, count in self.shapes.items() if count > threshold
+        }
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.seconds * 1000:.1f};desc="statements: {self.statements}", '
+            f"db-slowest;dur={self.slowest[0] * 1000:.1f}"
+        )
+
+
+class InstrumentedCursor(extensions.cursor):
+    """Adds every statement to the RequestQueries of the current request.
+
+    db_connector opens its connections with this cursor_factory, so every
+    router is covered. Statements are also counted per table for metrics.
+    """
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record(query, started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record(query, started)
+
+    def copy_expert(self, query, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(query, file, size)
+        finally:
+            self._record(query, started)
+
+    def _record(self, query, started: float):
+        seconds = time.perf_counter() - started
+        if isinstance(query, sql.Composable):
+            query = query.as_string(self)
+        elif isinstance(query, bytes):
+            query = query.decode(errors="replace")
+
+        tables = statement_tables(query)
+        with _table_lock:
+            table_statements.update(tables)
+        queries = current.get()
+        if queries is not None:
+            queries.record(query, seconds, current_batch.get())
+
+
+def execute_values(cursor, query, argslist, **kwargs):
+    """psycopg2.extras.execute_values, recorded as one run of its statement.
+
+    A long argslist is sent in pages of the same shape, which are not the
+    repeats the N+1 check is after. Calling it in a loop still counts once
+    per call.
+    """
+    token = current_batch.set(set())
+    try:
+        return extras.execute_values(cursor, query, argslist, **kwargs)
+    finally:
+        current_batch.reset(token)
+
+
+def log(request: Request, status_code: int, seconds: float, queries):
+    repeated = queries.repeated(query_stats_params["repeat_threshold"])
+    if query_stats_params["log_requests"]:
+        print(
+            json.dumps(
+                {
+                    "event": "request",
+                    "method": request.method,
+                    "path": request.url.path,
+                    "status": status_code,
+                    "ms": round(seconds * 1000, 1),
+                    "statements": queries.statements,
+                    "db_ms": round(queries.seconds * 1000, 1),
+                    "slowest_ms": round(queries.slowest[0] * 1000, 1),
+                    "slowest": (queries.slowest[1] or "")[:STATEMENT_LOG_LENGTH],
+                }
+            ),
+            flush=True,
+        )
+    for shape, count in repeated.items():
+        print(
+            json.dumps(
+                {
+                    "event": "repeated_statement",
+                    "level": "warning",
+                    "method": request.method,
+                    "path": request.url.path,
+                    "count": count,
+                    "statement": shape[:STATEMENT_LOG_LENGTH],
+                }
+            ),
+            flush=True,
+        )
+
+
+async def record_queries(request: Request, call_next):
+    queries = RequestQueries()
+    token = current.set(queries)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current.reset(token)
+
+    response.headers.append("Server-Timing", queries.server_timing())
+    log(request, response.status_code, time.perf_counter() - started, queries)
+    return response
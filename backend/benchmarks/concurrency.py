@@ -0,0 +1,140 @@
+"""Concurrent-request throughput of a single app instance.
+
+Runs the ASGI app in-process against the sqlite schema from tests/db_mock.py
+and adds a fixed delay to every statement to stand in for the network round
+trip to Postgres. Handlers that block the event loop serialize on that delay;
+handlers running in the threadpool overlap it.
+
+    python -m benchmarks.concurrency --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import httpx
+from psycopg2 import extensions, sql
+
+os.environ.setdefault("X_API_KEY", "benchmark")
+
+from tests import db_mock  # noqa: E402
+
+
+class SlowCursor:
+    def __init__(self, cursor, latency):
+        self._cursor = cursor
+        self._latency = latency
+
+    def execute(self, query, params=()):
+        if isinstance(query, sql.SQL):
+            query = query.string
+        time.sleep(self._latency)
+        return self._cursor.execute(query.replace("%s", "?"), params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class SlowConnection:
+    """sqlite connection that quacks enough like psycopg2 for the pool."""
+
+    def __init__(self, latency):
+        self._connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self._latency = latency
+        self.closed = 0
+        self.info = SimpleNamespace(
+            transaction_status=extensions.TRANSACTION_STATUS_IDLE
+        )
+
+        cursor = self._connection.cursor()
+        for table_query in db_mock.tables:
+            cursor.execute(table_query)
+        cursor.execute(
+            "INSERT INTO appuser (external_id, username) VALUES (?, ?), (?, ?)",
+            ("sample_id", "sample_user", "sample_id2", "sample_user2"),
+        )
+        cursor.execute(
+            "INSERT INTO friendship (appuser1, appuser2, accepted) VALUES (1, 2, 1)"
+        )
+        self._connection.commit()
+
+    def cursor(self):
+        return SlowCursor(self._connection.cursor(), self._latency)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self.closed = 1
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.commit() if exc_type is None else self.rollback()
+
+
+async def run(app, path, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"x-api-key": os.environ["X_API_KEY"]}
+    latencies = []
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+
+        async def request():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--path", default="/friends/?external_id=sample_id")
+    args = parser.parse_args()
+
+    import psycopg2
+
+    psycopg2.connect = lambda **kwargs: SlowConnection(args.latency_ms / 1000)
+
+    from app import db_connector
+    from app.api import app
+
+    if hasattr(db_connector, "open_pool"):
+        db_connector.open_pool()
+    try:
+        result = asyncio.run(run(app, args.path, args.requests, args.concurrency))
+    finally:
+        if hasattr(db_connector, "close_pool"):
+            db_connector.close_pool()
+
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Dealing a large deck to many players.
+
+Compares app.dealing with the tuple shuffling create_game used before, which
+copied or shuffled the card rows themselves in Python.
+
+    python -m benchmarks.dealing --cards 10000 --players 20
+"""
+import argparse
+import random
+import time
+
+from app import dealing
+
+
+def legacy_deal(gamemode, rows, players, cards_per_player, wildcards):
+    if gamemode == dealing.ALL:
+        batches = [list(rows) for _ in range(players)]
+    else:
+        random.shuffle(rows)
+        size = cards_per_player or len(rows) // players
+        batches = [rows[i * size : (i + 1) * size] for i in range(players)]
+    for batch in batches:
+        for _ in range(wildcards):
+            batch.append(("", "", True, None))
+    return batches
+
+
+def timed(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=10000)
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--wildcards", type=int, default=2)
+    parser.add_argument("--cards-per-player", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = [(f"card {i}", "", False, i) for i in range(args.cards)]
+    seed = dealing.new_seed()
+
+    print(f"{args.cards} cards, {args.players} players, best of {args.repeat}")
+    for gamemode in (dealing.ALL, dealing.DEAL, dealing.CUSTOM):
+        engine_ms = timed(
+            lambda: dealing.deal(
+                gamemode,
+                args.cards,
+                args.players,
+                seed,
+                args.cards_per_player,
+                args.wildcards,
+            ),
+            args.repeat,
+        )
+        line = f"{gamemode:>6}: engine {engine_ms} ms"
+        if gamemode != dealing.CUSTOM:
+            legacy_ms = timed(
+                lambda: legacy_deal(
+                    gamemode,
+                    list(rows),
+                    args.players,
+                    args.cards_per_player,
+                    args.wildcards,
+                ),
+                args.repeat,
+            )
+            line += f", legacy {legacy_ms} ms"
+        print(line)
+
+    hands = dealing.deal(dealing.DEAL, args.cards, args.players, seed)
+    replayed = dealing.deal(dealing.DEAL, args.cards, args.players, seed)
+    assert all((a == b).all() for a, b in zip(hands, replayed))
+
+
+if __name__ == "__main__":
+    main()
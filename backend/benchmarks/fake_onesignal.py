@@ -0,0 +1,67 @@
+"""Local stand-in for the OneSignal notifications API.
+
+Accepts the requests onesignal_helper sends, answers after a configurable
+delay and fails a share of them, so the notification outbox can be run and
+load-tested offline. Point the backend at it with
+
+    python -m benchmarks.fake_onesignal --port 8099 --latency-ms 300 --failure-rate 0.1
+    ONESIGNAL_API_URL=http://localhost:8099/api/v1/notifications uvicorn main:app
+
+GET /stats returns what it received.
+"""
+import argparse
+import asyncio
+import random
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_app(latency: float, failure_rate: float) -> FastAPI:
+    app = FastAPI()
+    stats = {"requests": 0, "notifications": 0, "recipients": 0, "failed": 0}
+
+    @app.post("/api/v1/notifications")
+    async def create_notification(request: Request):
+        stats["requests"] += 1
+        body = await request.json()
+        await asyncio.sleep(latency)
+
+        if random.random() < failure_rate:
+            stats["failed"] += 1
+            return JSONResponse({"errors": ["Internal server error"]}, 500)
+
+        if not body.get("app_id") or not body.get("include_player_ids"):
+            stats["failed"] += 1
+            return JSONResponse({"errors": ["Invalid notification"]}, 400)
+
+        stats["notifications"] += 1
+        stats["recipients"] += len(body["include_player_ids"])
+        return {
+            "id": str(uuid.uuid4()),
+            "recipients": len(body["include_player_ids"]),
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = create_app(args.latency_ms / 1000, args.failure_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
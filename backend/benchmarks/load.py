@@ -0,0 +1,512 @@
+"""Load test of the API scenarios players run, saved for comparison.
+
+Runs the ASGI app in-process under its lifespan, so with the connection
+pool, event broker, catalog, outbound client and outbox worker of a served
+app, or a server given with --url, against the Postgres database of the
+DB_* settings. The setup adds users, decks and
+games of its own, named after the run, so point it at a scratch database.
+Every scenario reports throughput and p50/p95/p99 per endpoint, and the
+run is saved to benchmarks/results/ as JSON named after the commit. Commit
+a run made on the reference machine to keep it as the baseline.
+
+    python -m benchmarks.load --requests 500 --concurrency 20
+    python -m benchmarks.load --scenario get_game --compare benchmarks/results/<run>.json
+
+Unlike benchmarks.concurrency it cannot use the sqlite schema of
+tests/db_mock.py, the game queries need Postgres (json_agg, arrays, ILIKE).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import psycopg2
+from psycopg2.extras import execute_values
+
+# One JSON line per request would drown the report
+os.environ.setdefault("SQL_LOG_REQUESTS", "false")
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+PERCENTILES = (50, 95, 99)
+# Cards in the deck of the games that only fill the game lists
+SMALL_DECK_CARDS = 20
+
+
+class Recorder:
+    """Latencies and status codes per endpoint of one scenario."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = Counter()
+
+    async def request(self, client, name, method, path, ok=(200,), **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, path, **kwargs)
+        self.latencies[name].append(time.perf_counter() - started)
+        self.statuses[name][response.status_code] += 1
+        if response.status_code not in ok:
+            self.errors[name] += 1
+        return response
+
+    def summary(self, seconds: float) -> dict:
+        results = {}
+        for name, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            results[name] = {
+                "requests": len(latencies),
+                "errors": self.errors[name],
+                "statuses": {
+                    str(status): count
+                    for status, count in sorted(self.statuses[name].items())
+                },
+                "throughput_rps": round(len(latencies) / seconds, 1),
+                "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+                **{
+                    f"p{share}_ms": round(percentile(latencies, share) * 1000, 2)
+                    for share in PERCENTILES
+                },
+            }
+        return results
+
+
+def percentile(values: list, share: int) -> float:
+    """Nearest-rank percentile of sorted values."""
+    return values[max(math.ceil(len(values) * share / 100) - 1, 0)]
+
+
+def make_token(user) -> str:
+    from app.helpers import jwt_helper
+
+    now = datetime.utcnow()
+    payload = SimpleNamespace(user_id=user.external_id, timestamp=now, expires_at=now)
+    return jwt_helper.create_jwt(
+        payload, idappuser=user.idappuser, username=user.username
+    )
+
+
+def create_deck(cursor, title: str, cards: int) -> int:
+    from app import card_counts, db_connector
+
+    cursor.execute("INSERT INTO deck (title) VALUES (%s) RETURNING iddeck", (title,))
+    iddeck = cursor.fetchone()[0]
+    cursor.execute(
+        """
+        WITH new_card AS (
+            INSERT INTO card (title, description)
+            SELECT %s || ' card ' || g, 'Description ' || g
+            FROM generate_series(1, %s) AS g
+            RETURNING idcard
+        )
+        INSERT INTO card_deck (card, deck)
+        SELECT idcard, %s FROM new_card
+        """,
+        (title, cards, iddeck),
+    )
+    card_counts.add(cursor, [(iddeck, None)], cards)
+    db_connector.catalog_changed(cursor)
+    return iddeck
+
+
+async def setup(client, args) -> SimpleNamespace:
+    """Users, decks and games for the scenarios, made partly through the API."""
+    from app import db_connection_params
+
+    run = uuid.uuid4().hex[:8]
+    connection = psycopg2.connect(**db_connection_params)
+    try:
+        with connection:
+            cursor = connection.cursor()
+            rows = execute_values(
+                cursor,
+                """
+                INSERT INTO appuser (external_id, username, email, firstname, lastname)
+                VALUES %s
+                RETURNING idappuser, external_id, username
+                """,
+                [
+                    (
+                        f"bench-{run}-{i}",
+                        f"bench{run}user{i}",
+                        f"bench{run}user{i}@example.com",
+                        "Bench",
+                        f"User{i}",
+                    )
+                    for i in range(args.users)
+                ],
+                fetch=True,
+            )
+            large_deck = create_deck(cursor, f"bench {run} large", args.deck_cards)
+            small_deck = create_deck(cursor, f"bench {run} small", SMALL_DECK_CARDS)
+            cursor.execute("SELECT version()")
+            postgres = cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+    users = [
+        SimpleNamespace(idappuser=idappuser, external_id=external_id, username=username)
+        for idappuser, external_id, username in rows
+    ]
+    for user in users:
+        user.headers = {
+            "x-api-key": os.environ["X_API_KEY"],
+            "authorization": f"Bearer {make_token(user)}",
+        }
+
+    async def create_game(user, others, deck, skips):
+        response = await client.post(
+            "/game/",
+            headers=user.headers,
+            json={
+                "external_id": user.external_id,
+                "deck": deck,
+                "participants": [other.idappuser for other in others],
+                "wildcards": 1,
+                "skips": skips,
+                "gamemode": "deal",
+            },
+        )
+        response.raise_for_status()
+        for other in others:
+            games = await client.get(
+                "/games/",
+                params={"external_id": other.external_id, "limit": 1},
+                headers=other.headers,
+            )
+            idgame = games.json()["games"][0]["idgame"]
+            response = await client.put(
+                "/game/accept",
+                headers=other.headers,
+                json={"external_id": other.external_id, "game": idgame},
+            )
+            response.raise_for_status()
+        return idgame
+
+    # Large games of two players that are polled and played, and a history
+    # of small games so every user has a list of games
+    pairs = []
+    for i in range(0, len(users) - 1, 2):
+        player, performer = users[i], users[i + 1]
+        idgame = await create_game(player, [performer], large_deck, args.requests)
+        pairs.append((idgame, player, performer))
+    for i, user in enumerate(users):
+        for j in range(args.games_per_user):
+            await create_game(user, [users[(i + j + 1) % len(users)]], small_deck, 1)
+
+    connection = psycopg2.connect(**db_connection_params)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            SELECT gc.idgame_card, gc.game, gc.player
+            FROM game_card gc
+            WHERE gc.game = ANY(%s) AND gc.wildcard = FALSE
+            ORDER BY gc.idgame_card
+            """,
+            ([idgame for idgame, _, _ in pairs],),
+        )
+        game_cards = cursor.fetchall()
+    finally:
+        connection.close()
+
+    by_id = {user.idappuser: user for user in users}
+    performers = {idgame: (player, performer) for idgame, player, performer in pairs}
+    cards = []
+    for idgame_card, idgame, idplayer in game_cards:
+        player, performer = performers[idgame]
+        other = performer if idplayer == player.idappuser else player
+        cards.append((idgame, idgame_card, by_id[idplayer], other))
+    random.shuffle(cards)
+
+    return SimpleNamespace(
+        run=run,
+        postgres=postgres,
+        users=users,
+        large_deck=large_deck,
+        pairs=pairs,
+        cards=iter(cards),
+        etags={},
+    )
+
+
+async def create_game(client, recorder, fixture, i):
+    user = fixture.users[i % len(fixture.users)]
+    other = fixture.users[(i + 1) % len(fixture.users)]
+    await recorder.request(
+        client,
+        "POST /game/",
+        "POST",
+        "/game/",
+        headers=user.headers,
+        json={
+            "external_id": user.external_id,
+            "deck": fixture.large_deck,
+            "participants": [other.idappuser],
+            "wildcards": 2,
+            "skips": 3,
+            "gamemode": "deal",
+        },
+    )
+
+
+async def get_game(client, recorder, fixture, i):
+    # Clients poll their open game and send back the last ETag
+    idgame, player, performer = fixture.pairs[i % len(fixture.pairs)]
+    user = random.choice((player, performer))
+    headers = dict(user.headers)
+    etag = fixture.etags.get((idgame, user.idappuser))
+    if etag:
+        headers["if-none-match"] = etag
+
+    response = await recorder.request(
+        client,
+        "GET /game/{idgame}",
+        "GET",
+        f"/game/{idgame}",
+        ok=(200, 304),
+        params={"external_id": user.external_id},
+        headers=headers,
+    )
+    if response.headers.get("etag"):
+        fixture.etags[(idgame, user.idappuser)] = response.headers["etag"]
+
+
+async def get_games(client, recorder, fixture, i):
+    user = random.choice(fixture.users)
+    await recorder.request(
+        client,
+        "GET /games/",
+        "GET",
+        "/games/",
+        params={"external_id": user.external_id, "limit": 20},
+        headers=user.headers,
+    )
+
+
+async def play_cycle(client, recorder, fixture, i):
+    # Every card is played once, then confirmed or, every third, skipped
+    card = next(fixture.cards, None)
+    if card is None:
+        raise RuntimeError("Every card has been played, raise --deck-cards")
+    idgame, idgame_card, player, performer = card
+    await recorder.request(
+        client,
+        "PUT /game/play-card/",
+        "PUT",
+        "/game/play-card/",
+        headers=player.headers,
+        json={
+            "external_id": player.external_id,
+            "idgame_card": idgame_card,
+            "game": idgame,
+            # Looked up by get_appuser_by_email, which matches usernames
+            "performers": [performer.username],
+        },
+    )
+    if i % 3 == 2:
+        await recorder.request(
+            client,
+            "PUT /game/skip-card/",
+            "PUT",
+            "/game/skip-card/",
+            headers=performer.headers,
+            json={"external_id": performer.external_id, "idgame_card": idgame_card},
+        )
+    else:
+        await recorder.request(
+            client,
+            "PUT /game/confirm-card/",
+            "PUT",
+            "/game/confirm-card/",
+            headers=player.headers,
+            json={"external_id": player.external_id, "idgame_card": idgame_card},
+        )
+
+
+async def appuser_search(client, recorder, fixture, i):
+    user = random.choice(fixture.users)
+    other = random.choice(fixture.users)
+    await recorder.request(
+        client,
+        "GET /appuser/search",
+        "GET",
+        "/appuser/search",
+        params={
+            "term": other.username[: random.randint(3, len(other.username))],
+            "external_id": user.external_id,
+        },
+        headers=user.headers,
+    )
+
+
+SCENARIOS = {
+    "create_game": create_game,
+    "get_game": get_game,
+    "get_games": get_games,
+    "play_cycle": play_cycle,
+    "appuser_search": appuser_search,
+}
+
+
+async def run_scenario(client, scenario, fixture, requests, concurrency) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    recorder = Recorder()
+
+    async def iteration(i):
+        async with semaphore:
+            await scenario(client, recorder, fixture, i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(iteration(i) for i in range(requests)))
+    return recorder.summary(time.perf_counter() - started)
+
+
+async def run(client, args) -> dict:
+    fixture = await setup(client, args)
+    results = {}
+    for name in args.scenario:
+        # Warm the pool, caches and catalog outside the measurement
+        await run_scenario(client, SCENARIOS[name], fixture, args.warmup, 1)
+        results[name] = await run_scenario(
+            client, SCENARIOS[name], fixture, args.requests, args.concurrency
+        )
+    return {"run": fixture.run, "postgres": fixture.postgres, "scenarios": results}
+
+
+def git(*command) -> str:
+    try:
+        return subprocess.run(
+            ["git", *command], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def print_results(scenarios: dict):
+    print(
+        f"{'scenario':<15} {'endpoint':<24} {'requests':>8} {'errors':>6} "
+        f"{'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    for scenario, endpoints in scenarios.items():
+        for name, stats in endpoints.items():
+            print(
+                f"{scenario:<15} {name:<24} {stats['requests']:>8} "
+                f"{stats['errors']:>6} {stats['throughput_rps']:>8} "
+                f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}"
+            )
+
+
+def compare(baseline: dict, scenarios: dict, threshold: float) -> list:
+    """The endpoints that got slower than the baseline by more than threshold."""
+    regressions = []
+    print(f"\nCompared with {baseline['commit']} from {baseline['date']}")
+    for scenario, endpoints in scenarios.items():
+        for name, stats in endpoints.items():
+            base = baseline["scenarios"].get(scenario, {}).get(name)
+            if not base:
+                continue
+            changes = {
+                f"p{share}": stats[f"p{share}_ms"] / base[f"p{share}_ms"] - 1
+                for share in PERCENTILES
+                if base[f"p{share}_ms"]
+            }
+            if base["throughput_rps"]:
+                changes["rps"] = stats["throughput_rps"] / base["throughput_rps"] - 1
+            # Latency going up or throughput going down
+            slower = [
+                key
+                for key, change in changes.items()
+                if (-change if key == "rps" else change) > threshold
+            ]
+            print(
+                f"{scenario:<15} {name:<24} "
+                + " ".join(f"{key} {change:+.0%}" for key, change in changes.items())
+                + ("  REGRESSION" if slower else "")
+            )
+            if slower:
+                regressions.append((scenario, name, slower))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        help="run only this scenario, can be repeated",
+    )
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--games-per-user", type=int, default=5)
+    parser.add_argument("--deck-cards", type=int, default=5000)
+    parser.add_argument("--url", help="a running server instead of the app in-process")
+    parser.add_argument("--compare", type=Path, help="results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+    args.scenario = args.scenario or list(SCENARIOS)
+    if args.games_per_user >= args.users:
+        # The small games go to the next users in turn, never the user itself
+        parser.error("--games-per-user must be below --users")
+
+    from app.api import app
+
+    async def run_app():
+        if args.url:
+            async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+                return await run(client, args)
+
+        # httpx does not send lifespan events, so start the app as uvicorn would
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                app=app, base_url="http://bench", timeout=60
+            ) as client:
+                return await run(client, args)
+
+    result = asyncio.run(run_app())
+    print_results(result["scenarios"])
+
+    result = {
+        "commit": git("rev-parse", "--short", "HEAD") or "unknown",
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "command": " ".join(["python -m benchmarks.load", *sys.argv[1:]]),
+        "arguments": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+        },
+        **result,
+    }
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        dirty = "-dirty" if result["dirty"] else ""
+        path = RESULTS_DIR / (
+            f"{datetime.now():%Y%m%d-%H%M%S}-{result['commit']}{dirty}.json"
+        )
+        path.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"\nSaved {path}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if compare(baseline, result["scenarios"], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+-- Version token for conditional GETs, bumped by every write to a game
+ALTER TABLE game ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1;
@@ -0,0 +1,13 @@
+-- Append-only log of the game_card and game_appuser rows each game version
+-- touched, read by GET /game/{idgame}/changes
+CREATE TABLE IF NOT EXISTS game_change (
+    idgame_change BIGSERIAL PRIMARY KEY,
+    createdtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    game INT NOT NULL REFERENCES game(idgame) ON DELETE CASCADE,
+    version INT NOT NULL,
+    game_card INT REFERENCES game_card(idgame_card) ON DELETE CASCADE,
+    appuser INT REFERENCES appuser(idappuser) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS game_change_game_version_idx
+    ON game_change (game, version);
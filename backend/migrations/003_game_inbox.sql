@@ -0,0 +1,37 @@
+-- One row per player and game with everything GET /games/ lists, kept up to
+-- date by the game write endpoints in the same transaction
+CREATE TABLE IF NOT EXISTS game_inbox (
+    appuser INT NOT NULL REFERENCES appuser(idappuser) ON DELETE CASCADE,
+    game INT NOT NULL REFERENCES game(idgame) ON DELETE CASCADE,
+    createdtime TIMESTAMP NOT NULL,
+    updatedtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    deck_title VARCHAR ( 256 ) DEFAULT '',
+    accepted BOOL DEFAULT FALSE,
+    participants VARCHAR ( 256 ) [] NOT NULL DEFAULT '{}',
+    waiting_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (appuser, game)
+);
+
+INSERT INTO game_inbox (
+    appuser, game, createdtime, deck_title, accepted, participants, waiting_count
+)
+SELECT ga.appuser, g.idgame, g.createdtime, d.title, ga.accepted,
+ARRAY(
+    SELECT other.username
+    FROM game_appuser AS oga
+    INNER JOIN appuser AS other ON oga.appuser = other.idappuser
+    WHERE oga.game = g.idgame AND oga.deleted = FALSE AND other.deleted = FALSE
+    AND oga.appuser != ga.appuser
+    ORDER BY oga.idgame_appuser
+),
+(
+    SELECT COUNT(1)
+    FROM game_card AS gc
+    WHERE gc.game = g.idgame AND gc.performer = ga.appuser
+    AND gc.deleted = FALSE AND gc.skipped = FALSE
+    AND gc.played_time IS NOT NULL AND gc.finished_time IS NULL
+)
+FROM game AS g
+INNER JOIN game_appuser AS ga ON g.idgame = ga.game
+INNER JOIN deck AS d ON g.deck = d.iddeck
+ON CONFLICT (appuser, game) DO NOTHING;
@@ -0,0 +1,23 @@
+-- Cards still to play or in play, so finished games can be filtered
+ALTER TABLE game_inbox ADD COLUMN IF NOT EXISTS open_count INT NOT NULL DEFAULT 0;
+
+UPDATE game_inbox SET open_count = (
+    SELECT COUNT(1)
+    FROM game_card AS gc
+    WHERE gc.game = game_inbox.game AND gc.deleted = FALSE AND gc.skipped = FALSE
+    AND gc.finished_time IS NULL
+);
+
+-- Keyset pages of GET /games/, newest first
+CREATE INDEX IF NOT EXISTS game_inbox_appuser_createdtime_idx
+    ON game_inbox (appuser, createdtime DESC, game DESC);
+CREATE INDEX IF NOT EXISTS game_inbox_pending_idx
+    ON game_inbox (appuser, createdtime DESC, game DESC) WHERE accepted = FALSE;
+CREATE INDEX IF NOT EXISTS game_inbox_waiting_idx
+    ON game_inbox (appuser, createdtime DESC, game DESC) WHERE waiting_count > 0;
+
+-- Keyset pages of GET /friendships/, one index per side of the friendship
+CREATE INDEX IF NOT EXISTS friendship_appuser1_createdtime_idx
+    ON friendship (appuser1, createdtime DESC, idfriendship DESC);
+CREATE INDEX IF NOT EXISTS friendship_appuser2_createdtime_idx
+    ON friendship (appuser2, createdtime DESC, idfriendship DESC);
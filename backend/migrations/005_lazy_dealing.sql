@@ -0,0 +1,14 @@
+-- Lazily dealt games keep the deck order and deal parameters on the game row
+-- and only insert a game_card when its card is played.
+ALTER TABLE game ADD COLUMN IF NOT EXISTS dealing VARCHAR(16) NOT NULL DEFAULT 'eager';
+ALTER TABLE game ADD COLUMN IF NOT EXISTS gamemode VARCHAR(16);
+ALTER TABLE game ADD COLUMN IF NOT EXISTS cardsperperson INT;
+ALTER TABLE game ADD COLUMN IF NOT EXISTS seed BIGINT;
+ALTER TABLE game ADD COLUMN IF NOT EXISTS deal_cards INT[];
+ALTER TABLE game ADD COLUMN IF NOT EXISTS deal_total INT;
+
+ALTER TABLE game_card ADD COLUMN IF NOT EXISTS deal_position INT;
+
+-- A dealt position is materialised at most once per player
+CREATE UNIQUE INDEX IF NOT EXISTS game_card_deal_position_idx
+    ON game_card (game, player, deal_position) WHERE deal_position IS NOT NULL;
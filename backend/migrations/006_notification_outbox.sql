@@ -0,0 +1,18 @@
+-- Push notifications are written here in the same transaction as the change
+-- they announce and delivered to OneSignal by app.notifications.OutboxWorker
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    idnotification_outbox SERIAL PRIMARY KEY,
+    createdtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updatedtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    receivers VARCHAR ( 256 )[] NOT NULL,
+    message VARCHAR ( 1024 ) NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent_time TIMESTAMP,
+    failed_time TIMESTAMP,
+    last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS notification_outbox_pending_idx
+    ON notification_outbox (next_attempt_time)
+    WHERE sent_time IS NULL AND failed_time IS NULL;
@@ -0,0 +1,22 @@
+-- Non-deleted card_deck rows per deck and owner (NULL for the public cards),
+-- kept up to date by the card_deck write endpoints through app.card_counts.
+-- python -m app.card_counts recounts them from card_deck.
+CREATE TABLE IF NOT EXISTS deck_card_count (
+    deck INT NOT NULL REFERENCES deck(iddeck) ON DELETE CASCADE,
+    appuser INT REFERENCES appuser(idappuser) ON DELETE CASCADE,
+    card_count INT NOT NULL DEFAULT 0
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS deck_card_count_deck_appuser_idx
+    ON deck_card_count (deck, COALESCE(appuser, 0));
+
+CREATE INDEX IF NOT EXISTS deck_card_count_appuser_idx
+    ON deck_card_count (appuser);
+
+INSERT INTO deck_card_count (deck, appuser, card_count)
+SELECT deck, appuser, COUNT(1)
+FROM card_deck
+WHERE deleted = FALSE AND deck IS NOT NULL
+GROUP BY deck, appuser
+ON CONFLICT (deck, COALESCE(appuser, 0))
+DO UPDATE SET card_count = EXCLUDED.card_count;
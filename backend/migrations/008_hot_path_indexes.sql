@@ -0,0 +1,51 @@
+-- migrate: no-transaction
+-- Indexes for the filters every request runs, checked by python -m app.query_plans.
+-- Partial on deleted = FALSE where every query of the table filters on it.
+-- Built concurrently, so writes to the tables go on during the deploy.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS appuser_external_id_idx
+    ON appuser (external_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS game_card_game_player_idx
+    ON game_card (game, player, played_time, finished_time)
+    WHERE deleted = FALSE;
+-- Cards received per player, counted without the deleted filter
+CREATE INDEX CONCURRENTLY IF NOT EXISTS game_card_game_performer_idx
+    ON game_card (game, performer);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS game_appuser_appuser_game_idx
+    ON game_appuser (appuser, game)
+    WHERE deleted = FALSE;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS game_appuser_game_idx
+    ON game_appuser (game);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS card_deck_deck_idx
+    ON card_deck (deck)
+    WHERE deleted = FALSE;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS card_deck_appuser_idx
+    ON card_deck (appuser, deck)
+    WHERE deleted = FALSE;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS deck_appuser_idx
+    ON deck (appuser)
+    WHERE deleted = FALSE;
+
+-- Pending requests per receiver, the accepted ones are paged through the
+-- friendship_appuser2_createdtime_idx from 004
+CREATE INDEX CONCURRENTLY IF NOT EXISTS friendship_pending_idx
+    ON friendship (appuser2)
+    WHERE accepted = FALSE;
+
+-- username ILIKE, exact and prefix, needs trigrams. Skipped where the
+-- pg_trgm contrib module is not installed. A DO block is a transaction, so
+-- this one index on the small appuser table is not built concurrently.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS appuser_username_trgm_idx
+            ON appuser USING gin (username gin_trgm_ops);
+    ELSE
+        RAISE NOTICE 'pg_trgm is not available, username ILIKE stays unindexed';
+    END IF;
+END
+$$;
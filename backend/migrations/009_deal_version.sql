@@ -0,0 +1,4 @@
+-- The shuffle a game was dealt with, see app.dealing.DEAL_VERSION. Games
+-- dealt before it was stored used the first one.
+ALTER TABLE game ADD COLUMN IF NOT EXISTS deal_version SMALLINT;
+UPDATE game SET deal_version = 1 WHERE deal_version IS NULL AND seed IS NOT NULL;
@@ -0,0 +1,189 @@
+import os
+
+import psycopg2
+import pytest
+from app import admin, card_counts, db_connection_params
+from psycopg2 import sql
+
+# Kept before conftest swaps them for the sqlite test database
+connect = psycopg2.connect
+SQL = sql.SQL
+
+postgres = pytest.mark.skipif(
+    not os.environ.get("TEST_POSTGRES"),
+    reason="set TEST_POSTGRES to run against the DB_* database",
+)
+
+
+def editor_payload(iddeck: int, idcard: int, cards: int):
+    """New decks with cards, a new card in an existing deck and edits."""
+    return admin.DecksAndCardsUpdateInput(
+        external_id="admin",
+        decks=[
+            admin.Deck(iddeck=-1, title="New A", description="a", created=True),
+            admin.Deck(iddeck=iddeck, title="Renamed", description="r", updated=True),
+            admin.Deck(iddeck=-2, title="New B", description="b", created=True),
+        ],
+        cards=[
+            admin.Card(
+                idcard=-(i + 1),
+                iddeck=[-1, -2, iddeck][i % 3],
+                title=f"Card {i}",
+                description=f"Description {i}",
+                created=True,
+            )
+            for i in range(cards)
+        ]
+        + [
+            admin.Card(
+                idcard=idcard,
+                iddeck=iddeck,
+                title="Edited",
+                description="e",
+                updated=True,
+            )
+        ],
+        deletes=admin.DeleteDecksAndCards(decks=[], cards=[]),
+    )
+
+
+def test_staged_rows_keep_the_payload_order_and_ids():
+    data = editor_payload(iddeck=5, idcard=9, cards=2)
+
+    assert admin.stage_deck_rows(data.decks) == [
+        (0, -1, "New A", "a", True, False),
+        (1, 5, "Renamed", "r", False, True),
+        (2, -2, "New B", "b", True, False),
+    ]
+    assert admin.stage_card_rows(data.cards) == [
+        (0, -1, -1, "Card 0", "Description 0", True, False),
+        (1, -2, -2, "Card 1", "Description 1", True, False),
+        (2, 9, 5, "Edited", "e", False, True),
+    ]
+
+
+def loop_reference(cursor, data, idappuser: int):
+    """The editor's changes applied one statement per deck and card."""
+    new_deck_ids = {}
+    new_card_decks = []
+    for deck in data.decks:
+        if deck.iddeck < 0 and deck.created:
+            cursor.execute(
+                """
+                INSERT INTO deck (title, description, updatedby, createdby)
+                VALUES (%s, %s, %s, %s) RETURNING iddeck
+                """,
+                (deck.title, deck.description, idappuser, idappuser),
+            )
+            new_deck_ids[deck.iddeck] = cursor.fetchone()[0]
+        elif deck.updated:
+            cursor.execute(
+                """
+                UPDATE deck SET title = %s, description = %s, updatedby = %s
+                WHERE iddeck = %s
+                """,
+                (deck.title, deck.description, idappuser, deck.iddeck),
+            )
+
+    for card in data.cards:
+        if card.idcard < 0 and card.created:
+            cursor.execute(
+                """
+                INSERT INTO card (title, description, updatedby)
+                VALUES (%s, %s, %s) RETURNING idcard
+                """,
+                (card.title, card.description, idappuser),
+            )
+            iddeck = new_deck_ids.get(card.iddeck, card.iddeck)
+            cursor.execute(
+                "INSERT INTO card_deck (card, deck, updatedby) VALUES (%s, %s, %s)",
+                (cursor.fetchone()[0], iddeck, idappuser),
+            )
+            new_card_decks.append((iddeck, None))
+        elif card.updated:
+            cursor.execute(
+                """
+                UPDATE card SET title = %s, description = %s, updatedby = %s
+                WHERE idcard = %s
+                """,
+                (card.title, card.description, idappuser, card.idcard),
+            )
+
+    card_counts.add(cursor, new_card_decks)
+
+
+def snapshot(cursor, since: dict, iddeck: int, idcard: int) -> dict:
+    """Rows the edit wrote, without ids, in id order."""
+    params = {**since, "iddeck": iddeck, "idcard": idcard}
+    queries = {
+        "decks": """
+            SELECT title, description, createdby, updatedby, deleted FROM deck
+            WHERE iddeck > %(deck)s OR iddeck = %(iddeck)s ORDER BY iddeck
+        """,
+        "cards": """
+            SELECT title, description, updatedby, deleted FROM card
+            WHERE idcard > %(card)s OR idcard = %(idcard)s ORDER BY idcard
+        """,
+        "card_decks": """
+            SELECT c.title, d.title, cd.updatedby
+            FROM card_deck cd
+            INNER JOIN card c ON cd.card = c.idcard
+            INNER JOIN deck d ON cd.deck = d.iddeck
+            WHERE cd.idcard_deck > %(card_deck)s ORDER BY cd.idcard_deck
+        """,
+        "counts": """
+            SELECT d.title, n.card_count
+            FROM deck_card_count n
+            INNER JOIN deck d ON n.deck = d.iddeck
+            WHERE d.iddeck > %(deck)s OR d.iddeck = %(iddeck)s ORDER BY d.title
+        """,
+    }
+    result = {}
+    for name, query in queries.items():
+        cursor.execute(query, params)
+        result[name] = cursor.fetchall()
+    return result
+
+
+@postgres
+@pytest.mark.parametrize("cards", [10, 2000])
+def test_set_based_edit_writes_the_same_rows_as_a_loop(monkeypatch, cards):
+    monkeypatch.setattr("psycopg2.sql.SQL", SQL)
+    connection = connect(**db_connection_params)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            INSERT INTO appuser (external_id, username, is_admin)
+            VALUES ('admin-test', 'admin-test', TRUE) RETURNING idappuser
+            """
+        )
+        idappuser = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO deck (title) VALUES ('Existing') RETURNING iddeck")
+        iddeck = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO card (title) VALUES ('Old') RETURNING idcard")
+        idcard = cursor.fetchone()[0]
+        cursor.execute(
+            "INSERT INTO card_deck (card, deck) VALUES (%s, %s)", (idcard, iddeck)
+        )
+        card_counts.add(cursor, [(iddeck, None)])
+        cursor.execute(
+            """
+            SELECT (SELECT MAX(iddeck) FROM deck), (SELECT MAX(idcard) FROM card),
+            (SELECT MAX(idcard_deck) FROM card_deck)
+            """
+        )
+        since = dict(zip(["deck", "card", "card_deck"], cursor.fetchone()))
+        data = editor_payload(iddeck, idcard, cards)
+
+        cursor.execute("SAVEPOINT edit")
+        loop_reference(cursor, data, idappuser)
+        expected = snapshot(cursor, since, iddeck, idcard)
+        cursor.execute("ROLLBACK TO SAVEPOINT edit")
+
+        admin.apply_decks_and_cards(cursor, data, idappuser)
+        assert snapshot(cursor, since, iddeck, idcard) == expected
+        assert len(expected["card_decks"]) == cards
+    finally:
+        connection.rollback()
+        connection.close()
@@ -0,0 +1,56 @@
+from unittest.mock import MagicMock
+
+from app import db_connector
+from app.appuser_cache import AppUserCache
+
+
+def test_rows_are_evicted_least_recently_used_first():
+    cache = AppUserCache(max_size=2)
+    cache.put(("external_id", "a"), (1, "a", None))
+    cache.put(("external_id", "b"), (2, "b", None))
+    cache.get(("external_id", "a"))
+    cache.put(("external_id", "c"), (3, "c", None))
+
+    assert cache.get(("external_id", "b")) is None
+    assert cache.get(("external_id", "a")) == (1, "a", None)
+    assert cache.stats()["evicted"] == 1
+
+
+def test_rows_expire_and_are_invalidated_by_id():
+    cache = AppUserCache(ttl_seconds=0)
+    cache.put(("external_id", "a"), (1, "a", None))
+    assert cache.get(("external_id", "a")) is None
+    assert cache.stats()["expired"] == 1
+
+    cache = AppUserCache()
+    cache.put(("external_id", "a"), (1, "a", "onesignal"))
+    cache.put(("username", "a"), (1, "a", "onesignal"))
+    cache.put(("username", "b"), (2, "b", None))
+    cache.on_notify("1")
+
+    assert cache.stats()["size"] == 1
+    assert cache.stats()["invalidated"] == 2
+
+
+def test_lookups_hit_the_database_once():
+    cursor = MagicMock()
+    cursor.fetchone.return_value = (1, "sample_user", "onesignal")
+
+    assert db_connector.get_appuser(cursor, "sample_id") == (1, "sample_user")
+    assert db_connector.get_appuser(cursor, "sample_id") == (1, "sample_user")
+    assert db_connector.get_appuser_by_username(cursor, "sample_user") == (
+        1,
+        "onesignal",
+    )
+    assert db_connector.get_appuser_by_email(cursor, "sample_user") == (
+        1,
+        "onesignal",
+    )
+    assert cursor.execute.call_count == 2
+
+    db_connector.appuser_changed(cursor, 1)
+    db_connector.get_appuser(cursor, "sample_id")
+    assert cursor.execute.call_count == 4
+
+    stats = db_connector.appuser_cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 3)
@@ -0,0 +1,96 @@
+import os
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import jwt
+import pytest
+from app import auth, db_connector
+from app.helpers import jwt_helper
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from passwordless import VerifiedUser
+
+
+def login_jwt(**claims):
+    verified_user = VerifiedUser(
+        True,
+        "sample_id",
+        datetime.utcnow(),
+        "origin",
+        "device",
+        "SE",
+        "nickname",
+        "credential",
+        datetime.utcnow(),
+        "token",
+        "passkey_signin",
+    )
+    return jwt_helper.create_jwt(verified_user, **claims)
+
+
+def bearer(token):
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+def test_identity_comes_from_the_token_without_a_query():
+    token = login_jwt(roles=["User", "Admin"], idappuser=7, username="sample_user")
+    identity = auth.get_identity(bearer(token))
+    cursor = MagicMock()
+
+    assert identity.roles == ["User", "Admin"]
+    assert db_connector.get_appuser(cursor, "sample_id", identity) == (
+        7,
+        "sample_user",
+    )
+    assert auth.appuser_filter(identity, "sample_id") == ("%s", 7)
+    cursor.execute.assert_not_called()
+
+    with pytest.raises(HTTPException) as error:
+        db_connector.get_appuser(cursor, "sample_id2", identity)
+    assert error.value.status_code == 403
+
+
+def test_requests_without_an_id_in_the_token_look_the_user_up():
+    assert auth.get_identity(None) is None
+
+    identity = auth.get_identity(bearer(login_jwt()))
+    cursor = MagicMock()
+    cursor.fetchone.return_value = (1, "sample_user", None)
+
+    assert db_connector.get_appuser(cursor, "sample_id", identity) == (
+        1,
+        "sample_user",
+    )
+    cursor.execute.assert_called_once()
+    assert auth.appuser_filter(identity, "sample_id")[1] == "sample_id"
+
+
+def test_invalid_tokens_are_rejected(monkeypatch):
+    token = login_jwt(idappuser=7)
+
+    with pytest.raises(HTTPException) as error:
+        auth.get_identity(bearer(token[:-2]))
+    assert error.value.status_code == 401
+
+    monkeypatch.setattr(jwt_helper, "JWT_TTL_HOURS", -1)
+    with pytest.raises(HTTPException) as error:
+        auth.get_identity(bearer(login_jwt(idappuser=7)))
+    assert error.value.status_code == 401
+
+
+def test_tokens_from_before_the_expiry_claim_fall_back_to_a_lookup():
+    legacy = {"user_id": "sample_id", "roles": ["User"]}
+    token = jwt.encode(legacy, os.environ["JWT_SECRET_KEY"], algorithm="HS256")
+
+    assert auth.get_identity(bearer(token)) is None
+
+    with pytest.raises(HTTPException) as error:
+        auth.get_identity(bearer(token[:-2]))
+    assert error.value.status_code == 401
+
+    without_expiry = jwt.encode(
+        {**legacy, "idappuser": 7}, os.environ["JWT_SECRET_KEY"], algorithm="HS256"
+    )
+    with pytest.raises(HTTPException) as error:
+        auth.get_identity(bearer(without_expiry))
+    assert error.value.status_code == 401
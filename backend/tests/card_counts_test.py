@@ -0,0 +1,16 @@
+from unittest.mock import MagicMock
+
+from app import card_counts
+
+
+def test_counts_are_added_once_per_deck_and_owner(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        card_counts, "execute_values", lambda cursor, query, rows: calls.append(rows)
+    )
+
+    card_counts.add(MagicMock(), [(1, None), (1, None), (2, 7), (None, 7)])
+    card_counts.add(MagicMock(), [(2, 7)], -1)
+    card_counts.add(MagicMock(), [])
+
+    assert calls == [[(1, None, 2), (2, 7, 1)], [(2, 7, -1)]]
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+from app import catalog
+
+from . import db_mock
+
+
+@pytest.fixture
+def seeded_database(monkeypatch):
+    connection = sqlite3.connect(":memory:", check_same_thread=False)
+    cursor = connection.cursor()
+    for table_query in db_mock.tables:
+        cursor.execute(table_query)
+    cursor.executescript(
+        """
+        INSERT INTO appuser (idappuser, external_id) VALUES (1, 'sample_id');
+        INSERT INTO deck (iddeck, title, description) VALUES (1, 'Public', 'Any');
+        INSERT INTO deck (iddeck, title, hidden) VALUES (2, 'Hidden', TRUE);
+        INSERT INTO deck (iddeck, title, appuser) VALUES (3, 'Mine', 1);
+        INSERT INTO card (idcard, title, description) VALUES (1, 'Dance', 'A bit');
+        INSERT INTO card (idcard, title, appuser) VALUES (2, 'Sing', 1);
+        INSERT INTO card_deck (idcard_deck, card, deck) VALUES (1, 1, 1);
+        INSERT INTO card_deck (idcard_deck, card, deck, appuser) VALUES (2, 2, 1, 1);
+        INSERT INTO card_deck (idcard_deck, deck, wildcard, appuser)
+        VALUES (3, 3, TRUE, 1);
+        INSERT INTO deck_card_count (deck, appuser, card_count)
+        VALUES (1, NULL, 1), (1, 1, 1), (3, 1, 1);
+        """
+    )
+    queries = []
+    connection.set_trace_callback(queries.append)
+
+    @contextmanager
+    def get_connection():
+        yield connection
+
+    monkeypatch.setattr("app.db_connector.get_connection", get_connection)
+    yield queries
+
+
+def test_catalog_is_loaded_once_until_invalidated(seeded_database):
+    public = catalog.Catalog()
+
+    assert [deck[1] for deck in public.decks(hidden=False)] == ["Public"]
+    assert [deck[:2] for deck in public.decks()] == [(1, "Public"), (2, "Hidden")]
+    assert public.cards(iddeck=1) == [(1, 1, "Dance", "A bit", 0)]
+    assert public.loads == 1
+
+    public.invalidate()
+    public.cards()
+    assert public.loads == 2
+
+
+def test_user_decks_and_cards_are_merged_into_the_catalog(seeded_database, test_app):
+    headers = {"x-api-key": os.environ["X_API_KEY"]}
+
+    decks = test_app.get("/decks/?external_id=sample_id", headers=headers).json()
+    assert [
+        (deck["title"], deck["userdeck"], deck["cardcount"]) for deck in decks["decks"]
+    ] == [("Public", False, 2), ("Mine", True, 1)]
+
+    cards = test_app.get(
+        "/cards/?external_id=sample_id&iddeck=1", headers=headers
+    ).json()
+    assert [(card["title"], card["usercard"]) for card in cards["cards"]] == [
+        ("Dance", False),
+        ("Sing", True),
+    ]
+
+    seeded_database.clear()
+    public = test_app.get("/decks/", headers=headers).json()
+    assert [deck["title"] for deck in public["decks"]] == ["Public"]
+    assert seeded_database == []
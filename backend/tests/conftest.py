@@ -3,12 +3,20 @@ from unittest import mock
 from unittest.mock import MagicMock
 
 import pytest
+from app import catalog, db_connector
 from app.api import app
 from fastapi.testclient import TestClient
 
 from . import db_mock
 
 
+@pytest.fixture(autouse=True)
+def caches():
+    # Every test connection is a fresh database
+    db_connector.appuser_cache.clear()
+    catalog.catalog.invalidate()
+
+
 @pytest.fixture(scope="function")
 def test_app(db_connection, session_monkeypatch):
     yield TestClient(app)
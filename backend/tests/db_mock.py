@@ -42,6 +42,7 @@ tables = [
         appuser INT REFERENCES appuser(idappuser),
         title VARCHAR ( 256 ) DEFAULT '',
         description VARCHAR ( 2048 ) DEFAULT '',
+        hidden BOOL DEFAULT FALSE,
         deleted BOOL DEFAULT FALSE
     );""",
     """CREATE TABLE card_deck (
@@ -56,6 +57,11 @@ tables = [
         wildcard BOOL DEFAULT FALSE,
         deleted BOOL DEFAULT FALSE
     );""",
+    """CREATE TABLE deck_card_count (
+        deck INT NOT NULL REFERENCES deck(iddeck) ON DELETE CASCADE,
+        appuser INT REFERENCES appuser(idappuser) ON DELETE CASCADE,
+        card_count INT NOT NULL DEFAULT 0
+    );""",
     """CREATE TABLE game (
         idgame serial PRIMARY KEY,
         createdtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -64,7 +70,15 @@ tables = [
         updatedby INT REFERENCES appuser(idappuser),
         appuser INT REFERENCES appuser(idappuser) ON DELETE CASCADE,
         deck INT REFERENCES deck(iddeck) ON DELETE CASCADE,
-        deleted BOOL DEFAULT FALSE
+        deleted BOOL DEFAULT FALSE,
+        version INT NOT NULL DEFAULT 1,
+        dealing VARCHAR ( 16 ) NOT NULL DEFAULT 'eager',
+        gamemode VARCHAR ( 16 ),
+        cardsperperson INT,
+        seed BIGINT,
+        deal_version SMALLINT,
+        deal_cards INT[],
+        deal_total INT
     );""",
     """CREATE TABLE game_appuser (
         idgame_appuser serial PRIMARY KEY,
@@ -92,6 +106,38 @@ tables = [
         description VARCHAR ( 2048 ) DEFAULT '',
         played_time TIMESTAMP,
         finished_time TIMESTAMP,
-        deleted BOOL DEFAULT FALSE
+        deleted BOOL DEFAULT FALSE,
+        deal_position INT
+    );""",
+    """CREATE TABLE game_change (
+        idgame_change serial PRIMARY KEY,
+        createdtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        game INT REFERENCES game(idgame) ON DELETE CASCADE,
+        version INT NOT NULL,
+        game_card INT REFERENCES game_card(idgame_card) ON DELETE CASCADE,
+        appuser INT REFERENCES appuser(idappuser) ON DELETE CASCADE
+    );""",
+    """CREATE TABLE game_inbox (
+        appuser INT NOT NULL REFERENCES appuser(idappuser) ON DELETE CASCADE,
+        game INT NOT NULL REFERENCES game(idgame) ON DELETE CASCADE,
+        createdtime TIMESTAMP NOT NULL,
+        updatedtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        deck_title VARCHAR ( 256 ) DEFAULT '',
+        accepted BOOL DEFAULT FALSE,
+        participants TEXT DEFAULT '',
+        waiting_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (appuser, game)
+    );""",
+    """CREATE TABLE notification_outbox (
+        idnotification_outbox serial PRIMARY KEY,
+        createdtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updatedtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        receivers TEXT NOT NULL,
+        message VARCHAR ( 1024 ) NOT NULL,
+        attempts INT NOT NULL DEFAULT 0,
+        next_attempt_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        sent_time TIMESTAMP,
+        failed_time TIMESTAMP,
+        last_error TEXT
     );""",
 ]
@@ -0,0 +1,81 @@
+import pytest
+from app.db_pool import ConnectionPool, PoolTimeoutError
+from psycopg2 import extensions
+
+
+class FakeInfo:
+    transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.info = FakeInfo()
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr("psycopg2.connect", lambda **kwargs: FakeConnection())
+    pool = ConnectionPool({}, min_size=1, max_size=2, acquire_timeout=0.05)
+    pool.open()
+    yield pool
+    pool.close()
+
+
+def test_pool_reuses_connections(pool):
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert first.commits == 2
+    assert pool.stats()["connections_created"] == 1
+
+
+def test_pool_times_out_when_exhausted(pool):
+    first = pool.getconn()
+    second = pool.getconn()
+
+    with pytest.raises(PoolTimeoutError):
+        pool.getconn()
+
+    pool.putconn(first)
+    pool.putconn(second)
+    stats = pool.stats()
+    assert stats["acquire_timeouts"] == 1
+    assert stats["size"] == 2
+    assert stats["idle"] == 2
+
+
+def test_pool_rolls_back_on_error(pool):
+    with pytest.raises(ValueError):
+        with pool.connection() as connection:
+            raise ValueError()
+
+    assert connection.rollbacks == 1
+    assert pool.stats()["in_use"] == 0
+
+
+def test_reopening_keeps_the_size_of_checked_out_connections(pool):
+    first = pool.getconn()
+    second = pool.getconn()
+    pool.close()
+    pool.open()
+
+    assert pool.stats()["size"] == 2
+    pool.putconn(first)
+    pool.putconn(second)
+    with pytest.raises(PoolTimeoutError):
+        [pool.getconn() for _ in range(3)]
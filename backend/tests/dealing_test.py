@@ -0,0 +1,55 @@
+from app import dealing
+
+
+def test_deal_mode_splits_the_deck_between_seats():
+    hands = [
+        dealing.player_positions(dealing.DEAL, 10, 3, seat, seed=42, wildcards=1)
+        for seat in range(3)
+    ]
+
+    dealt = [position for hand in hands for position in hand if position < 10]
+    assert len(dealt) == len(set(dealt)) == 9
+    assert all(hand[-1] == 10 for hand in hands)
+    assert sum(len(hand) for hand in hands) == dealing.dealt_count(
+        dealing.DEAL, 10, 3, wildcards=1
+    )
+
+
+def test_hands_only_depend_on_the_seed():
+    first = dealing.player_positions(dealing.ALL, 20, 2, 1, seed=7)
+    again = dealing.player_positions(dealing.ALL, 20, 2, 1, seed=7)
+    other_seat = dealing.player_positions(dealing.ALL, 20, 2, 0, seed=7)
+
+    assert first == again
+    assert sorted(first) == list(range(20))
+    assert first != other_seat
+
+
+def test_custom_mode_deals_overlapping_hands():
+    hands = dealing.deal(dealing.CUSTOM, 5, 4, seed=3, cards_per_player=4)
+
+    assert [len(hand) for hand in hands] == [4, 4, 4, 4]
+    assert all(len(set(hand.tolist())) == 4 for hand in hands)
+    assert dealing.dealt_count(dealing.CUSTOM, 5, 4, 4) == 16
+
+
+def test_stored_deal_versions_keep_their_hands():
+    # Pinned so a NumPy upgrade cannot change games in progress
+    assert dealing.player_positions(dealing.DEAL, 10, 2, 0, seed=42) == [4, 8, 1, 9, 3]
+    assert dealing.player_positions(dealing.ALL, 6, 2, 1, seed=42) == [2, 4, 3, 0, 1, 5]
+    # Version 1 is what permutation and permuted dealt before it was stored
+    assert dealing.player_positions(dealing.DEAL, 10, 2, 0, seed=42, version=1) == [
+        5,
+        6,
+        0,
+        7,
+        3,
+    ]
+    assert dealing.player_positions(dealing.ALL, 6, 2, 1, seed=42, version=1) == [
+        2,
+        4,
+        0,
+        1,
+        3,
+        5,
+    ]
@@ -0,0 +1,56 @@
+import pytest
+from app.helpers import etag_helper
+from fastapi import Request, Response
+
+
+def request_with(if_none_match=None):
+    headers = []
+    if if_none_match is not None:
+        headers.append((b"if-none-match", if_none_match.encode()))
+    return Request({"type": "http", "headers": headers})
+
+
+def test_etag_is_weak_and_joins_its_parts():
+    assert etag_helper.make_etag(12, 3) == 'W/"12-3"'
+    assert etag_helper.make_etag("d41d8cd9") == 'W/"d41d8cd9"'
+
+
+@pytest.mark.parametrize(
+    "if_none_match, matches",
+    [
+        (None, False),
+        ("", False),
+        ('W/"12-3"', True),
+        ('"12-3"', True),
+        ('W/"12-4"', False),
+        ("*", True),
+        ('W/"12-2", W/"12-3"', True),
+        ('"12-1","12-3"', True),
+        ('W/"12-1", "12-2"', False),
+    ],
+)
+def test_if_none_match_uses_the_weak_comparison(if_none_match, matches):
+    etag = etag_helper.make_etag(12, 3)
+
+    assert etag_helper.etag_matches(request_with(if_none_match), etag) is matches
+
+
+def test_not_modified_keeps_the_etag_and_revalidation():
+    response = etag_helper.not_modified('W/"12-3"')
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == 'W/"12-3"'
+    assert response.headers["cache-control"] == "no-cache"
+
+    response = Response()
+    etag_helper.set_etag(response, 'W/"12-4"')
+    assert response.headers["etag"] == 'W/"12-4"'
+
+
+def test_digest_follows_the_body_not_its_key_order():
+    page = {"games": [{"idgame": 1, "accepted": True}], "next_cursor": None}
+    same = {"next_cursor": None, "games": [{"accepted": True, "idgame": 1}]}
+    changed = {"games": [{"idgame": 1, "accepted": False}], "next_cursor": None}
+
+    assert etag_helper.digest(page) == etag_helper.digest(same)
+    assert etag_helper.digest(page) != etag_helper.digest(changed)
@@ -0,0 +1,71 @@
+import asyncio
+import socket
+import threading
+from unittest.mock import MagicMock
+
+from app.events import EventBroker, format_event
+
+
+def test_dispatch_routes_events_to_game_and_appuser_subscribers():
+    broker = EventBroker({}, "test")
+    game_subscription = broker.subscribe(game=1)
+    other_game_subscription = broker.subscribe(game=2)
+    appuser_subscription = broker.subscribe(appuser=7)
+
+    broker.dispatch({"type": "card_played", "game": 1, "appusers": [7, 8]})
+
+    assert game_subscription.queue.qsize() == 1
+    assert other_game_subscription.queue.qsize() == 0
+    assert appuser_subscription.queue.qsize() == 1
+
+
+def test_stalled_subscriber_keeps_newest_events(monkeypatch):
+    monkeypatch.setattr("app.events.SUBSCRIBER_QUEUE_SIZE", 2)
+    broker = EventBroker({}, "test")
+    subscription = broker.subscribe(game=1)
+
+    for version in range(3):
+        broker.dispatch({"type": "card_played", "game": 1, "version": version})
+
+    assert subscription.queue.get_nowait()["version"] == 1
+    assert subscription.queue.get_nowait()["version"] == 2
+
+
+def test_format_event_leaves_out_recipients():
+    event = {"type": "card_played", "game": 1, "version": 3, "appusers": [7]}
+
+    assert format_event(event) == (
+        "id: 3\n"
+        "event: card_played\n"
+        'data: {"type": "card_played", "game": 1, "version": 3}\n\n'
+    )
+
+
+def test_reader_is_added_and_removed_on_the_loop_thread(monkeypatch):
+    reader, writer = socket.socketpair()
+    connection = MagicMock(closed=False)
+    connection.fileno.return_value = reader.fileno()
+    monkeypatch.setattr("psycopg2.connect", lambda **params: connection)
+    broker = EventBroker({}, "test")
+    threads = []
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for name in ["add_reader", "remove_reader"]:
+            method = getattr(loop, name)
+
+            def tracked(*args, method=method):
+                threads.append(threading.get_ident())
+                return method(*args)
+
+            monkeypatch.setattr(loop, name, tracked)
+
+        await broker.start()
+        await broker.stop()
+
+    asyncio.run(run())
+    reader.close()
+    writer.close()
+
+    assert threads == [threading.get_ident()] * 2
+    connection.cursor().execute.assert_called_once_with("LISTEN test")
@@ -0,0 +1,463 @@
+import os
+import uuid
+
+import psycopg2
+import pytest
+from app import db_connection_params, game
+from app.api import app
+from app.api_classes import Game, GameCard
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+from psycopg2 import sql
+
+# Kept before conftest swaps them for the sqlite test database
+connect = psycopg2.connect
+SQL = sql.SQL
+
+postgres = pytest.mark.skipif(
+    not os.environ.get("TEST_POSTGRES"),
+    reason="set TEST_POSTGRES to run against the DB_* database",
+)
+
+
+class Players:
+    """Three fresh users, a private deck and the games they create.
+
+    The endpoints commit, so everything is deleted again by cleanup.
+    """
+
+    def __init__(self, cursor, cards: int):
+        self.cursor = cursor
+        self.client = TestClient(app)
+        self.headers = {"x-api-key": os.environ["X_API_KEY"]}
+
+        suffix = uuid.uuid4().hex[:12]
+        self.external_ids = [f"game-test-{suffix}-{i}" for i in range(3)]
+        self.usernames = [f"gt{suffix}{i}" for i in range(3)]
+        self.ids = []
+        for external_id, username, firstname in zip(
+            self.external_ids, self.usernames, ["Ann", "Ben", "Cat"]
+        ):
+            cursor.execute(
+                """
+                INSERT INTO appuser (external_id, username, firstname, lastname)
+                VALUES (%s, %s, %s, 'Test') RETURNING idappuser
+                """,
+                (external_id, username, firstname),
+            )
+            self.ids.append(cursor.fetchone()[0])
+
+        cursor.execute(
+            "INSERT INTO deck (title, appuser) VALUES (%s, %s) RETURNING iddeck",
+            (f"Deck {suffix}", self.ids[0]),
+        )
+        self.iddeck = cursor.fetchone()[0]
+        self.idcards = []
+        for i in range(cards):
+            cursor.execute(
+                "INSERT INTO card (title, description) VALUES (%s, %s) "
+                "RETURNING idcard",
+                (f"card {i}", f"do {i}"),
+            )
+            self.idcards.append(cursor.fetchone()[0])
+            cursor.execute(
+                "INSERT INTO card_deck (card, deck) VALUES (%s, %s)",
+                (self.idcards[-1], self.iddeck),
+            )
+        cursor.connection.commit()
+
+    def create_game(self, gamemode="deal", dealing="eager", wildcards=0) -> int:
+        response = self.client.post(
+            "/game/",
+            json={
+                "external_id": self.external_ids[0],
+                "deck": self.iddeck,
+                "participants": self.ids[1:],
+                "wildcards": wildcards,
+                "skips": 1,
+                "gamemode": gamemode,
+                "dealing": dealing,
+            },
+            headers=self.headers,
+        )
+        assert response.json() == {"success": True}
+        self.cursor.execute(
+            "SELECT MAX(idgame) FROM game WHERE appuser = %s", (self.ids[0],)
+        )
+        return self.cursor.fetchone()[0]
+
+    def get(self, path: str, player: int, **params):
+        return self.client.get(
+            path,
+            params={"external_id": self.external_ids[player], **params},
+            headers=self.headers,
+        )
+
+    def put(self, path: str, player: int, **data):
+        return self.client.put(
+            path,
+            json={"external_id": self.external_ids[player], **data},
+            headers=self.headers,
+        )
+
+    def play(self, player: int, idgame_card: int, performer: int, **game):
+        return self.put(
+            "/game/play-card/",
+            player,
+            idgame_card=idgame_card,
+            performers=[self.usernames[performer]],
+            **game,
+        )
+
+    def snapshot(self, idgame: int, player: int) -> dict:
+        response = self.get(f"/game/{idgame}", player)
+        assert response.status_code == 200
+        return response.json()
+
+    def inbox(self, player: int, **params) -> list:
+        return self.get("/games/", player, **params).json()["games"]
+
+    def cleanup(self):
+        cursor = self.cursor
+        cursor.connection.rollback()
+        cursor.execute("SELECT idgame FROM game WHERE deck = %s", (self.iddeck,))
+        games = [row[0] for row in cursor.fetchall()]
+        for table in ["game_change", "game_inbox", "game_card", "game_appuser"]:
+            cursor.execute(f"DELETE FROM {table} WHERE game = ANY(%s)", (games,))
+        cursor.execute("DELETE FROM game WHERE idgame = ANY(%s)", (games,))
+        cursor.execute("DELETE FROM card_deck WHERE deck = %s", (self.iddeck,))
+        cursor.execute("DELETE FROM deck_card_count WHERE deck = %s", (self.iddeck,))
+        cursor.execute("DELETE FROM card WHERE idcard = ANY(%s)", (self.idcards,))
+        cursor.execute("DELETE FROM deck WHERE iddeck = %s", (self.iddeck,))
+        cursor.execute("DELETE FROM appuser WHERE idappuser = ANY(%s)", (self.ids,))
+        cursor.connection.commit()
+
+
+@pytest.fixture
+def players(monkeypatch):
+    monkeypatch.setattr("psycopg2.connect", connect)
+    monkeypatch.setattr("psycopg2.sql.SQL", SQL)
+    connection = connect(**db_connection_params)
+    players = None
+    try:
+        players = Players(connection.cursor(), cards=6)
+        yield players
+    finally:
+        if players:
+            players.cleanup()
+        connection.close()
+
+
+def separate_queries(cursor, idgame: int, external_id: str) -> dict:
+    """The game view as GET /game/{idgame} built it with one query per part."""
+    game_columns = ", ".join(game.GAME_COLUMNS)
+    card_columns = ", ".join(f"gc.{column}" for column in game.GAME_CARD_COLUMNS)
+    performer_name = "CONCAT(performer.firstname, ' ', LEFT(performer.lastname, 1))"
+
+    cursor.execute(
+        f"SELECT {game_columns} FROM game WHERE deleted = FALSE AND idgame = %s",
+        (idgame,),
+    )
+    game_data = cursor.fetchone()
+
+    cursor.execute(
+        f"""
+        SELECT {card_columns}, (player.external_id = %s) AS mycard
+        FROM game_card gc
+        INNER JOIN appuser player ON gc.player = player.idappuser
+        WHERE gc.deleted = FALSE AND player.deleted = FALSE
+        AND gc.played_time IS NULL AND gc.game = %s AND player.external_id = %s
+        AND gc.skipped = FALSE
+        """,
+        (external_id, idgame, external_id),
+    )
+    cards_to_play = cursor.fetchall()
+
+    cursor.execute(
+        f"""
+        SELECT {card_columns}, (player.external_id = %s) AS mycard, {performer_name}
+        FROM game_card gc
+        INNER JOIN appuser performer ON gc.performer = performer.idappuser
+        LEFT JOIN appuser player ON gc.player = player.idappuser
+        WHERE gc.deleted = FALSE AND performer.deleted = FALSE AND gc.game = %s
+        AND (finished_time IS NOT NULL OR gc.skipped = TRUE)
+        AND (player.external_id = %s OR performer.external_id = %s)
+        """,
+        (external_id, idgame, external_id, external_id),
+    )
+    cards_done = cursor.fetchall()
+
+    cursor.execute(
+        f"""
+        SELECT {card_columns}, (player.external_id = %s) AS mycard, {performer_name}
+        FROM game_card gc
+        LEFT JOIN appuser performer ON gc.performer = performer.idappuser
+        LEFT JOIN appuser player ON gc.player = player.idappuser
+        WHERE gc.deleted = FALSE AND performer.deleted = FALSE
+        AND gc.game = %s AND played_time IS NOT NULL AND finished_time IS NULL
+        AND gc.skipped = FALSE
+        AND (performer.external_id = %s OR player.external_id = %s)
+        """,
+        (external_id, idgame, external_id, external_id),
+    )
+    cards_in_play = cursor.fetchall()
+
+    cursor.execute(
+        """
+        SELECT username, ga.accepted, ga.skips_left,
+        (
+            SELECT COUNT(1) FROM game_card gc
+            WHERE gc.game = %s AND gc.performer = ga.appuser
+        )
+        FROM appuser a
+        INNER JOIN game_appuser ga ON a.idappuser = ga.appuser
+        WHERE a.deleted = FALSE AND ga.deleted = FALSE
+        AND ga.game = %s AND a.external_id != %s
+        """,
+        (idgame, idgame, external_id),
+    )
+    participants = {
+        username: {
+            "name": username,
+            "accepted": accepted,
+            "skips_left": skips_left,
+            "received_cards": received_cards,
+        }
+        for username, accepted, skips_left, received_cards in cursor.fetchall()
+    }
+
+    game_view = Game.from_tuple(game_data + (participants,))
+    game_view.started = all(part["accepted"] for part in participants.values())
+
+    def game_cards(rows):
+        return [GameCard.from_tuple(row) for row in sorted(rows)]
+
+    return jsonable_encoder(
+        {
+            "game": game_view,
+            "cards_in_play": game_cards(cards_in_play),
+            "cards_to_play": game_cards(cards_to_play),
+            "cards_done": game_cards(cards_done),
+        }
+    )
+
+
+@postgres
+def test_snapshot_matches_the_separate_queries(players):
+    idgame = players.create_game(wildcards=1)
+    players.put("/game/accept", 1, game=idgame)
+
+    hands = [players.snapshot(idgame, player)["cards_to_play"] for player in range(3)]
+    # Ann's first card is done, her second skipped and Ben's is in play
+    players.play(0, hands[0][0]["idgame_card"], performer=1)
+    players.put("/game/confirm-card/", 0, idgame_card=hands[0][0]["idgame_card"])
+    players.play(0, hands[0][1]["idgame_card"], performer=2)
+    players.put("/game/skip-card/", 2, idgame_card=hands[0][1]["idgame_card"])
+    players.play(1, hands[1][0]["idgame_card"], performer=0)
+
+    for player in range(3):
+        snapshot = players.snapshot(idgame, player)
+        expected = separate_queries(
+            players.cursor, idgame, players.external_ids[player]
+        )
+        players.cursor.connection.rollback()
+
+        # The version is new to the single statement
+        assert snapshot["game"].pop("version") > expected["game"].pop("version")
+        for field in expected["game"]:
+            assert snapshot["game"][field] == expected["game"][field], field
+        for cards in ["cards_in_play", "cards_to_play", "cards_done"]:
+            assert len(snapshot[cards]) == len(expected[cards]), cards
+            for card, expected_card in zip(snapshot[cards], expected[cards]):
+                for field in expected_card:
+                    assert card[field] == expected_card[field], (cards, field)
+
+    snapshot = players.snapshot(idgame, 0)
+    assert len(snapshot["cards_in_play"]) == len(snapshot["cards_to_play"]) == 1
+    assert len(snapshot["cards_done"]) == 2
+
+
+@postgres
+def test_if_none_match_answers_304_until_the_game_changes(players):
+    idgame = players.create_game()
+    response = players.get(f"/game/{idgame}", 1)
+    etag = response.headers["etag"]
+
+    unchanged = players.client.get(
+        f"/game/{idgame}",
+        params={"external_id": players.external_ids[1]},
+        headers={**players.headers, "if-none-match": etag},
+    )
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+    assert unchanged.headers["etag"] == etag
+
+    players.put("/game/accept", 1, game=idgame)
+    changed = players.client.get(
+        f"/game/{idgame}",
+        params={"external_id": players.external_ids[1]},
+        headers={**players.headers, "if-none-match": etag},
+    )
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert (
+        changed.json()["game"]["participants"]
+        == response.json()["game"]["participants"]
+    )
+
+
+@postgres
+def test_changes_return_the_rows_changed_since_the_cursor(players):
+    idgame = players.create_game()
+    version = players.snapshot(idgame, 0)["game"]["version"]
+    idgame_card = players.snapshot(idgame, 0)["cards_to_play"][0]["idgame_card"]
+
+    players.play(0, idgame_card, performer=1)
+
+    changes = players.get(f"/game/{idgame}/changes", 0, since=version).json()
+    assert changes["cursor"] == version + 1
+    assert not changes["reset"]
+    assert [card["idgame_card"] for card in changes["game_cards"]] == [idgame_card]
+    assert changes["game_cards"][0]["played_time"]
+    assert changes["game_cards"][0]["performer_name"] == "Ben T"
+    assert changes["participants"] == {
+        players.usernames[1]: {
+            "name": players.usernames[1],
+            "accepted": False,
+            "skips_left": 1,
+            "received_cards": 1,
+        }
+    }
+
+    # Cat neither plays nor performs the card, so only Ben's counts change
+    others = players.get(f"/game/{idgame}/changes", 2, since=version).json()
+    assert others["game_cards"] == []
+    assert list(others["participants"]) == [players.usernames[1]]
+
+    latest = players.get(f"/game/{idgame}/changes", 0, since=version + 1).json()
+    assert latest == {
+        "cursor": version + 1,
+        "reset": False,
+        "game_cards": [],
+        "participants": {},
+    }
+    stale = players.get(f"/game/{idgame}/changes", 0, since=version + 5).json()
+    assert stale["reset"]
+
+
+@postgres
+def test_inbox_follows_accept_play_confirm_and_skip(players):
+    idgame = players.create_game()
+
+    def inbox_game(player: int) -> dict:
+        (row,) = [row for row in players.inbox(player) if row["idgame"] == idgame]
+        return row
+
+    def states(player: int) -> list:
+        return [
+            state
+            for state in ["pending", "active", "waiting", "finished"]
+            if idgame in [row["idgame"] for row in players.inbox(player, state=state)]
+        ]
+
+    assert inbox_game(1)["accepted"] is False
+    assert inbox_game(1)["deck"].startswith("Deck ")
+    assert sorted(inbox_game(1)["participants"]) == sorted(
+        [players.usernames[0], players.usernames[2]]
+    )
+    assert states(0) == ["active"]
+    assert states(1) == ["pending"]
+
+    players.put("/game/accept", 1, game=idgame)
+    players.put("/game/accept", 2, game=idgame)
+    assert states(1) == ["active"]
+
+    # deal mode hands out all 6 cards, 2 per player
+    hands = [players.snapshot(idgame, player)["cards_to_play"] for player in range(3)]
+    players.play(0, hands[0][0]["idgame_card"], performer=1)
+    assert inbox_game(1)["card_waiting"] is True
+    assert inbox_game(0)["card_waiting"] is False
+    assert states(1) == ["active", "waiting"]
+
+    players.put("/game/confirm-card/", 0, idgame_card=hands[0][0]["idgame_card"])
+    assert inbox_game(1)["card_waiting"] is False
+
+    played = [card for hand in hands for card in hand][1:]
+    for card in played:
+        player = players.ids.index(card["player"])
+        performer = (player + 1) % 3
+        players.play(player, card["idgame_card"], performer=performer)
+    players.put("/game/skip-card/", 1, idgame_card=played[0]["idgame_card"])
+    for card in played[1:]:
+        players.put(
+            "/game/confirm-card/",
+            players.ids.index(card["player"]),
+            idgame_card=card["idgame_card"],
+        )
+
+    assert [states(player) for player in range(3)] == [["finished"]] * 3
+    players.cursor.execute(
+        "SELECT open_count, waiting_count FROM game_inbox WHERE game = %s",
+        (idgame,),
+    )
+    assert players.cursor.fetchall() == [(0, 0)] * 3
+    players.cursor.connection.rollback()
+
+
+@postgres
+def test_games_pages_follow_the_cursor(players):
+    idgames = [players.create_game() for _ in range(5)]
+    players.put("/game/accept", 1, game=idgames[1])
+
+    pages = []
+    cursor = None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = players.get("/games/", 1, **params).json()
+        pages.append([row["idgame"] for row in page["games"]])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert pages == [idgames[4:2:-1], idgames[2:0:-1], idgames[0:1]]
+    assert [row["idgame"] for row in players.inbox(1, state="pending")] == [
+        idgame for idgame in reversed(idgames) if idgame != idgames[1]
+    ]
+    assert [row["idgame"] for row in players.inbox(1, state="active")] == [idgames[1]]
+    assert players.inbox(1, state="waiting") == []
+
+
+@postgres
+def test_lazy_play_card_deals_the_negative_id(players):
+    idgame = players.create_game(gamemode="all", dealing="lazy", wildcards=1)
+    cards_to_play = players.snapshot(idgame, 1)["cards_to_play"]
+    assert len(cards_to_play) == 7
+    assert all(card["idgame_card"] < 0 for card in cards_to_play)
+    card = cards_to_play[0]
+
+    assert players.play(1, card["idgame_card"], performer=0).status_code == 422
+    response = players.play(1, card["idgame_card"], performer=0, game=idgame)
+    assert response.json() == {"success": True}
+
+    snapshot = players.snapshot(idgame, 1)
+    assert [c["idgame_card"] for c in snapshot["cards_to_play"]] == [
+        c["idgame_card"] for c in cards_to_play[1:]
+    ]
+    (in_play,) = snapshot["cards_in_play"]
+    assert in_play["idgame_card"] > 0
+    assert (in_play["title"], in_play["card"]) == (card["title"], card["card"])
+    assert in_play["performer_name"] == "Ann T"
+
+    # Playing the same undealt id again reuses the row it was dealt
+    players.play(1, card["idgame_card"], performer=2, game=idgame)
+    players.cursor.execute(
+        "SELECT idgame_card, performer FROM game_card WHERE game = %s", (idgame,)
+    )
+    assert players.cursor.fetchall() == [(in_play["idgame_card"], players.ids[2])]
+    players.cursor.connection.rollback()
+
+    assert players.play(1, -100, performer=0, game=idgame).status_code == 404
+    # Other players' hands are dealt on their own
+    other_hand = players.snapshot(idgame, 2)["cards_to_play"]
+    assert len(other_hand) == 7
+    assert all(card["idgame_card"] < 0 for card in other_hand)
@@ -0,0 +1,135 @@
+import asyncio
+
+import httpx
+import pytest
+from app.http_client import CircuitOpenError, DeadlineExceededError, OutboundClient
+from app.passwordless_login import passwordless_api
+from app.passwordless_login.passwordless_bp import AsyncPasswordlessClient
+from fastapi import HTTPException
+from passwordless import PasswordlessError, PasswordlessOptions, VerifySignIn
+
+
+def start(client: OutboundClient, handler):
+    async def started():
+        await client.start()
+        await client._client.aclose()
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    asyncio.run(started())
+
+
+def test_outbound_calls_are_bounded_and_timed():
+    client = OutboundClient(concurrency=2)
+    in_flight = []
+
+    async def handler(request):
+        in_flight.append(client.stats()["in_flight"])
+        await asyncio.sleep(0.01)
+        return httpx.Response(200 if request.url.path == "/ok" else 503)
+
+    start(client, handler)
+
+    async def calls():
+        await asyncio.gather(
+            *(client.request("test", "GET", "http://test/ok") for _ in range(5)),
+            client.request("test", "GET", "http://test/down"),
+        )
+
+    asyncio.run(calls())
+
+    stats = client.stats()["services"]["test"]
+    assert max(in_flight) == 2
+    assert stats["requests"] == 6
+    assert stats["errors"] == 1
+    assert stats["p50_ms"] >= 10
+
+
+def test_passwordless_errors_keep_their_problem_details(monkeypatch):
+    client = OutboundClient()
+    start(
+        client,
+        lambda request: httpx.Response(
+            401,
+            json={"type": "t", "title": "Invalid token", "status": 401},
+            headers={"Content-Type": "application/problem+json"},
+        ),
+    )
+    monkeypatch.setattr("app.http_client.client", client)
+    passwordless = AsyncPasswordlessClient(PasswordlessOptions("secret", "http://pw"))
+
+    with pytest.raises(PasswordlessError) as error:
+        asyncio.run(passwordless.sign_in(VerifySignIn("token")))
+
+    assert error.value.problem_details.title == "Invalid token"
+
+
+def test_login_answers_503_while_passwordless_is_unavailable(monkeypatch):
+    def refused(request):
+        raise httpx.ConnectError("refused")
+
+    async def slow(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    def login_status(handler, breaker_open=False, **options) -> int:
+        client = OutboundClient(**options)
+        start(client, handler)
+        if breaker_open:
+            client.breaker("passwordless").record(failed=True)
+        monkeypatch.setattr("app.http_client.client", client)
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(passwordless_api.login("token"))
+        return error.value.status_code
+
+    assert login_status(refused) == 503
+    assert login_status(lambda request: httpx.Response(502)) == 503
+    assert login_status(slow, deadlines={"passwordless": 0.01}) == 503
+    assert (
+        login_status(
+            lambda request: httpx.Response(200), breaker_open=True, failure_threshold=1
+        )
+        == 503
+    )
+    rejected = httpx.Response(
+        401,
+        json={"type": "t", "title": "Invalid token", "status": 401},
+        headers={"Content-Type": "application/problem+json"},
+    )
+    assert login_status(lambda request: rejected) == 400
+
+
+def test_breaker_fails_fast_while_open_and_recovers(monkeypatch):
+    client = OutboundClient(failure_threshold=2, reset_seconds=60)
+    start(client, lambda request: httpx.Response(503))
+
+    async def call():
+        return await client.request("test", "GET", "http://test/")
+
+    asyncio.run(call())
+    asyncio.run(call())
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(call())
+
+    monkeypatch.setattr("time.monotonic", lambda: 10**9)
+    client._client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200))
+    )
+    asyncio.run(call())
+
+    stats = client.stats()["services"]["test"]
+    assert stats["breaker"] == "closed"
+    assert (stats["breaker_opened"], stats["rejected"]) == (1, 1)
+
+
+def test_slow_calls_hit_the_deadline():
+    client = OutboundClient(deadlines={"test": 0.01})
+
+    async def handler(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    start(client, handler)
+
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(client.request("test", "GET", "http://test/"))
+    assert client.stats()["services"]["test"]["timeouts"] == 1
@@ -0,0 +1,37 @@
+import os
+
+from app import metrics
+from app.histogram import Histogram
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 3.0]:
+        histogram.observe(("GET",), value)
+
+    assert histogram.series() == {("GET",): ([2, 3], 3.65, 4)}
+
+
+def test_metrics_skip_the_api_key(db_connection, test_app, monkeypatch):
+    test_app.get(
+        "/game/12345",
+        params={"external_id": "sample_id"},
+        headers={"x-api-key": os.environ["X_API_KEY"]},
+    )
+
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    assert test_app.get("/metrics").status_code == 404
+
+    monkeypatch.setenv("METRICS_TOKEN", "token")
+    assert test_app.get("/metrics").status_code == 401
+    resp = test_app.get("/metrics", headers={"authorization": "Bearer token"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith(metrics.CONTENT_TYPE)
+    assert 'route="/game/{idgame}"' in resp.text
+    assert "uptome_outbound_in_flight 0" in resp.text
+
+
+def test_worker_stats_are_only_served_as_metrics(db_connection, test_app):
+    headers = {"x-api-key": os.environ["X_API_KEY"]}
+    for path in ["/db/pool", "/notifications/outbox", "/http/outbound"]:
+        assert test_app.get(path, headers=headers).status_code == 404
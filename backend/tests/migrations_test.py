@@ -0,0 +1,74 @@
+from unittest.mock import MagicMock
+
+import pytest
+from app import migrations, query_plans
+
+
+def test_only_pending_migrations_are_applied(tmp_path):
+    (tmp_path / "002_second.sql").write_text("SELECT 2")
+    (tmp_path / "010_tenth.sql").write_text("SELECT 10")
+    (tmp_path / "001_first.sql").write_text("SELECT 1")
+    found = migrations.discover(tmp_path)
+    assert [version for version, _, _ in found] == [1, 2, 10]
+
+    connection = MagicMock()
+    cursor = connection.cursor.return_value
+    cursor.fetchall.return_value = [(1, migrations.checksum("SELECT 1"))]
+
+    assert migrations.migrate(connection, found) == [2, 10]
+    executed = [call.args[0] for call in cursor.execute.call_args_list]
+    assert "SELECT 1" not in executed
+    assert executed.index("SELECT 2") < executed.index("SELECT 10")
+
+    (tmp_path / "02_again.sql").write_text("SELECT 2")
+    with pytest.raises(ValueError):
+        migrations.discover(tmp_path)
+
+
+def test_no_transaction_migrations_run_statement_by_statement():
+    migration_sql = """-- migrate: no-transaction
+-- Built concurrently
+CREATE INDEX CONCURRENTLY IF NOT EXISTS a_idx
+    ON a (b);
+DO $$
+BEGIN
+    CREATE INDEX IF NOT EXISTS c_idx ON c (d);
+END
+$$;
+-- trailing comment
+"""
+    connection = MagicMock()
+    connection.autocommit = False
+    cursor = connection.cursor.return_value
+    cursor.fetchall.return_value = []
+    executed = []
+    cursor.execute.side_effect = lambda query, *args: executed.append(
+        (query.split("\n")[-1], connection.autocommit)
+    )
+
+    assert migrations.migrate(connection, [(8, "indexes", migration_sql)]) == [8]
+    assert [query for query in executed if query[0].startswith(("    ON", "$$"))] == [
+        ("    ON a (b);", True),
+        ("$$;", True),
+    ]
+    # The schema_migration row is still written in a transaction
+    assert [
+        autocommit
+        for query, autocommit in executed
+        if query.startswith("INSERT INTO schema_migration")
+    ] == [False]
+    assert not connection.autocommit
+
+
+def test_seq_scans_are_found_in_subplans():
+    plan = {
+        "Node Type": "Nested Loop",
+        "Plans": [
+            {"Node Type": "Index Scan", "Relation Name": "game"},
+            {
+                "Node Type": "Aggregate",
+                "Plans": [{"Node Type": "Seq Scan", "Relation Name": "game_card"}],
+            },
+        ],
+    }
+    assert query_plans.seq_scans(plan) == ["game_card"]
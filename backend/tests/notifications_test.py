@@ -0,0 +1,141 @@
+import asyncio
+import os
+
+import httpx
+import psycopg2
+import pytest
+from app import db_connection_params, notifications
+from app.helpers import onesignal_helper
+from app.helpers.onesignal_helper import OneSignalError, coalesce_notifications
+from app.http_client import OutboundClient
+
+# Imported before conftest replaces them for the API tests
+send_notification_to_users = onesignal_helper.send_notification_to_users
+connect = psycopg2.connect
+
+postgres = pytest.mark.skipif(
+    not os.environ.get("TEST_POSTGRES"),
+    reason="set TEST_POSTGRES to run against the DB_* database",
+)
+
+
+def test_failed_delivery_is_retried_with_backoff():
+    worker = notifications.OutboxWorker(max_attempts=3)
+
+    idnotification, sent, failed, delay, error, attempted = worker.result(
+        1, 2, OneSignalError("down")
+    )
+
+    assert (sent, failed) == (False, False)
+    assert (
+        notifications.BACKOFF_BASE_SECONDS
+        <= delay
+        <= 2 * notifications.BACKOFF_BASE_SECONDS
+    )
+    assert worker.stats()["retried"] == 1
+
+
+def test_delivery_gives_up_on_permanent_errors_and_last_attempt():
+    worker = notifications.OutboxWorker(max_attempts=3)
+
+    assert worker.result(1, 1, OneSignalError("bad", retryable=False))[1:3] == (
+        False,
+        True,
+    )
+    assert worker.result(1, 3, OneSignalError("down"))[1:3] == (False, True)
+    assert worker.result(1, 1, None)[1:3] == (True, False)
+    assert worker.stats()["sent"] == 1
+
+
+def test_coalesce_merges_messages_per_user_and_batches_users():
+    requests = coalesce_notifications(
+        [
+            (1, ["bob"], "Alice says you're up!"),
+            (2, ["bob"], "Alice says you're up!"),
+            (3, ["carol", "dave"], "Alice wants to play!"),
+            (4, ["dave"], "Erin says you're up!"),
+        ]
+    )
+
+    assert sorted(requests) == [
+        ("Alice says you're up!", ["bob"], [1, 2]),
+        ("Alice wants to play!", ["carol"], [3]),
+        ("Erin says you're up! (+1 more)", ["dave"], [3, 4]),
+    ]
+
+
+def test_breaker_rejections_give_the_attempt_back(monkeypatch):
+    monkeypatch.setenv("ONESIGNAL_API_KEY", "key")
+    monkeypatch.setenv("ONESIGNAL_APP_ID", "app")
+    client = OutboundClient(failure_threshold=1, reset_seconds=60)
+    client._client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200))
+    )
+    monkeypatch.setattr("app.http_client.client", client)
+    monkeypatch.setattr(
+        onesignal_helper, "send_notification_to_users", send_notification_to_users
+    )
+    worker = notifications.OutboxWorker(batch_size=10)
+    breaker = client.breaker("onesignal")
+
+    breaker.record(failed=True)
+    assert worker.claim_limit() == 0
+    monkeypatch.setattr("time.monotonic", lambda: 10**9)
+    assert worker.claim_limit() == 1
+
+    # A trial call is already running, so both are rejected
+    breaker.before_call()
+    recorded = []
+    monkeypatch.setattr(
+        worker, "_claim", lambda limit: [(1, ["bob"], "a", 3), (2, ["carol"], "b", 8)]
+    )
+    monkeypatch.setattr(worker, "_record", recorded.extend)
+    asyncio.run(worker.drain())
+
+    assert [
+        (id, sent, failed, delay, attempted)
+        for id, sent, failed, delay, _, attempted in recorded
+    ] == [
+        (1, False, False, 0, False),
+        (2, False, False, 0, False),
+    ]
+    assert worker.stats()["deferred"] == 2
+
+
+@postgres
+def test_claim_takes_pending_pushes_to_the_same_receivers():
+    connection = connect(**db_connection_params)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM notification_outbox")
+        # Queued 1.5 s apart with a 2 s window: only the first one is due
+        rows = [
+            (["bob"], "Alice says you're up!", 0, -0.1),
+            (["bob", "carol"], "Alice wants to play!", 0, 1.4),
+            (["dave"], "Erin says you're up!", 0, 1.4),
+            (["bob"], "Retried later", 2, 1.4),
+            (["bob"], "Queued after the window", 0, 5),
+        ]
+        ids = []
+        for receivers, message, attempts, due_in in rows:
+            cursor.execute(
+                """
+                INSERT INTO notification_outbox
+                (receivers, message, attempts, next_attempt_time)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                RETURNING idnotification_outbox
+                """,
+                (receivers, message, attempts, due_in),
+            )
+            ids.append(cursor.fetchone()[0])
+
+        claimed = notifications.claim(cursor, limit=10, coalesce_seconds=2)
+
+        assert [row[0] for row in claimed] == ids[:2]
+        assert coalesce_notifications(row[:3] for row in claimed) == [
+            ("Alice wants to play! (+1 more)", ["bob"], ids[:2]),
+            ("Alice wants to play!", ["carol"], [ids[1]]),
+        ]
+    finally:
+        connection.rollback()
+        connection.close()
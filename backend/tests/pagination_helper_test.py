@@ -0,0 +1,29 @@
+from datetime import datetime
+
+import pytest
+from app.helpers import pagination_helper
+from fastapi import HTTPException
+
+
+def test_cursor_round_trip():
+    createdtime = datetime(2024, 1, 2, 3, 4, 5, 678)
+    cursor = pagination_helper.encode_cursor(createdtime, 42)
+
+    assert pagination_helper.decode_cursor(cursor) == (createdtime, 42)
+
+
+def test_invalid_cursor_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        pagination_helper.decode_cursor("not-a-cursor")
+
+    assert error.value.status_code == 422
+
+
+def test_next_cursor_trims_the_lookahead_row():
+    rows = [(datetime(2024, 1, day), day) for day in (3, 2, 1)]
+
+    cursor = pagination_helper.next_cursor(rows, 2, 0, 1)
+
+    assert rows == [(datetime(2024, 1, 3), 3), (datetime(2024, 1, 2), 2)]
+    assert pagination_helper.decode_cursor(cursor) == (datetime(2024, 1, 2), 2)
+    assert pagination_helper.next_cursor(rows, 2, 0, 1) is None
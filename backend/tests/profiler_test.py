@@ -0,0 +1,59 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from app import profiler
+from app.helpers import stream_helper
+
+
+def test_profiles_keep_the_threads_running_app_code():
+    sampler = profiler.SamplingProfiler(interval_seconds=0.001)
+    sampler.start()
+    for _ in range(2000):
+        stream_helper.format_rows([("title", "description")] * 10, ["a", "b"], "csv")
+    sampler.stop()
+
+    profile = sampler.speedscope("test")
+    assert len(profile["profiles"]) == 1
+    names = {frame["name"] for frame in profile["shared"]["frames"]}
+    assert "format_rows" in names
+    json.dumps(profile)
+
+    assert "format_rows (stream_helper.py:" in sampler.collapsed()
+
+
+def test_profiling_needs_an_admin(db_connection, test_app):
+    resp = test_app.get(
+        "/cards/",
+        headers={"x-api-key": os.environ["X_API_KEY"], "x-profile": "speedscope"},
+    )
+    assert resp.status_code == 403
+    assert "x-profile-file" not in resp.headers
+
+    assert profiler.profile_path("../api.py") is None
+
+
+def test_profiles_are_written_off_the_event_loop(
+    db_connection, test_app, monkeypatch, tmp_path
+):
+    monkeypatch.setitem(profiler.profiling_params, "directory", str(tmp_path))
+    monkeypatch.setattr(profiler, "is_admin", lambda headers: True)
+    save = profiler.save
+    saved = []
+
+    def save_outside_the_loop(*args):
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()
+        saved.append(args[2])
+        save(*args)
+
+    monkeypatch.setattr(profiler, "save", save_outside_the_loop)
+    resp = test_app.get(
+        "/cards/",
+        headers={"x-api-key": os.environ["X_API_KEY"], "x-profile": "collapsed"},
+    )
+
+    assert saved == [resp.headers["x-profile-file"]]
+    assert profiler.profile_path(saved[0]) == str(tmp_path / saved[0])
@@ -0,0 +1,52 @@
+import os
+import time
+
+from app import query_stats
+
+
+def test_repeated_statement_shapes_are_counted():
+    queries = query_stats.RequestQueries()
+    for idgame in range(7):
+        queries.record(f"SELECT * FROM game_card\n  WHERE game = {idgame}", 0.001)
+    queries.record("SELECT title FROM deck WHERE title = 'It''s'", 0.01)
+    for _ in range(7):
+        queries.record("INSERT INTO card (title) VALUES ('a'),('b')", 0.0)
+    # Pages of one execute_values call
+    batch = set()
+    for _ in range(7):
+        queries.record("INSERT INTO card_deck (card) VALUES (1),(2)", 0.0, batch)
+
+    assert queries.statements == 22
+    assert queries.slowest == (0.01, "SELECT title FROM deck WHERE title = ?")
+    assert queries.repeated(5) == {
+        "SELECT * FROM game_card WHERE game = ?": 7,
+        "INSERT INTO card (title) VALUES (?),(?)": 7,
+    }
+    assert queries.server_timing() == (
+        'db;dur=17.0;desc="statements: 22", db-slowest;dur=10.0'
+    )
+
+
+def test_execute_values_calls_count_once_per_call(monkeypatch):
+    def execute_values(cursor, query, argslist, page_size=100):
+        for _ in range(0, len(argslist), page_size):
+            query_stats.InstrumentedCursor._record(cursor, query, time.perf_counter())
+
+    monkeypatch.setattr(query_stats.extras, "execute_values", execute_values)
+    queries = query_stats.RequestQueries()
+    token = query_stats.current.set(queries)
+    try:
+        query_stats.execute_values(None, "INSERT INTO card VALUES %s", [()] * 700)
+        for _ in range(6):
+            query_stats.execute_values(None, "INSERT INTO deck VALUES %s", [()])
+    finally:
+        query_stats.current.reset(token)
+
+    assert queries.statements == 13
+    assert queries.repeated(5) == {"INSERT INTO deck VALUES %s": 6}
+
+
+def test_responses_have_a_server_timing_header(db_connection, test_app):
+    resp = test_app.get("/cards/", headers={"x-api-key": os.environ["X_API_KEY"]})
+    assert resp.status_code == 200
+    assert resp.headers["server-timing"].startswith("db;dur=")
@@ -0,0 +1,31 @@
+import csv
+import io
+import json
+
+import anyio
+from anyio.to_thread import run_sync
+from app.helpers import stream_helper
+
+
+def test_stream_reader_reads_across_chunks():
+    async def body():
+        for chunk in [b"title,desc", b"ription\n", b"a,b\n"]:
+            yield chunk
+
+    async def read_all():
+        reader = stream_helper.StreamReader(body())
+        return await run_sync(lambda: [reader.read(4), reader.read(-1), reader.read(4)])
+
+    assert anyio.run(read_all) == [b"titl", b"e,description\na,b\n", b""]
+
+
+def test_format_rows():
+    rows = [("Title", 'With "quotes", commas\nand lines'), ("Åsa", "")]
+    columns = ["title", "description"]
+
+    csv_rows = csv.reader(io.StringIO(stream_helper.format_rows(rows, columns, "csv")))
+    assert list(csv_rows) == [list(row) for row in rows]
+    ndjson = stream_helper.format_rows(rows, columns, "ndjson").splitlines()
+    assert [json.loads(line) for line in ndjson] == [
+        dict(zip(columns, row)) for row in rows
+    ]
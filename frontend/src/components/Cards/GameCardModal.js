@@ -57,6 +57,7 @@ export default function GameCardModal({
       let body = {
         external_id: userId,
         idgame_card: card.idgame_card,
+        game: card.game,
         performers:
           Object.keys(participants).length === 1
             ? Object.keys(participants)
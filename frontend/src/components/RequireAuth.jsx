@@ -4,7 +4,12 @@ import { jwtDecode } from "jwt-decode";
 function getJwt() {
   const jwt = localStorage.getItem("jwt");
   if (jwt) {
-    return jwtDecode(jwt);
+    const decoded = jwtDecode(jwt);
+    if (!decoded.exp || decoded.exp * 1000 < Date.now()) {
+      localStorage.removeItem("jwt");
+      return false;
+    }
+    return decoded;
   }
 
   return false;
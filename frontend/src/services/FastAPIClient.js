@@ -1,6 +1,13 @@
 const BACKEND_URL = process.env.REACT_APP_API_URL;
 const X_API_KEY = process.env.REACT_APP_API_KEY;
 
+function authHeaders() {
+  const jwt = localStorage.getItem("jwt");
+  return jwt
+    ? { "x-api-key": X_API_KEY, Authorization: `Bearer ${jwt}` }
+    : { "x-api-key": X_API_KEY };
+}
+
 export default class FastApiClient {
   async register(username, email, firstName, lastName) {
     const request = {
@@ -48,9 +55,7 @@ export default class FastApiClient {
     try {
       const response = await fetch(`${BACKEND_URL}${url}`, {
         method: "get",
-        headers: {
-          "x-api-key": X_API_KEY,
-        },
+        headers: authHeaders(),
       });
 
       if (response.ok) {
@@ -75,7 +80,7 @@ export default class FastApiClient {
         headers: {
           Accept: "application/json",
           "Content-Type": "application/json",
-          "x-api-key": X_API_KEY,
+          ...authHeaders(),
         },
       });
 
@@ -100,7 +105,7 @@ export default class FastApiClient {
         headers: {
           Accept: "application/json",
           "Content-Type": "application/json",
-          "x-api-key": X_API_KEY,
+          ...authHeaders(),
         },
       });
 
@@ -121,9 +126,7 @@ export default class FastApiClient {
     try {
       const response = await fetch(`${BACKEND_URL}${url}`, {
         method: "delete",
-        headers: {
-          "x-api-key": X_API_KEY,
-        },
+        headers: authHeaders(),
       });
 
       if (response.ok) {